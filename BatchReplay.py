@@ -0,0 +1,296 @@
+import argparse
+import json
+import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from BuildCache import BuildCache
+from Builder import Builder, copyable, repeated_types, _init_worker, _init_shared_worker, _build_batch_in_worker
+from BuildServer import build_response, open_database
+from Client import Client
+from Manufacturer import Manufacturer
+from SharedCatalog import SharedCatalog
+
+# operations process mode workers catch up with before they are restarted with a fresh copy
+MAX_DELTAS = 64
+
+'''
+Headless replay of JSON lines requests through the database, e.g.
+
+    python BatchReplay.py nightly.jsonl --output results.jsonl --workers 4
+
+Every line is a build, either the list Client.save_components_to_json writes or
+{"id": ..., "components": [...]}, or a manufacturer operation:
+
+    {"id": ..., "op": "add", "component": {...}, "compatible": [{...}, ...], "symmetric": false}
+    {"id": ..., "op": "update", "component": {...}, "compatible": {...}}
+
+One result line is written per request, in input order; requests without an id
+get their line number. Builds between two operations are validated in batches
+on the workers, an operation waits for the builds before it and is applied alone.
+In process mode the workers replay the operations on their copy of the database
+and are only restarted after MAX_DELTAS of them. In shared mode the worker
+processes map the catalog from shared memory and switch to a new generation
+after an operation instead of being restarted.
+Input and output are streamed, only the batches in flight are held in memory.
+'''
+
+
+def decode(line: str, number: int) -> tuple:
+    """
+    decodes one request line, components are rebuilt with Client.recreate_from_json
+    :param line: JSON text
+    :param number: line number, the id of requests that do not carry one
+    :return: (request id, 'build', component set), (request id, op, request dict) or (request id, 'error', message)
+    """
+    request_id = number
+    try:
+        request = json.loads(line)
+        if isinstance(request, dict):
+            request_id = request.get('id', number)
+            op = request.get('op', 'build')
+            if op == 'build':
+                return request_id, 'build', {Client.recreate_from_json(data) for data in request['components']}
+            if op not in ('add', 'update'):
+                return request_id, 'error', 'unknown op: ' + str(op)
+            return request_id, op, request
+        return request_id, 'build', {Client.recreate_from_json(data) for data in request}
+    except (ValueError, KeyError, LookupError, TypeError) as err:
+        return request_id, 'error', repr(err)
+
+
+class BatchReplay:
+
+    def __init__(self, database, workers: int = 1, mode: str = "thread", batch_size: int = 256, cache=None):
+        """
+        init function
+        :param database: database to replay against
+        :param workers: builds are validated on this many threads or processes, 1 validates inline
+        :param mode: "thread", "process" or "shared"
+        :param batch_size: builds per Builder.build_batch call
+        :param cache: optional BuildCache, used in thread mode and inline
+        """
+        if mode not in ("thread", "process", "shared"):
+            raise ValueError("mode must be 'thread', 'process' or 'shared'")
+        if mode != "thread" and workers > 1 and getattr(database, 'backend', None) is not None:
+            # worker processes get a copy of the in-memory store, a backend is shared by threads instead
+            raise ValueError("process mode needs an in-memory database, use thread mode with a backend")
+        if mode != "thread" and workers > 1 and not copyable(database):
+            raise ValueError(mode + " mode needs a CompatibilityDatabase, use thread mode")
+        self._database = database
+        self.workers = workers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.cache = cache
+        self._executor = None
+        # database version the worker processes were started with, or last published in shared mode
+        self._pool_version = None
+        self._shared = None
+        # in process mode, operations applied since the workers were started, see _apply_deltas
+        self._deltas = []
+
+        self.counts = {'requests': 0, 'builds': 0, 'succeeded': 0, 'failed': 0, 'operations': 0, 'errors': 0}
+
+    def run(self, lines, output) -> dict:
+        """
+        replays requests and writes one JSON result line per request
+        :param lines: iterable of request lines, e.g. an open file
+        :param output: file-like object the results are written to
+        :return: counts of requests, builds, succeeded, failed, operations and errors
+        """
+        window = 2 * max(1, self.workers)
+        pending = deque()
+        batch = []
+        try:
+            for (number, line) in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                (request_id, kind, payload) = decode(line, number)
+                self.counts['requests'] += 1
+                if kind in ('build', 'error'):
+                    batch.append((request_id, kind, payload))
+                    if len(batch) >= self.batch_size:
+                        pending.append(self._submit(batch))
+                        batch = []
+                else:
+                    # an operation sees every build before it finished and none after it started
+                    if batch:
+                        pending.append(self._submit(batch))
+                        batch = []
+                    while pending:
+                        self._write(pending.popleft(), output)
+                    output.write(json.dumps(self._apply(request_id, kind, payload)) + '\n')
+                while len(pending) > window:
+                    self._write(pending.popleft(), output)
+
+            if batch:
+                pending.append(self._submit(batch))
+            while pending:
+                self._write(pending.popleft(), output)
+        finally:
+            self.close()
+        output.flush()
+        return self.counts
+
+    def close(self):
+        """
+        shuts the worker pool down and unlinks the shared catalog
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._deltas = []
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def _pool(self):
+        """
+        :return: executor for build batches, None when validating inline.
+            Worker processes hold a copy of the database and catch up with the operations of this replay,
+            they are restarted after any other change or too many operations.
+            In shared mode a new generation is published instead, workers switch to it on their next batch.
+        """
+        if self.workers <= 1:
+            return None
+        if self.mode == "process" and self._executor is not None and self._pool_version != self._database.version:
+            self.close()
+        if self.mode == "shared" and self._shared is not None and self._pool_version != self._database.version:
+            self._shared.publish(self._database)
+            self._pool_version = self._database.version
+        if self._executor is None:
+            if self.mode == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            elif self.mode == "shared":
+                self._shared = SharedCatalog()
+                self._shared.publish(self._database)
+                self._pool_version = self._database.version
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_shared_worker,
+                                                     initargs=(self._shared.prefix,))
+            else:
+                database = self._database
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     initargs=(database.inventory, database.dependencies,
+                                                               database.engine, database.undirected,
+                                                               database.rules, database.uuids))
+                self._pool_version = database.version
+        return self._executor
+
+    def _submit(self, batch: list) -> tuple:
+        """
+        starts validating a batch of builds
+        :param batch: list of (request id, 'build' or 'error', component set or message)
+        :return: (batch, future of the build_batch results of its valid builds)
+        """
+        inventory = self._database.inventory
+        entries = []
+        for (request_id, kind, payload) in batch:
+            if kind == 'build':
+                missing = [comp.name for comp in payload if comp not in inventory]
+                repeated = repeated_types(payload)
+                if missing:
+                    (kind, payload) = ('error', 'not in inventory: ' + ', '.join(missing))
+                elif repeated:
+                    (kind, payload) = ('error', 'more than one of type: ' + ', '.join(repeated))
+            entries.append((request_id, kind, payload))
+        component_sets = [payload for (_, kind, payload) in entries if kind == 'build']
+
+        executor = self._pool()
+        if executor is None:
+            future = Future()
+            future.set_result(Builder('replay', self._database, self.cache).build_batch(component_sets))
+        elif self.mode == "thread":
+            future = executor.submit(Builder('replay', self._database, self.cache).build_batch, component_sets)
+        else:
+            future = executor.submit(_build_batch_in_worker, 'replay', component_sets, tuple(self._deltas))
+        return entries, future
+
+    def _write(self, item: tuple, output):
+        """
+        writes the results of a submitted batch in input order
+        :param item: (batch, future) as returned by _submit
+        :param output: file-like object
+        """
+        (entries, future) = item
+        results = iter(future.result())
+        for (request_id, kind, payload) in entries:
+            if kind == 'error':
+                self.counts['errors'] += 1
+                response = {'id': request_id, 'error': payload}
+            else:
+                (ok, conflicts, suggestions) = next(results)
+                self.counts['builds'] += 1
+                self.counts['succeeded' if ok else 'failed'] += 1
+                response = build_response(request_id, ok, conflicts, suggestions)
+            output.write(json.dumps(response) + '\n')
+
+    def _apply(self, request_id, op: str, request: dict) -> dict:
+        """
+        applies a manufacturer operation
+        :param request_id: id of the request
+        :param op: 'add' or 'update'
+        :param request: decoded request line
+        :return: response dict
+        """
+        version = self._database.version
+        try:
+            component = Client.recreate_from_json(request['component'])
+            manufacturer = Manufacturer(component.manufacturer, self._database)
+            if op == 'add':
+                compatible = [Client.recreate_from_json(data) for data in request.get('compatible', [])]
+                missing = [comp.name for comp in compatible if comp not in self._database.inventory]
+                if missing:
+                    raise KeyError('not in inventory: ' + ', '.join(missing))
+                symmetric = request.get('symmetric', False)
+                manufacturer.send_many([(component, compatible)], symmetric=symmetric)
+                delta = ('add', component, compatible, symmetric)
+            else:
+                other = Client.recreate_from_json(request['compatible'])
+                manufacturer.update_compatibility(component, other)
+                delta = ('update', component, other)
+        except (ValueError, KeyError, LookupError, TypeError) as err:
+            self.counts['errors'] += 1
+            return {'id': request_id, 'op': op, 'error': repr(err)}
+        self.counts['operations'] += 1
+        if self.mode == "process" and self._executor is not None and self._pool_version == version \
+                and len(self._deltas) < MAX_DELTAS:
+            # the workers were in step before this operation, they replay it instead of being restarted
+            self._deltas.append(delta)
+            self._pool_version = self._database.version
+        return {'id': request_id, 'op': op, 'ok': True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay JSON lines build and manufacturer requests')
+    parser.add_argument('input', help='JSON lines request file, - for stdin')
+    parser.add_argument('--output', default='-', help='JSON lines result file, - for stdout')
+    parser.add_argument('--inventory', default='inventory.pkl')
+    parser.add_argument('--dependency', default='dependency.pkl')
+    parser.add_argument('--default', action='store_true', help='start from the example catalog')
+    parser.add_argument('--sqlite', help='serve from this SQLite file instead of the pickled files')
+    parser.add_argument('--compact', action='store_true', help='keep compatibility rows compressed in memory')
+    parser.add_argument('--engine', choices=['bitset', 'none'], default='bitset',
+                        help='storage engine validating build batches in memory')
+    parser.add_argument('--workers', type=int, default=1, help='threads or processes validating builds')
+    parser.add_argument('--mode', choices=['thread', 'process', 'shared'], default='thread')
+    parser.add_argument('--batch', type=int, default=256, help='builds per validation batch')
+    parser.add_argument('--cache', type=int, default=10000, help='build results to cache, 0 disables the cache')
+    args = parser.parse_args()
+    database = open_database(args)
+
+    replay = BatchReplay(database, workers=args.workers, mode=args.mode, batch_size=args.batch,
+                         cache=BuildCache(database, args.cache) if args.cache > 0 else None)
+    f_in = sys.stdin if args.input == '-' else open(args.input, "r")
+    f_out = sys.stdout if args.output == '-' else open(args.output, "w")
+    try:
+        counts = replay.run(f_in, f_out)
+    finally:
+        if f_in is not sys.stdin:
+            f_in.close()
+        if f_out is not sys.stdout:
+            f_out.close()
+        database.close()
+    print(json.dumps(counts), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, CompatibilityDatabase falls back to the dict store without it
+    np = None
+
+
+class BitsetEngine:
+    """
+    Dense compatibility storage engine.
+    Every component ID gets an integer index and its compatibility set is
+    kept as a packed row of bits in a numpy uint8 matrix. A single check is
+    one bit test and "compatible with all of these" is one row AND.
+    """
+
+    def __init__(self, capacity: int = 64):
+        """
+        init function
+        :param capacity: initial number of rows/columns to allocate
+        """
+        if np is None:
+            raise ImportError('BitsetEngine requires numpy')
+
+        # component ID -> dense index, and the reverse list
+        self.index = dict()
+        self.ids = list()
+
+        self.rows = self._allocate(capacity)
+
+    @staticmethod
+    def _allocate(capacity: int):
+        """
+        allocates an empty bit matrix
+        :param capacity: number of rows/columns, rounded up to a multiple of 8
+        :return: zeroed uint8 matrix of shape (capacity, capacity / 8)
+        """
+        capacity = max(8, (capacity + 7) // 8 * 8)
+        return np.zeros((capacity, capacity // 8), dtype=np.uint8)
+
+    def _grow(self, needed: int):
+        """
+        doubles the matrix until it can hold the needed number of components
+        :param needed: number of components to fit
+        """
+        capacity = self.rows.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        rows = self._allocate(capacity)
+        rows[:self.rows.shape[0], :self.rows.shape[1]] = self.rows
+        self.rows = rows
+
+    def _slot(self, comp_id: int) -> int:
+        """
+        returns the dense index of a component ID, assigning one if needed
+        :param comp_id: component ID
+        :return: dense index
+        """
+        idx = self.index.get(comp_id)
+        if idx is None:
+            idx = len(self.ids)
+            self._grow(idx + 1)
+            self.index[comp_id] = idx
+            self.ids.append(comp_id)
+        return idx
+
+    def _indices(self, comp_ids) -> 'np.ndarray':
+        """
+        returns dense indices for already known component IDs
+        :param comp_ids: iterable of component IDs
+        :return: int64 array of indices
+        """
+        return np.fromiter((self.index[comp_id] for comp_id in comp_ids), dtype=np.int64)
+
+    def _set_bits(self, row: int, cols):
+        """
+        sets the given column bits in a row
+        :param row: row index
+        :param cols: array of column indices
+        """
+        cols = np.asarray(cols, dtype=np.int64)
+        if cols.size:
+            np.bitwise_or.at(self.rows[row], cols >> 3, np.left_shift(1, cols & 7).astype(np.uint8))
+
+    def load(self, dependencies: dict):
+        """
+        rebuilds the matrix from a dependencies dictionary
+        :param dependencies: dict mapping component ID to its set of compatible IDs
+        :return: None
+        """
+        self.index = dict()
+        self.ids = list()
+        for (comp_id, compatible) in dependencies.items():
+            self.index.setdefault(comp_id, len(self.index))
+            for other in compatible:
+                self.index.setdefault(other, len(self.index))
+        self.ids = list(self.index)
+        self.rows = self._allocate(len(self.ids))
+
+        for (comp_id, compatible) in dependencies.items():
+            self._set_bits(self.index[comp_id], self._indices(compatible))
+
+    def add_component(self, comp_id: int, compatibility_set: set):
+        """
+        adds (or replaces) a component row
+        :param comp_id: ID of the new component
+        :param compatibility_set: IDs the component is compatible with
+        :return: None
+        """
+        row = self._slot(comp_id)
+        cols = [self._slot(other) for other in compatibility_set]
+        self.rows[row] = 0
+        self._set_bits(row, cols)
+
+    def add_edge(self, comp_id: int, other_id: int):
+        """
+        marks other_id as compatible in the row of comp_id
+        :param comp_id: component to update
+        :param other_id: compatible component
+        :return: None
+        """
+        row = self._slot(comp_id)
+        col = self._slot(other_id)
+        self.rows[row, col >> 3] |= np.uint8(1 << (col & 7))
+
+    def add_edges(self, additions: dict):
+        """
+        sets many bits, one scatter per row
+        :param additions: dict mapping component ID to the IDs to mark compatible in its row
+        :return: None
+        """
+        for (comp_id, compatible) in additions.items():
+            row = self._slot(comp_id)
+            self._set_bits(row, [self._slot(other) for other in compatible])
+
+    def compatible(self, comp_id: int, other_id: int) -> bool:
+        """
+        single bit test
+        :param comp_id: first component ID
+        :param other_id: second component ID
+        :return: True if other_id is in the compatibility row of comp_id
+        """
+        row = self.index.get(comp_id)
+        col = self.index.get(other_id)
+        if row is None or col is None:
+            return False
+        return bool((self.rows[row, col >> 3] >> (col & 7)) & 1)
+
+    def compatible_pairs(self, comp_ids, other_ids):
+        """
+        many bit tests in one gather
+        :param comp_ids: sequence of first component IDs
+        :param other_ids: sequence of second component IDs, same length
+        :return: boolean array, True where other_ids[n] is in the row of comp_ids[n]
+        """
+        rows = self._indices(comp_ids)
+        cols = self._indices(other_ids)
+        return ((self.rows[rows, cols >> 3] >> (cols & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def row_and(self, comp_ids):
+        """
+        intersects the compatibility rows of the given components
+        :param comp_ids: iterable of component IDs
+        :return: packed row of IDs every given component is compatible with
+        """
+        idx = self._indices(comp_ids)
+        if idx.size == 0:
+            return np.full(self.rows.shape[1], 0xFF, dtype=np.uint8)
+        return np.bitwise_and.reduce(self.rows[idx], axis=0)
+
+    def members(self, packed_row) -> set:
+        """
+        decodes a packed row into component IDs
+        :param packed_row: packed row as returned by row_and
+        :return: set of component IDs whose bit is set
+        """
+        bits = np.unpackbits(packed_row, bitorder='little')[:len(self.ids)]
+        return {self.ids[i] for i in np.flatnonzero(bits)}
+
+    def common_compatible(self, comp_ids) -> set:
+        """
+        IDs that every given component is compatible with
+        :param comp_ids: iterable of component IDs
+        :return: set of component IDs
+        """
+        return self.members(self.row_and(comp_ids))
+
+    def compatible_with_all(self, comp_id: int, other_ids) -> bool:
+        """
+        checks a component against many others with one masked comparison
+        :param comp_id: component ID to check
+        :param other_ids: IDs it has to be compatible with
+        :return: True if comp_id is compatible with every one of other_ids
+        """
+        if comp_id not in self.index:
+            return False
+        if any(other not in self.index for other in other_ids):
+            return False
+        cols = self._indices(other_ids)
+        mask = np.zeros(self.rows.shape[1], dtype=np.uint8)
+        if cols.size:
+            np.bitwise_or.at(mask, cols >> 3, np.left_shift(1, cols & 7).astype(np.uint8))
+        row = self.rows[self.index[comp_id]]
+        return bool(np.array_equal(row & mask, mask))
+
+    def submatrix(self, comp_ids: list):
+        """
+        gathers the pairwise compatibility among the given components
+        :param comp_ids: list of component IDs
+        :return: k x k boolean array, [a, b] True if comp_ids[b] is in the row of comp_ids[a]
+        """
+        idx = self._indices(comp_ids)
+        block = self.rows[idx[:, None], (idx >> 3)[None, :]]
+        return ((block >> (idx & 7).astype(np.uint8)[None, :]) & 1).astype(bool)
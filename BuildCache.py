@@ -0,0 +1,128 @@
+import weakref
+from collections import OrderedDict
+from threading import Lock
+from Metrics import metrics
+
+'''
+Build result cache shared by Builders
+'''
+
+
+class BuildCache:
+    """
+    LRU cache of build results keyed by the frozenset of component IDs of a build.
+    Every entry carries a stamp: the database generation and the version of each
+    of its components and of the replacements it suggests, whose rows the ranking
+    reads. CompatibilityDatabase bumps the version of both ends of every edge it
+    adds, so an entry goes stale exactly when a row it was computed from changed,
+    and changes elsewhere in the catalog leave it alone.
+    """
+
+    def __init__(self, database, max_entries: int = 10000):
+        """
+        init function
+        :param database: database the cached builds were validated against
+        :param max_entries: entries kept before the least recently used one is evicted
+        """
+        self._database = database
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # misses caused by an entry whose components changed since it was stored
+        self.invalidations = 0
+
+        me = weakref.ref(self)
+        metrics.gauge('build_cache', lambda: me().stats() if me() is not None else None)
+
+    def key(self, component_set) -> frozenset:
+        """
+        canonical key of a build
+        :param component_set: components in the inventory
+        :return: frozenset of component IDs
+        """
+        return frozenset(self._database.cid(comp) for comp in component_set)
+
+    def stamp(self, key: frozenset) -> tuple:
+        """
+        current versions of the components of a build. Take it before validating,
+        a change made while the build runs then makes the stored result stale.
+        :param key: build key
+        :return: (database generation, versions in ID order, database version)
+        """
+        database = self._database
+        version = database.version
+        versions = database.component_versions
+        return database.generation, tuple(versions.get(comp_id, 0) for comp_id in sorted(key)), version
+
+    def _current(self, replacements: tuple) -> bool:
+        """
+        :param replacements: (ID, version) of every suggested replacement of an entry
+        :return: True if none of them changed since
+        """
+        versions = self._database.component_versions
+        return all(versions.get(comp_id, 0) == version for (comp_id, version) in replacements)
+
+    def get(self, key: frozenset, stamp: tuple):
+        """
+        looks a build up
+        :param key: build key
+        :param stamp: current stamp of the build
+        :return: cached (ok, conflicts, suggestions, repairs), None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp[:2] and self._current(entry[2]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if metrics.enabled:
+                    metrics.incr('cache.hits')
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self.invalidations += 1
+            self.misses += 1
+            if metrics.enabled:
+                metrics.incr('cache.misses')
+            return None
+
+    def put(self, key: frozenset, stamp: tuple, result: tuple):
+        """
+        stores a build result, evicting the least recently used entries over max_entries
+        :param key: build key
+        :param stamp: stamp taken before the build was validated
+        :param result: (ok, conflicts, suggestions, repairs)
+        :return: None
+        """
+        database = self._database
+        replacements = sorted({database.cid(comp) for candidates in result[2].values() for comp in candidates})
+        if replacements and database.version != stamp[2]:
+            # the catalog changed during the build, the replacement rows it ranked by may be older than now
+            return
+        versions = database.component_versions
+        replacements = tuple((comp_id, versions.get(comp_id, 0)) for comp_id in replacements)
+        with self._lock:
+            self._entries[key] = (stamp[:2], result, replacements)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        drops all entries, statistics are kept
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: dict with entries, hits, misses, evictions, invalidations and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else None}
@@ -0,0 +1,261 @@
+import json
+import os
+import weakref
+from collections import deque
+from queue import Queue, Full
+from threading import Thread, Event, Lock
+from Builder import Builder
+from Metrics import metrics
+
+'''
+Registry of saved builds kept valid as the catalog changes
+'''
+
+
+class BuildRegistry:
+    """
+    Saved builds, each stored as the sorted tuple of its component IDs, with a
+    reverse index from component ID to the builds containing it.
+    The registry listens to the database: a row change queues the builds of
+    that component, and a revalidation pass (in the background after start, or
+    on demand with revalidate) checks only those. Every build whose verdict
+    flips goes out on the change feed, as a numbered event kept in a bounded
+    history (changes) and put on the queue of every subscriber.
+    """
+
+    def __init__(self, database, history: int = 10000):
+        """
+        init function
+        :param database: database the builds are validated against
+        :param history: change events kept for changes(since)
+        """
+        self._database = database
+        self._lock = Lock()
+
+        # build ID -> sorted tuple of component IDs, and the reverse mapping
+        self.builds = dict()
+        self._by_key = dict()
+        # build ID -> True if it has no conflicts
+        self.verdicts = dict()
+        # component ID -> set of IDs of the builds containing it
+        self.by_component = dict()
+        self._next_id = 0
+
+        # component IDs whose rows changed since the last pass, None for all
+        self._pending = set()
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+
+        self.sequence = 0
+        self.history = deque(maxlen=history)
+        self._subscribers = []
+        self.revalidated = 0
+
+        # held weakly so a dropped registry does not keep receiving changes
+        me = weakref.ref(self)
+
+        def listener(comp_ids):
+            registry = me()
+            if registry is not None:
+                registry._changed(comp_ids)
+        self._listener = listener
+        database.listeners.append(listener)
+
+    def __len__(self):
+        return len(self.builds)
+
+    def _changed(self, comp_ids):
+        """
+        database listener, queues the builds of changed rows. Runs under the database lock, so it only records
+        :param comp_ids: IDs whose rows changed, None when the whole store was replaced
+        """
+        with self._lock:
+            if comp_ids is None or self._pending is None:
+                self._pending = None
+            else:
+                self._pending.update(comp_id for comp_id in comp_ids if comp_id in self.by_component)
+            if self._pending is None or self._pending:
+                self._wake.set()
+
+    def register(self, component_set, build_id=None):
+        """
+        saves a build and validates it. Saving the same components again returns the existing ID
+        :param component_set: components in the inventory
+        :param build_id: ID to save it under, the next number if None
+        :return: build ID
+        """
+        key = tuple(sorted(self._database.cid(comp) for comp in component_set))
+        with self._lock:
+            if key in self._by_key:
+                return self._by_key[key]
+            if build_id is None:
+                while self._next_id in self.builds:
+                    self._next_id += 1
+                build_id = self._next_id
+            elif build_id in self.builds:
+                raise KeyError('Build ' + str(build_id) + ' already registered')
+            self.builds[build_id] = key
+            self._by_key[key] = build_id
+            for comp_id in key:
+                self.by_component.setdefault(comp_id, set()).add(build_id)
+        self.verdicts[build_id] = len(self._conflicts(key)) == 0
+        return build_id
+
+    def remove(self, build_id):
+        """
+        forgets a build
+        :param build_id: ID returned by register
+        """
+        with self._lock:
+            key = self.builds.pop(build_id)
+            del self._by_key[key]
+            self.verdicts.pop(build_id, None)
+            for comp_id in key:
+                self.by_component[comp_id].discard(build_id)
+                if len(self.by_component[comp_id]) == 0:
+                    del self.by_component[comp_id]
+
+    def components(self, build_id) -> set:
+        """
+        :return: set of the components of a build
+        """
+        return {self._database.component_from_id(comp_id) for comp_id in self.builds[build_id]}
+
+    def _conflicts(self, key: tuple) -> list:
+        """
+        :return: conflict pairs of a build, without suggestions
+        """
+        builder = Builder('registry', self._database)
+        builder.check_conflict({self._database.component_from_id(comp_id) for comp_id in key})
+        return builder.conflicts
+
+    def revalidate(self) -> int:
+        """
+        checks the builds queued by row changes and publishes the verdicts that flipped
+        :return: number of builds checked
+        """
+        with self._lock:
+            (pending, self._pending) = (self._pending, set())
+            self._wake.clear()
+            if pending is None:
+                affected = list(self.builds)
+            else:
+                affected = set()
+                for comp_id in pending:
+                    affected.update(self.by_component.get(comp_id, ()))
+            affected = [(build_id, self.builds[build_id]) for build_id in affected if build_id in self.builds]
+
+        with metrics.timer('registry.revalidate'):
+            for (build_id, key) in affected:
+                conflicts = self._conflicts(key)
+                ok = len(conflicts) == 0
+                was = self.verdicts.get(build_id)
+                self.verdicts[build_id] = ok
+                if was is not None and was != ok:
+                    self._publish(build_id, ok, conflicts)
+        self.revalidated += len(affected)
+        if metrics.enabled:
+            metrics.incr('registry.revalidated', len(affected))
+        return len(affected)
+
+    def _publish(self, build_id, ok: bool, conflicts: list):
+        """
+        numbers a change event, keeps it in the history and hands it to the subscribers
+        """
+        with self._lock:
+            self.sequence += 1
+            event = {'seq': self.sequence, 'build': build_id, 'ok': ok,
+                     'conflicts': [[first.name, second.name] for (first, second) in conflicts]}
+            self.history.append(event)
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except Full:
+                # a subscriber that stopped reading catches up from changes(since)
+                if metrics.enabled:
+                    metrics.incr('registry.dropped')
+
+    def changes(self, since: int = 0) -> list:
+        """
+        change events after a sequence number, as far back as the history reaches
+        :param since: last sequence number seen
+        :return: list of event dicts with seq, build, ok and conflicts (pairs of names)
+        """
+        with self._lock:
+            return [event for event in self.history if event['seq'] > since]
+
+    def subscribe(self, maxsize: int = 1000) -> Queue:
+        """
+        :param maxsize: events held for the subscriber before new ones are dropped
+        :return: queue receiving every change event from now on
+        """
+        queue = Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: Queue):
+        with self._lock:
+            self._subscribers.remove(queue)
+
+    def start(self):
+        """
+        revalidates in a background thread whenever rows of registered builds change
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            if not self._stop.is_set():
+                self.revalidate()
+
+    def close(self):
+        """
+        stops the background thread and the database notifications
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._listener in self._database.listeners:
+            self._database.listeners.remove(self._listener)
+
+    def save(self, filename: str):
+        """
+        writes the builds and verdicts as JSON, components by uuid so the file outlives ID changes
+        :param filename: file to write
+        """
+        with self._lock:
+            data = {'builds': [[build_id, [self._database.uuids[comp_id] for comp_id in key],
+                                self.verdicts.get(build_id)] for (build_id, key) in self.builds.items()],
+                    'sequence': self.sequence}
+        f_tmp = open(filename + ".tmp", "w")
+        json.dump(data, f_tmp)
+        f_tmp.close()
+        os.replace(filename + ".tmp", filename)
+
+    def load(self, filename: str):
+        """
+        adds the builds of a file written by save and revalidates them all
+        :param filename: file to read
+        """
+        f_r = open(filename, "r")
+        data = json.load(f_r)
+        f_r.close()
+        for (build_id, uuids, _) in data['builds']:
+            self.register({self._database.component_from_uuid(comp_uuid) for comp_uuid in uuids}, build_id)
+        self.sequence = max(self.sequence, data.get('sequence', 0))
+
+    def stats(self) -> dict:
+        """
+        :return: dict with builds, failing builds, indexed components, builds revalidated and events published
+        """
+        return {'builds': len(self.builds), 'failing': sum(1 for ok in self.verdicts.values() if not ok),
+                'components': len(self.by_component), 'revalidated': self.revalidated, 'events': self.sequence}
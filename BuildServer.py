@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+import time
+import warnings
+from collections import deque
+from BitsetEngine import BitsetEngine
+from BuildCache import BuildCache
+from Builder import Builder, repeated_types
+from CatalogFile import catalog_key
+from Client import Client
+from CompatibilityDatabase import CompatibilityDatabase
+from SQLiteBackend import SQLiteBackend
+
+'''
+Asyncio build service
+
+Speaks JSON lines over TCP or a Unix socket. A request is either the list
+Client.save_components_to_json writes, or {"id": ..., "components": [...]};
+{"op": "stats"} returns the latency report, taken once the requests before it on
+the connection are answered. Requests arriving within
+batch_window seconds are validated together by Builder.build_batch.
+Responses on one connection come back in request order.
+'''
+
+
+def build_response(request_id, ok: bool, conflicts: list, suggestions: dict) -> dict:
+    """
+    JSON form of a build result. Conflicts and suggestions are sorted by catalog key, otherwise
+    their order follows the component numbering, which differs between storage layouts
+    :param request_id: id the request came with
+    :param ok: True if the build succeeded
+    :param conflicts: list of conflicting component pairs
+    :param suggestions: dict mapping a component to its ranked replacements
+    :return: dict ready for json.dumps
+    """
+    pairs = sorted((sorted(pair, key=catalog_key) for pair in conflicts),
+                   key=lambda pair: [catalog_key(comp) for comp in pair])
+    return {'id': request_id, 'ok': ok,
+            'conflicts': [[first.to_dict(), second.to_dict()] for (first, second) in pairs],
+            'suggestions': [{'component': part.to_dict(),
+                             'replacements': [comp.to_dict() for comp in suggestions[part]]}
+                            for part in sorted(suggestions, key=catalog_key)]}
+
+
+def open_database(args) -> CompatibilityDatabase:
+    """
+    opens the database the command line options ask for. In memory it gets a BitsetEngine
+    unless --engine none is given or numpy is missing, so Builder.build_batch validates a
+    batch in one vectorized pass; a SQLite backend answers those passes itself.
+    :param args: parsed options inventory, dependency, default, sqlite, compact and engine
+    :return: initialized database
+    """
+    if args.sqlite:
+        backend = SQLiteBackend(args.sqlite)
+        database = CompatibilityDatabase(args.inventory, args.dependency, undirected=backend.undirected)
+        database.init_from_backend(backend)
+        return database
+
+    engine = None
+    if args.engine == 'bitset':
+        try:
+            engine = BitsetEngine()
+        except ImportError:
+            warnings.warn('numpy is missing, builds are validated one pair at a time')
+    database = CompatibilityDatabase(args.inventory, args.dependency, engine=engine, compact=args.compact)
+    if args.default:
+        database.default_init()
+    else:
+        database.init_from_file()
+    return database
+
+
+class BuildServer:
+
+    def __init__(self, database, batch_window: float = 0.002, max_batch: int = 256, max_pending: int = 1024,
+                 cache_size: int = 10000):
+        """
+        init function
+        :param database: database to validate against
+        :param batch_window: seconds to wait for more requests before validating a batch
+        :param max_batch: largest number of builds validated in one pass
+        :param max_pending: requests queued before readers stop reading from their sockets
+        :param cache_size: build results kept in the BuildCache, 0 disables it
+        """
+        self._database = database
+        self.cache = BuildCache(database, cache_size) if cache_size > 0 else None
+        self._builder = Builder('server', database, self.cache)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._server = None
+        self._batcher = None
+        # connection handler tasks, cancelled by close
+        self._handlers = set()
+
+        # latencies of the most recent requests in seconds
+        self.latencies = deque(maxlen=10000)
+        self.served = 0
+        self.batches = 0
+
+    async def start_tcp(self, host: str = '127.0.0.1', port: int = 8765):
+        """
+        starts listening on a TCP port
+        """
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def start_unix(self, path: str):
+        """
+        starts listening on a Unix socket
+        """
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        self._server = await asyncio.start_unix_server(self._handle, path)
+        return self._server
+
+    async def close(self):
+        """
+        stops accepting connections, ends the open ones and stops the batcher
+        """
+        if self._server is not None:
+            self._server.close()
+        handlers = list(self._handlers)
+        for handler in handlers:
+            handler.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """
+        latency report over the most recent requests
+        :return: dict with request count, batch count, p50 and p99 latency in milliseconds and cache statistics
+        """
+        ordered = sorted(self.latencies)
+        report = {'served': self.served, 'batches': self.batches, 'p50_ms': None, 'p99_ms': None,
+                  'cache': self.cache.stats() if self.cache is not None else None}
+        if len(ordered) != 0:
+            report['p50_ms'] = 1000 * ordered[int(0.50 * (len(ordered) - 1))]
+            report['p99_ms'] = 1000 * ordered[int(0.99 * (len(ordered) - 1))]
+        return report
+
+    async def _handle(self, reader, writer):
+        """
+        serves one connection: a reader loop queueing requests and a writer loop answering them in order
+        """
+        responses = asyncio.Queue(maxsize=self.max_batch)
+        sender = asyncio.ensure_future(self._send(writer, responses))
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    # blocks while the queues are full, which stops reading from the socket
+                    await responses.put((time.perf_counter(), await self._submit(line)))
+            # the sender reads the queue until it gets None, so this put cannot block for long
+            await responses.put(None)
+            await sender
+        except ConnectionError:
+            # the client went away while we were reading
+            await responses.put(None)
+            await sender
+        except asyncio.CancelledError:
+            # ended by close, the task finishes normally so the stream callback has nothing to report
+            sender.cancel()
+            writer.close()
+        finally:
+            self._handlers.discard(asyncio.current_task())
+
+    async def _send(self, writer, responses):
+        """
+        writes answers in request order. When the client is gone the remaining
+        answers are taken off the queue and dropped, so the reader never blocks on it
+        """
+        connected = True
+        while True:
+            item = await responses.get()
+            if item is None:
+                break
+            if not connected:
+                continue
+            (received, future) = item
+            response = await future
+            if callable(response):
+                # a stats request, reported now that every request before it is answered
+                response = response()
+            try:
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()
+            except ConnectionError:
+                connected = False
+                continue
+            self.latencies.append(time.perf_counter() - received)
+            self.served += 1
+        writer.close()
+
+    async def _submit(self, line: bytes):
+        """
+        decodes a request line and queues it for the batcher
+        :return: future resolving to the response dict, or for stats to a function the sender calls in turn
+        """
+        future = asyncio.get_event_loop().create_future()
+        request_id = None
+        try:
+            request = json.loads(line)
+            if isinstance(request, dict):
+                request_id = request.get('id')
+                if request.get('op') == 'stats':
+                    future.set_result(lambda: {'id': request_id, 'stats': self.stats()})
+                    return future
+                request = request['components']
+            components = {Client.recreate_from_json(data) for data in request}
+        except (ValueError, KeyError, LookupError, TypeError) as err:
+            future.set_result({'id': request_id, 'error': repr(err)})
+            return future
+        await self._queue.put((request_id, components, future))
+        return future
+
+    async def _run_batches(self):
+        """
+        collects requests for up to batch_window seconds and validates them in one pass
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            valid = []
+            for (request_id, components, future) in batch:
+                missing = [comp.name for comp in components if comp not in self._database.inventory]
+                repeated = repeated_types(components)
+                if missing:
+                    future.set_result({'id': request_id, 'error': 'not in inventory: ' + ', '.join(missing)})
+                elif repeated:
+                    future.set_result({'id': request_id, 'error': 'more than one of type: ' + ', '.join(repeated)})
+                else:
+                    valid.append((request_id, components, future))
+
+            try:
+                results = await loop.run_in_executor(None, self._builder.build_batch,
+                                                     [components for (_, components, _) in valid])
+            except Exception as err:
+                for (request_id, _, future) in valid:
+                    future.set_result({'id': request_id, 'error': repr(err)})
+                continue
+            self.batches += 1
+            for ((request_id, _, future), (ok, conflicts, suggestions)) in zip(valid, results):
+                future.set_result(build_response(request_id, ok, conflicts, suggestions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Custom Car Builder validation service')
+    parser.add_argument('--inventory', default='inventory.pkl')
+    parser.add_argument('--dependency', default='dependency.pkl')
+    parser.add_argument('--default', action='store_true', help='start from the example catalog')
+    parser.add_argument('--sqlite', help='serve from this SQLite file instead of the pickled files')
+    parser.add_argument('--compact', action='store_true', help='keep compatibility rows compressed in memory')
+    parser.add_argument('--engine', choices=['bitset', 'none'], default='bitset',
+                        help='storage engine validating build batches in memory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--window', type=float, default=0.002, help='batching window in seconds')
+    parser.add_argument('--cache', type=int, default=10000, help='build results to cache, 0 disables the cache')
+    args = parser.parse_args()
+    database = open_database(args)
+
+    async def serve():
+        server = BuildServer(database, batch_window=args.window, cache_size=args.cache)
+        if args.unix:
+            listener = await server.start_unix(args.unix)
+        else:
+            listener = await server.start_tcp(args.host, args.port)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
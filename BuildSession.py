@@ -0,0 +1,192 @@
+from Components import *
+from Metrics import metrics
+
+'''
+Live validation of a configuration that changes one part at a time
+'''
+
+
+class BuildSession:
+    """
+    Keeps the conflicts and type-slot violations of a configuration up to date
+    as parts are added and removed, so reading them costs nothing.
+    Adding a part checks it against the k parts already in, removing one drops
+    the conflicts it was in, both O(k). Changes to the database are picked up
+    through the component versions and generation BuildCache uses: a part whose
+    row changed is checked again, a new generation checks everything again.
+    """
+
+    def __init__(self, builder):
+        """
+        init function
+        :param builder: Builder whose database the parts are checked against, it also computes suggestions
+        """
+        self._builder = builder
+        self._database = builder._database
+        # part -> component ID
+        self._parts = dict()
+        # part -> set of conflict pairs it is in, each pair is (component, incompatible component)
+        self._conflicts = dict()
+        # comp_type -> parts of that type, Extra parts take no slot
+        self._slots = dict()
+        # part -> version of its row when it was last checked, and the generation of those versions
+        self._checked = dict()
+        self._generation = getattr(self._database, 'generation', 0)
+        # suggestions of the current configuration, computed on first request
+        self._suggestions = None
+
+    def __len__(self):
+        return len(self._parts)
+
+    def __contains__(self, component):
+        return component in self._parts
+
+    @property
+    def components(self) -> set:
+        """
+        :return: set of the parts in the configuration
+        """
+        return set(self._parts)
+
+    def _version(self, comp_id: int) -> int:
+        return self._database.component_versions.get(comp_id, 0) \
+            if hasattr(self._database, 'component_versions') else 0
+
+    def _check(self, component, comp_id: int):
+        """
+        finds the conflicts between one part and all others
+        :param component: part to check
+        :param comp_id: its ID
+        :return: None
+        """
+        database = self._database
+        undirected = getattr(database, 'undirected', False)
+        found = self._conflicts.setdefault(component, set())
+        for (other, other_id) in self._parts.items():
+            if other == component:
+                continue
+            pairs = []
+            if not database.compatible_ids(comp_id, other_id):
+                pairs.append((component, other))
+            if not undirected and not database.compatible_ids(other_id, comp_id):
+                pairs.append((other, component))
+            for pair in pairs:
+                found.add(pair)
+                self._conflicts.setdefault(other, set()).add(pair)
+        self._checked[component] = self._version(comp_id)
+        if metrics.enabled:
+            metrics.incr('session.pair_checks', len(self._parts) - 1)
+
+    def _forget(self, component):
+        """
+        drops every conflict a part is in
+        """
+        for pair in self._conflicts.pop(component, ()):
+            other = pair[1] if pair[0] == component else pair[0]
+            if other in self._conflicts:
+                self._conflicts[other].discard(pair)
+
+    def add(self, component):
+        """
+        adds a part and checks it against the others, adding it again changes nothing
+        :param component: component in the inventory
+        :return: None
+        """
+        if component in self._parts:
+            return
+        comp_id = self._database.inventory.get(component)
+        if comp_id is None:
+            raise KeyError("Component: " + str(component.name) + " not in inventory")
+        self._refresh()
+        self._parts[component] = comp_id
+        if component.comp_type != Component_Type.Extra:
+            self._slots.setdefault(component.comp_type, set()).add(component)
+        self._check(component, comp_id)
+        self._suggestions = None
+
+    def remove(self, component):
+        """
+        removes a part and the conflicts it was in
+        :param component: part in the configuration
+        :return: None
+        """
+        del self._parts[component]
+        self._forget(component)
+        self._checked.pop(component, None)
+        if component.comp_type != Component_Type.Extra:
+            self._slots[component.comp_type].discard(component)
+        self._suggestions = None
+
+    def reset(self, component_set=()):
+        """
+        replaces the configuration
+        :param component_set: components in the inventory
+        :return: None
+        """
+        for component in list(self._parts):
+            self.remove(component)
+        self._generation = getattr(self._database, 'generation', 0)
+        for component in component_set:
+            self.add(component)
+
+    def _refresh(self):
+        """
+        checks again the parts whose rows changed in the database since they were checked
+        """
+        generation = getattr(self._database, 'generation', 0)
+        if generation != self._generation:
+            self._generation = generation
+            stale = list(self._parts)
+        else:
+            stale = [component for (component, comp_id) in self._parts.items()
+                     if self._checked.get(component) != self._version(comp_id)]
+        for component in stale:
+            self._forget(component)
+        for component in stale:
+            self._check(component, self._parts[component])
+        if stale:
+            self._suggestions = None
+
+    def conflicts(self) -> list:
+        """
+        :return: list of (component, incompatible component) pairs, as Builder.conflicts
+        """
+        self._refresh()
+        pairs = set()
+        for found in self._conflicts.values():
+            pairs.update(found)
+        return list(pairs)
+
+    def violations(self) -> dict:
+        """
+        type slots taken by more than one part, every car has one of each primary type
+        :return: dict mapping Component_Type to the parts competing for it
+        """
+        return {comp_type: set(parts) for (comp_type, parts) in self._slots.items() if len(parts) > 1}
+
+    def ok(self) -> bool:
+        """
+        :return: True if the configuration has no conflicts and no type slot taken twice.
+            Builder.build gives the same result, or raises ValueError for a slot taken twice
+        """
+        if self.violations():
+            return False
+        self._refresh()
+        return not any(self._conflicts.values())
+
+    def suggestions(self) -> dict:
+        """
+        replacements resolving the conflicts, see Builder.suggest_resolve. Only computed
+        when asked for, and kept until the configuration or its rows change.
+        :return: dict mapping a conflicting component to replacements, best ranked first
+        """
+        conflicts = self.conflicts()
+        if self._suggestions is None:
+            if conflicts:
+                self._builder.conflicts = conflicts
+                self._builder.current_build = self.components
+                self._suggestions = self._builder.suggest_resolve()
+                self._builder.suggestions = self._suggestions
+            else:
+                self._suggestions = dict()
+        return self._suggestions
@@ -1,43 +1,521 @@
-from collections import Counter
+import os
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from itertools import combinations
+from CatalogFile import catalog_key
 from Components import *
 from CompatibilityDatabase import *
+from BuildSession import BuildSession
+from SharedCatalog import SharedCatalog, SharedCatalogReader
+from Metrics import metrics
+
+# largest set of parts suggest_resolve replaces together, beyond it a greedy cover is tried
+MAX_SWAP = 3
+
+# read-only database installed once in every build_many worker process
+_worker_database = None
+
+# in shared mode, the worker's view of the published catalog generations
+_worker_shared = None
+
+# number of the parent's operations the worker database has applied since it was copied, see _apply_deltas
+_worker_applied = 0
+
+
+def _init_worker(inventory: dict, dependencies: dict, engine, undirected: bool = False, rules=None, uuids=None):
+    """
+    builds the database of a worker process from the parent's data
+    :param inventory: parent inventory
+    :param dependencies: parent dependencies
+    :param engine: parent storage engine, already loaded
+    :param undirected: storage mode of the parent
+    :param rules: parent RuleSet, already compiled
+    :param uuids: parent uuids, needed when the worker is to apply the parent's operations
+    :return: None
+    """
+    global _worker_database, _worker_applied
+    database = CompatibilityDatabase(None, None, engine=engine, undirected=undirected)
+    database.inventory = inventory
+    database.dependencies = dependencies
+    if rules is not None:
+        database.rules = rules
+    if uuids is not None:
+        database.uuids = uuids
+    database.fill_id_chart()
+    _worker_database = database
+    _worker_applied = 0
+
+
+def _init_shared_worker(prefix: str):
+    """
+    maps the current generation of a SharedCatalog in a worker process, nothing is copied
+    :param prefix: SharedCatalog.prefix
+    :return: None
+    """
+    global _worker_database, _worker_shared
+    _worker_shared = SharedCatalogReader(prefix)
+    # catalogs hold full rows, so the worker reads them as a directed store
+    database = CompatibilityDatabase(None, None)
+    database.init_from_mapped(_worker_shared.catalog)
+    _worker_database = database
+
+
+def copyable(database) -> bool:
+    """
+    :return: True if worker processes can be given the database, as a copy (process mode) or
+        a shared memory catalog (shared mode). A ShardedDatabase can not, it is thread mode only
+    """
+    return hasattr(database, 'dependencies') and hasattr(database, 'catalog_image')
+
+
+def repeated_types(component_set) -> list:
+    """
+    :param component_set: components of a build
+    :return: names of the primary component types that appear more than once, a build holds one of each
+    """
+    counter = Counter(comp.comp_type for comp in component_set if comp.comp_type != Component_Type.Extra)
+    return sorted(comp_type.name for (comp_type, count) in counter.items() if count > 1)
+
+
+def _adopt_generation():
+    """
+    switches a shared mode worker to the newest published generation before a task
+    """
+    if _worker_shared is not None and _worker_shared.refresh():
+        _worker_database.init_from_mapped(_worker_shared.catalog)
+
+
+def _build_in_worker(clientID: str, index: int, component_set: set):
+    """
+    runs one build inside a worker process
+    :return: (index, ok, conflicts, suggestions)
+    """
+    _adopt_generation()
+    return Builder(clientID, _worker_database).build_result(index, component_set)
+
+
+def _apply_deltas(deltas: tuple):
+    """
+    replays on the worker's copy the operations the parent applied since the copy was made.
+    Every task carries all of them, a worker applies those it has not seen, in the parent's order,
+    so new components get the same IDs as in the parent.
+    :param deltas: tuple of ('add', component, compatible components, symmetric) or ('update', component, other)
+    """
+    global _worker_applied
+    for delta in deltas[_worker_applied:]:
+        if delta[0] == 'add':
+            _worker_database.bulk_add([(delta[1], delta[2])], symmetric=delta[3])
+        else:
+            _worker_database.update_compatibility(delta[1], delta[2])
+    _worker_applied = len(deltas)
+
+
+def _build_batch_in_worker(clientID: str, component_sets: list, deltas: tuple = ()):
+    """
+    runs Builder.build_batch inside a worker process
+    :param deltas: operations to catch up with first, see _apply_deltas
+    :return: list of (ok, conflicts, suggestions)
+    """
+    _adopt_generation()
+    _apply_deltas(deltas)
+    return Builder(clientID, _worker_database).build_batch(component_sets)
 
 
 class Builder:
-    def __init__(self, clientID: str, database):
+    def __init__(self, clientID: str, database, cache=None):
+        """
+        init function
+        :param clientID: client the builds are for
+        :param database: database to validate against
+        :param cache: optional BuildCache, may be shared between builders
+        """
         self.clientID = clientID
         self.conflicts = []
         self._database = database
         self.suggestions = dict()
+        self.repairs = []
+        self.current_build = set()
+        self.cache = cache
+
+    def session(self) -> BuildSession:
+        """
+        :return: a BuildSession validating a configuration against this builder's database as it changes
+        """
+        return BuildSession(self)
 
     def build(self, component_set) -> bool:
         """
         :param component_set: a set of client provided components
         :return: True if build succeeds, False otherwise
         """
-        self.validate_entry(component_set)
-        self.conflicts.clear()
-        self.suggestions.clear()
+        with metrics.timer('builder.build'):
+            self.validate_entry(component_set)
+            self.conflicts.clear()
+            self.suggestions.clear()
+            self.repairs = []
+            self.current_build = set(component_set)
 
+            if self.cache is not None:
+                key = self.cache.key(component_set)
+                stamp = self.cache.stamp(key)
+                cached = self.cache.get(key, stamp)
+                if cached is not None:
+                    (ok, conflicts, suggestions, self.repairs) = cached
+                    self.conflicts = list(conflicts)
+                    self.suggestions = {part: list(replacements) for (part, replacements) in suggestions.items()}
+                    return ok
+
+            ok = self._validate(component_set)
+            if self.cache is not None and self._cacheable(ok, self.current_build, self.repairs):
+                self.cache.put(key, stamp, (ok, tuple(self.conflicts),
+                                            {part: tuple(replacements) for (part, replacements)
+                                             in self.suggestions.items()}, self.repairs))
+            return ok
+
+    def _validate(self, component_set) -> bool:
+        """
+        checks a build from scratch, filling conflicts, suggestions and repairs
+        :param component_set: a set of components, already checked by validate_entry
+        :return: True if the build has no conflicts
+        """
         self.check_conflict(component_set)
         if len(self.conflicts) != 0:
-            self.suggestions = self.suggest_resolve()
+            if metrics.enabled:
+                metrics.incr('builder.failed')
+            with metrics.timer('builder.suggest_resolve'):
+                self.suggestions = self.suggest_resolve()
             return False
         return True
 
+    @staticmethod
+    def _cacheable(ok: bool, component_set: set, repairs: list) -> bool:
+        """
+        decides whether a result only depends on the rows of its own components and
+        of the replacements it suggests, see BuildCache.
+        Suggestions that replace every part, or finding none at all, depend on
+        the whole catalog of those types, which component versions do not track.
+        Swapping several parts together also depends on the edges between their
+        candidates, including those that are not suggested in the end.
+        :return: True if the result may be cached
+        """
+        if ok:
+            return True
+        return len(repairs) != 0 and all(len(swap) == 1 < len(component_set) for swap in repairs)
+
+    def build_result(self, index: int, component_set) -> tuple:
+        """
+        builds and returns a detached copy of the outcome
+        :param index: position of the component set in a batch
+        :param component_set: a set of client provided components
+        :return: (index, ok, conflicts, suggestions)
+        """
+        ok = self.build(component_set)
+        return index, ok, list(self.conflicts), dict(self.suggestions)
+
+    def build_batch(self, component_sets: list) -> list:
+        """
+        validates many builds in one pass, see _build_batch. With a cache, only the
+        builds it does not hold are validated.
+        :param component_sets: list of component sets
+        :return: list of (ok, conflicts, suggestions), one per set
+        """
+        if self.cache is None:
+            return [result[:3] for result in self._build_batch(component_sets)]
+
+        for component_set in component_sets:
+            self.validate_entry(component_set)
+        keys = [self.cache.key(component_set) for component_set in component_sets]
+        stamps = [self.cache.stamp(key) for key in keys]
+        results = [self.cache.get(key, stamp) for (key, stamp) in zip(keys, stamps)]
+        missing = [index for (index, result) in enumerate(results) if result is None]
+        computed = self._build_batch([component_sets[index] for index in missing])
+        for (index, result) in zip(missing, computed):
+            if self._cacheable(result[0], component_sets[index], result[3]):
+                (ok, conflicts, suggestions, repairs) = result
+                self.cache.put(keys[index], stamps[index], (ok, tuple(conflicts), {
+                    part: tuple(replacements) for (part, replacements) in suggestions.items()}, repairs))
+            results[index] = result
+        return [(ok, list(conflicts), {part: list(replacements) for (part, replacements) in suggestions.items()})
+                for (ok, conflicts, suggestions, _) in results]
+
+    def _build_batch(self, component_sets: list) -> list:
+        """
+        validates many builds in one pass. With a storage engine that supports
+        compatible_pairs, every ordered pair of every build is tested in a single
+        vectorized gather; suggestions are only computed for the failing builds.
+        :param component_sets: list of component sets
+        :return: list of (ok, conflicts, suggestions, repairs), one per set
+        """
+        engine = getattr(self._database, 'engine', None)
+        if engine is None or not hasattr(engine, 'compatible_pairs'):
+            results = []
+            for component_set in component_sets:
+                self.validate_entry(component_set)
+                self.conflicts = []
+                self.suggestions = dict()
+                self.repairs = []
+                self.current_build = set(component_set)
+                ok = self._validate(component_set)
+                results.append((ok, self.conflicts, self.suggestions, self.repairs))
+            self.conflicts = []
+            return results
+
+        # an undirected store keeps each edge in the row of the smaller id, one test per unordered pair
+        undirected = getattr(self._database, 'undirected', False)
+        builds = []
+        (firsts, seconds) = ([], [])
+        for component_set in component_sets:
+            self.validate_entry(component_set)
+            components = list(component_set)
+            comp_ids = [self._database.cid(comp) for comp in components]
+            builds.append(components)
+            for first in range(len(comp_ids)):
+                for second in range(first + 1 if undirected else 0, len(comp_ids)):
+                    if first != second:
+                        firsts.append(min(comp_ids[first], comp_ids[second]) if undirected else comp_ids[first])
+                        seconds.append(max(comp_ids[first], comp_ids[second]) if undirected else comp_ids[second])
+        compatible = engine.compatible_pairs(firsts, seconds) if firsts else []
+        rules = getattr(self._database, 'rules', None)
+        if rules:
+            compatible = rules.overlay_pairs(firsts, seconds, compatible)
+
+        results = []
+        position = 0
+        for components in builds:
+            conflicts = []
+            for first in range(len(components)):
+                for second in range(first + 1 if undirected else 0, len(components)):
+                    if first != second:
+                        if not compatible[position]:
+                            conflicts.append((components[first], components[second]))
+                        position += 1
+            suggestions = dict()
+            self.repairs = []
+            if len(conflicts) != 0:
+                self.conflicts = conflicts
+                suggestions = self.suggest_resolve(set(components))
+            results.append((len(conflicts) == 0, conflicts, suggestions, self.repairs))
+        self.conflicts = []
+        return results
+
+    def build_many(self, component_sets, workers: int = None, mode: str = "thread", ordered: bool = True):
+        """
+        builds many component sets on a thread or process pool and streams the results.
+        The input is consumed lazily, at most a few sets per worker are in flight.
+        In process mode each worker receives the compatibility data once when it
+        starts instead of with every task. In shared mode the catalog is published
+        into shared memory once and every worker maps it, see SharedCatalog, so
+        memory stays the same whatever the number of workers.
+        :param component_sets: iterable of component sets
+        :param workers: pool size, defaults to the number of CPUs
+        :param mode: "thread", "process" or "shared"
+        :param ordered: yield in submission order if True, completion order otherwise
+        :return: generator of (index, ok, conflicts, suggestions)
+        """
+        workers = workers or os.cpu_count() or 1
+        if mode in ("process", "shared") and getattr(self._database, 'backend', None) is not None:
+            # worker processes get a copy of the in-memory store, a backend is shared by threads instead
+            raise ValueError(mode + " mode needs an in-memory database, use thread mode with a backend")
+        if mode in ("process", "shared") and not copyable(self._database):
+            raise ValueError(mode + " mode needs a CompatibilityDatabase, use thread mode")
+        shared = None
+        if mode == "thread":
+            executor = ThreadPoolExecutor(max_workers=workers)
+            task = self._build_in_thread
+        elif mode == "process":
+            database = self._database
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                           initargs=(database.inventory, database.dependencies,
+                                                     getattr(database, 'engine', None),
+                                                     getattr(database, 'undirected', False),
+                                                     getattr(database, 'rules', None)))
+            task = partial(_build_in_worker, self.clientID)
+        elif mode == "shared":
+            shared = SharedCatalog()
+            try:
+                shared.publish(self._database)
+            except BaseException:
+                shared.close()
+                raise
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_shared_worker,
+                                           initargs=(shared.prefix,))
+            task = partial(_build_in_worker, self.clientID)
+        else:
+            raise ValueError("mode must be 'thread', 'process' or 'shared'")
+
+        try:
+            yield from self._run_pool(executor, task, component_sets, workers, ordered)
+        finally:
+            if shared is not None:
+                shared.close()
+
+    @staticmethod
+    def _run_pool(executor, task, component_sets, workers: int, ordered: bool):
+        """
+        feeds component sets to a pool, keeping a few per worker in flight
+        :return: generator of task results
+        """
+        with executor:
+            window = 4 * workers
+            pending = deque() if ordered else set()
+            for (index, component_set) in enumerate(component_sets):
+                future = executor.submit(task, index, component_set)
+                if ordered:
+                    pending.append(future)
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                else:
+                    pending.add(future)
+                    if len(pending) >= window:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for finished in done:
+                            yield finished.result()
+
+            if ordered:
+                while pending:
+                    yield pending.popleft().result()
+            else:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for finished in done:
+                        yield finished.result()
+
+    def _build_in_thread(self, index: int, component_set):
+        """
+        runs one build on a private Builder sharing this builder's database
+        :return: (index, ok, conflicts, suggestions)
+        """
+        return Builder(self.clientID, self._database, self.cache).build_result(index, component_set)
+
+    def enumerate_builds(self, fixed=frozenset(), extras=None, limit: int = None):
+        """
+        lazily yields every conflict-free build containing the given parts.
+        Each open primary slot starts from the parts of that type compatible with
+        all fixed parts, the slot with the fewest candidates is filled first and
+        every choice prunes the candidates of the remaining slots.
+        :param fixed: components every build must contain
+        :param extras: Extra components to add to every build
+        :param limit: stop after this many builds
+        :return: generator of component sets
+        """
+        search = self._prepare_search(fixed, extras)
+        if search is None:
+            return
+        (fixed, domains) = search
+
+        produced = 0
+        for chosen in self._assign(domains, []):
+            yield fixed | {self._database.component_from_id(comp_id) for comp_id in chosen}
+            produced += 1
+            if limit is not None and produced >= limit:
+                return
+
+    def count_builds(self, fixed=frozenset(), extras=None, limit: int = None) -> int:
+        """
+        counts the builds enumerate_builds would yield without materializing them
+        :param fixed: components every build must contain
+        :param extras: Extra components to add to every build
+        :param limit: stop counting at this number
+        :return: number of conflict-free builds
+        """
+        search = self._prepare_search(fixed, extras)
+        if search is None:
+            return 0
+        return self._count(search[1], limit)
+
+    def _prepare_search(self, fixed, extras):
+        """
+        validates the fixed parts and computes the candidate IDs of every open primary slot
+        :return: (fixed parts, dict slot type -> set of candidate IDs), None if nothing can be built
+        """
+        fixed = set(fixed) | set(extras or ())
+        if repeated_types(fixed):
+            return None
+        self.validate_entry(fixed)
+        filled = {comp.comp_type for comp in fixed}
+        checker = Builder(self.clientID, self._database)
+        checker.check_conflict(fixed)
+        if len(checker.conflicts) != 0:
+            return None
+
+        domains = dict()
+        for comp_type in (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels):
+            if comp_type not in filled:
+                candidates = self._database.query(comp_type=comp_type, compatible_with=fixed)
+                domains[comp_type] = {self._database.cid(comp) for comp in candidates}
+                if len(domains[comp_type]) == 0:
+                    return None
+        return fixed, domains
+
+    def _prune(self, comp_id: int, domains: dict) -> dict:
+        """
+        keeps the candidates of every slot that do not conflict with comp_id
+        :return: pruned domains, None if a slot runs empty
+        """
+        database = self._database
+        pruned = dict()
+        for (comp_type, domain) in domains.items():
+            pruned[comp_type] = {other for other in domain
+                                 if database.mutually_compatible(comp_id, other)}
+            if len(pruned[comp_type]) == 0:
+                return None
+        return pruned
+
+    def _assign(self, domains: dict, chosen: list):
+        """
+        backtracking search filling the most constrained slot first
+        :return: generator of lists of chosen IDs
+        """
+        if len(domains) == 0:
+            yield list(chosen)
+            return
+        slot = min(domains, key=lambda comp_type: len(domains[comp_type]))
+        rest = {comp_type: domain for (comp_type, domain) in domains.items() if comp_type != slot}
+        for comp_id in sorted(domains[slot]):
+            pruned = self._prune(comp_id, rest)
+            if pruned is not None:
+                chosen.append(comp_id)
+                yield from self._assign(pruned, chosen)
+                chosen.pop()
+
+    def _count(self, domains: dict, limit: int = None) -> int:
+        """
+        counting version of _assign, the last open slot is counted without being enumerated
+        :return: number of complete assignments, capped at limit
+        """
+        if len(domains) == 0:
+            return 1
+        slot = min(domains, key=lambda comp_type: len(domains[comp_type]))
+        if len(domains) == 1:
+            total = len(domains[slot])
+            return total if limit is None else min(total, limit)
+        rest = {comp_type: domain for (comp_type, domain) in domains.items() if comp_type != slot}
+        total = 0
+        for comp_id in domains[slot]:
+            pruned = self._prune(comp_id, rest)
+            if pruned is not None:
+                total += self._count(pruned, None if limit is None else limit - total)
+                if limit is not None and total >= limit:
+                    return limit
+        return total
+
     def validate_entry(self, component_set: set):
         """
-        ensures exactly one primary component in the car, each exists in inventory
+        ensures at most one component of every primary type in the car, each exists in inventory
         :param component_set: set of components
-        :return: True if valid, False otherwise
+        :return: None, raises KeyError for a component not in the inventory and ValueError for a repeated type
         """
-        counter = Counter()
         for comp in component_set:
             if comp not in self._database.inventory:
+                if metrics.enabled:
+                    metrics.incr('builder.validate_errors')
                 raise KeyError("Component: " + str(comp.name) + " not in inventory")
-            if comp.comp_type != Component_Type.Extra:
-                counter[comp.comp_type] += 1
-        assert (val == 1 for val in counter.values())
+        repeated = repeated_types(component_set)
+        if repeated:
+            if metrics.enabled:
+                metrics.incr('builder.validate_errors')
+            raise ValueError("More than one component of type: " + ', '.join(repeated))
 
     def check_conflict(self, component_set: set):
         """
@@ -45,36 +523,179 @@ class Builder:
         :param component_set: set of current components
         :return: None
         """
+        undirected = getattr(self._database, 'undirected', False)
+        if metrics.enabled:
+            pairs = len(component_set) * (len(component_set) - 1)
+            metrics.incr('builder.pair_checks', pairs // 2 if undirected else pairs)
+        engine = getattr(self._database, 'engine', None)
+        if engine is None:
+            self.check_conflict_pairwise(component_set)
+            return
+
+        # gather the rows of the build once and test every ordered pair in one step
+        components = list(component_set)
+        comp_ids = [self._database.cid(comp) for comp in components]
+        compatible = engine.submatrix(comp_ids)
+        if compatible is None:
+            # the engine has no arrays without numpy
+            self.check_conflict_pairwise(component_set)
+            return
+        if undirected:
+            # each edge is only set in the row of its smaller id
+            compatible |= compatible.T
+        rules = getattr(self._database, 'rules', None)
+        if rules:
+            compatible = rules.overlay_matrix(comp_ids, compatible)
+        compatible[range(len(components)), range(len(components))] = True
+        for (first, second) in zip(*(~compatible).nonzero()):
+            if not undirected or first < second:
+                self.conflicts.append((components[first], components[second]))
+
+    def check_conflict_pairwise(self, component_set: set):
+        """
+        checks conflicts among components one pair at a time, used with the dict store
+        :param component_set: set of current components
+        :return: None
+        """
+        if getattr(self._database, 'undirected', False):
+            # compatibility is symmetric, every unordered pair is checked once
+            components = list(component_set)
+            for first in range(len(components)):
+                for second in range(first + 1, len(components)):
+                    if not self._database.compatibility(components[first], components[second]):
+                        self.conflicts.append((components[first], components[second]))
+            return
+
         for comp1 in component_set:
             for comp2 in component_set:
                 if comp1 != comp2:
                     if not self._database.compatibility(comp1, comp2):
                         self.conflicts.append((comp1, comp2))
 
-    def suggest_resolve(self):
+    def suggest_resolve(self, component_set=None):
         # TODO: Needs a lot of successful client build data to train
         # Open ended, can be a Neural network or k-means clustering
         # to suggest other similar items instead of conflicting items
 
-        # For now, I will just suggest components that are not
-        # conflicting with one of the components in the setup
-        # for every conflict
+        # For now, the smallest sets of conflicting parts whose replacement makes
+        # the build conflict-free are searched (minimum covers of the conflict
+        # pairs, up to MAX_SWAP parts, else one greedy cover), and every part of
+        # such a set gets the candidates of its type that fit the parts that are
+        # kept and at least one candidate for every other part of the set.
+        # Candidates fitting the most replacements of the other swapped parts
+        # come first, then those whose compatibility row is most like the row of
+        # the part they replace (see CompatibilityDatabase.row_similarity)
 
         """
-        returns potential resolves for conflicts
-        :return: dictionary of potential resolves for each component
+        returns potential resolves for conflicts, also stores the minimal swap sets in self.repairs
+        :param component_set: the build the conflicts came from, defaults to the last build
+        :return: dictionary mapping a conflicting component to replacements, best ranked first.
+            Ties are broken by manufacturer and catalog key, not by ID, as catalogs and shards number
+            components differently; the order is the same wherever the build is checked
         """
+        database = self._database
+        component_set = set(self.current_build if component_set is None else component_set)
+        edges = {frozenset(conflict) for conflict in self.conflicts}
+        # every swap set has to touch every conflict, which prunes the search to the few sets around them.
+        # Parts outside the conflicts are tried too, a replacement may only fit once one of them goes as well
+        nodes = sorted({part for edge in edges for part in edge}, key=catalog_key)
+        parts = nodes + sorted(component_set - set(nodes), key=catalog_key)
+
+        plans = []
+        for size in range(1, min(len(parts), MAX_SWAP) + 1):
+            for swap in combinations(parts, size):
+                swap = set(swap)
+                if all(edge & swap for edge in edges):
+                    plan = self._plan(swap, component_set)
+                    if plan is not None:
+                        plans.append(plan)
+            if len(plans) != 0:
+                break
+        if len(plans) == 0 and len(parts) > MAX_SWAP:
+            plan = self._plan(self._greedy_cover(edges), component_set)
+            if plan is not None:
+                plans.append(plan)
+        self.repairs = [frozenset(swap) for (swap, _) in plans]
+
+        # (part, candidate ID) -> replacements of the other swapped parts the candidate fits
+        partners = dict()
+        for (swap, domains) in plans:
+            for part in swap:
+                others = {other: domain for (other, domain) in domains.items() if other != part}
+                for cand_id in domains[part]:
+                    pruned = self._prune(cand_id, others)
+                    if pruned is not None:
+                        key = (part, cand_id)
+                        partners[key] = max(partners.get(key, 0), sum(len(domain) for domain in pruned.values()))
 
+        candidates = dict()
+        for (part, cand_id) in partners:
+            candidates.setdefault(part, []).append(cand_id)
         suggestions = dict()
-        for conflict in self.conflicts:
-            suggestion_ids = set()
-            if conflict[0] in self._database.dependencies:
-                suggestion_ids = self._database.dependencies[conflict[0]]
-            need_type = conflict[1].comp_type
-            suggests = [self._database.component_from_id(comp_id) for comp_id in suggestion_ids]
-            suggests = [comp for comp in suggests if comp.comp_type == need_type]
-            if conflict[0] not in suggestions:
-                suggestions[conflict[0]] = set()
-            suggestions[conflict[0]].union(suggests)
+        for (part, cand_ids) in candidates.items():
+            likeness = database.row_similarity(database.cid(part), cand_ids) \
+                if hasattr(database, 'row_similarity') else dict()
+            ranked = [(database.component_from_id(cand_id), cand_id) for cand_id in cand_ids]
+            ranked.sort(key=lambda item: (-partners[(part, item[1])], -likeness.get(item[1], 0.0),
+                                          item[0].manufacturer, catalog_key(item[0])))
+            suggestions[part] = [comp for (comp, _) in ranked]
 
         return suggestions
+
+    def _plan(self, swap: set, component_set: set):
+        """
+        candidates for every part of a swap set, if the swap can be completed
+        :param swap: parts to replace
+        :param component_set: the build
+        :return: (swap, dict part -> set of candidate IDs), None if no joint replacement fits
+        """
+        kept = component_set - swap
+        domains = dict()
+        for part in swap:
+            domains[part] = self._replacements(part, kept)
+            if len(domains[part]) == 0:
+                return None
+        if next(self._assign(domains, []), None) is None:
+            return None
+        return swap, domains
+
+    @staticmethod
+    def _greedy_cover(edges: set) -> set:
+        """
+        covers the conflict pairs by repeatedly taking the part in most uncovered pairs,
+        the one with the smallest catalog key on ties
+        :param edges: set of frozenset pairs of parts
+        :return: set of parts touching every pair
+        """
+        cover = set()
+        edges = set(edges)
+        while edges:
+            degree = Counter(part for edge in edges for part in edge)
+            part = min(degree, key=lambda comp: (-degree[comp], catalog_key(comp)))
+            cover.add(part)
+            edges = {edge for edge in edges if part not in edge}
+        return cover
+
+    def alternatives(self, part, component_set=None, k: int = 5) -> list:
+        """
+        the parts most like part, by compatibility row, that fit the rest of the build.
+        See CompatibilityDatabase.similar, only the MinHash buckets of part are ranked
+        :param part: component to find alternatives for, usually a conflicting one
+        :param component_set: the build, defaults to the last build
+        :param k: number of alternatives
+        :return: list of up to k components, most similar first
+        """
+        component_set = set(self.current_build if component_set is None else component_set)
+        return self._database.similar(part, k, compatible_with=component_set - {part})
+
+    def _replacements(self, part, kept: set) -> set:
+        """
+        parts that could take the place of part next to the kept ones
+        :param part: component to replace
+        :param kept: components staying in the build
+        :return: set of candidate IDs of the same type (and use, for Extra) compatible with all kept parts
+        """
+        use = part.use if part.comp_type == Component_Type.Extra else None
+        candidates = self._database.query(comp_type=part.comp_type, use=use, compatible_with=kept)
+        candidates.discard(part)
+        return {self._database.cid(comp) for comp in candidates}
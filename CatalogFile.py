@@ -0,0 +1,458 @@
+import mmap
+import os
+import struct
+import sys
+import zlib
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from Components import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+'''
+Binary catalog snapshot, version 1. All integers are little-endian.
+
+    header      HEADER, see below
+    table       one RECORD per component, sorted by its lookup key
+    uuid_order  uint32 record numbers sorted by uuid
+    strings     utf-8 string pool referenced by (offset, length) pairs
+    row_offsets uint64[n + 1], row i of the adjacency is targets[row_offsets[i]:row_offsets[i + 1]]
+    targets     uint32 record numbers, sorted within every row
+
+The header holds the section offsets and a crc32 of every section plus its own.
+'''
+
+MAGIC = b'CMKC'
+VERSION = 1
+
+# magic, version, flags, components, edges, 6 section offsets (last one is the file end), 5 section crcs, header crc
+HEADER = struct.Struct('<4sHHIQ6Q5II')
+
+# comp_type, then (offset, length) of key, name, manufacturer, attribute and component ID
+RECORD = struct.Struct('<B3x10I')
+
+_TYPES = {Component_Type.Body: 1, Component_Type.Engine: 2, Component_Type.Battery: 3,
+          Component_Type.Wheels: 4, Component_Type.Extra: 5}
+
+
+def _attribute(component: Component) -> str:
+    """
+    the type specific attribute of a component as a plain string
+    :param component: component
+    :return: attribute value, empty for Battery
+    """
+    if component.attribute is None:
+        return ''
+    value = getattr(component, component.attribute)
+    return str(getattr(value, 'value', value))
+
+
+def catalog_key(component: Component) -> bytes:
+    """
+    the lookup key records are sorted by
+    :param component: component
+    :return: key bytes
+    """
+    return '\x00'.join((str(_TYPES[component.comp_type]), component.name,
+                        component.manufacturer, _attribute(component))).encode('utf-8')
+
+
+def _build_component(comp_type: int, name: str, manufacturer: str, attribute: str) -> Component:
+    """
+    recreates a component from its record fields
+    :return: component object
+    """
+    if comp_type == 1:
+        return Body(name, Structure(attribute), manufacturer)
+    elif comp_type == 2:
+        return Engine(name, Engine_Mechanism(attribute), manufacturer)
+    elif comp_type == 3:
+        return Battery(name, manufacturer)
+    elif comp_type == 4:
+        return Wheels(name, Diameter(attribute), manufacturer)
+    elif comp_type == 5:
+        return Extra(name, attribute, manufacturer)
+    raise LookupError("Unknown component type " + str(comp_type) + " in catalog")
+
+
+def write_catalog(filename: str, inventory: dict, dependencies: dict, uuids):
+    """
+    writes a catalog snapshot of the given database state
+    :param filename: file to write
+    :param inventory: dict mapping component to ID
+    :param dependencies: dict mapping ID to the set of compatible IDs
+    :param uuids: uuid of every ID
+    :return: None
+    """
+    f_c = open(filename + ".tmp", "wb")
+    for part in pack_catalog(inventory, dependencies, uuids):
+        f_c.write(part)
+    f_c.close()
+    os.replace(filename + ".tmp", filename)
+
+
+def pack_catalog(inventory: dict, dependencies: dict, uuids) -> list:
+    """
+    encodes a database state in the catalog layout
+    :param inventory: dict mapping component to ID
+    :param dependencies: dict mapping ID to the set of compatible IDs
+    :param uuids: uuid of every ID
+    :return: list of byte strings, the header and the sections in file order
+    """
+    components = sorted(inventory, key=catalog_key)
+    number = {inventory[comp]: i for (i, comp) in enumerate(components)}
+
+    pool = bytearray()
+    interned = dict()
+
+    def string(value: str):
+        encoded = value.encode('utf-8')
+        if encoded not in interned:
+            interned[encoded] = len(pool)
+            pool.extend(encoded)
+        return interned[encoded], len(encoded)
+
+    table = bytearray()
+    for comp in components:
+        fields = []
+        for value in (catalog_key(comp).decode('utf-8'), comp.name, comp.manufacturer,
+                      _attribute(comp), uuids[inventory[comp]]):
+            fields.extend(string(value))
+        table.extend(RECORD.pack(_TYPES[comp.comp_type], *fields))
+
+    uuid_order = struct.pack('<%dI' % len(components),
+                             *sorted(range(len(components)), key=lambda i: uuids[inventory[components[i]]]))
+
+    row_offsets = [0]
+    targets = []
+    for comp in components:
+        row = sorted(number[other] for other in dependencies.get(inventory[comp], ()) if other in number)
+        targets.extend(row)
+        row_offsets.append(len(targets))
+    row_offsets = struct.pack('<%dQ' % len(row_offsets), *row_offsets)
+    targets = struct.pack('<%dI' % len(targets), *targets)
+
+    sections = [bytes(table), uuid_order, bytes(pool), row_offsets, targets]
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+    offsets.append(position)
+
+    header = HEADER.pack(MAGIC, VERSION, 0, len(components), len(targets) // 4, *offsets,
+                         *[zlib.crc32(section) for section in sections], 0)
+    header = header[:-4] + struct.pack('<I', zlib.crc32(header[:-4]))
+    return [header] + sections
+
+
+class MappedCatalog:
+    """
+    Read-only, memory-mapped view of a catalog snapshot.
+    Nothing is deserialized up front: components are decoded when asked for,
+    lookups binary search the sorted tables and compatibility is a binary
+    search inside one adjacency row. Processes mapping the same file share
+    its pages.
+    """
+
+    def __init__(self, filename: str, verify: bool = False, buffer=None):
+        """
+        init function
+        :param filename: catalog file written by write_catalog, only a name when buffer is given
+        :param verify: check the crc32 of every section, reads the whole file
+        :param buffer: optional buffer holding the catalog instead of the file, e.g. shared memory
+        """
+        if sys.byteorder != 'little':
+            raise OSError('Catalog files can only be mapped on little-endian machines')
+
+        self.filename = filename
+        if buffer is None:
+            f_c = open(filename, "rb")
+            self._map = mmap.mmap(f_c.fileno(), 0, access=mmap.ACCESS_READ)
+            f_c.close()
+        else:
+            self._map = memoryview(buffer)
+
+        if len(self._map) < HEADER.size:
+            raise ValueError(filename + ' is not a catalog file')
+        fields = HEADER.unpack_from(self._map, 0)
+        (magic, version, _, self.size, self.edges) = fields[:5]
+        self._offsets = fields[5:11]
+        crcs = fields[11:16]
+        if magic != MAGIC:
+            raise ValueError(filename + ' is not a catalog file')
+        if version != VERSION:
+            raise ValueError('Unsupported catalog version ' + str(version))
+        if zlib.crc32(self._map[:HEADER.size - 4]) != fields[16] or self._offsets[5] != len(self._map):
+            raise ValueError('Corrupt catalog header in ' + filename)
+
+        view = memoryview(self._map)
+        self._sections = [view[self._offsets[i]:self._offsets[i + 1]] for i in range(5)]
+        if verify:
+            for (section, crc) in zip(self._sections, crcs):
+                if zlib.crc32(section) != crc:
+                    raise ValueError('Checksum mismatch in ' + filename)
+
+        (self._table, uuid_order, self._strings, row_offsets, targets) = self._sections
+        self._uuid_order = uuid_order.cast('I')
+        self._row_offsets = row_offsets.cast('Q')
+        self._targets = targets.cast('I')
+
+    def __len__(self):
+        return self.size
+
+    def _record(self, number: int) -> tuple:
+        return RECORD.unpack_from(self._table, number * RECORD.size)
+
+    def _string(self, offset: int, length: int) -> bytes:
+        return bytes(self._strings[offset:offset + length])
+
+    def _key(self, number: int) -> bytes:
+        record = self._record(number)
+        return self._string(record[1], record[2])
+
+    def uuid(self, number: int) -> str:
+        """
+        :param number: record number
+        :return: uuid of the record
+        """
+        record = self._record(number)
+        return self._string(record[9], record[10]).decode('utf-8')
+
+    def component(self, number: int) -> Component:
+        """
+        decodes one record into a component
+        :param number: record number
+        :return: component object
+        """
+        record = self._record(number)
+        return _build_component(record[0], self._string(record[3], record[4]).decode('utf-8'),
+                                self._string(record[5], record[6]).decode('utf-8'),
+                                self._string(record[7], record[8]).decode('utf-8'))
+
+    def find(self, component) -> int:
+        """
+        binary searches the record of a component
+        :param component: component to look up
+        :return: record number, None if not in the catalog
+        """
+        if not isinstance(component, Component) or component.comp_type not in _TYPES:
+            return None
+        key = catalog_key(component)
+        (low, high) = (0, self.size)
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.size and self._key(low) == key:
+            return low
+        return None
+
+    def find_uuid(self, comp_uuid: str) -> int:
+        """
+        binary searches the record of a uuid
+        :param comp_uuid: uuid string
+        :return: record number, None if not in the catalog
+        """
+        (low, high) = (0, self.size)
+        while low < high:
+            mid = (low + high) // 2
+            if self.uuid(self._uuid_order[mid]) < comp_uuid:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.size and self.uuid(self._uuid_order[low]) == comp_uuid:
+            return self._uuid_order[low]
+        return None
+
+    def row(self, number: int):
+        """
+        :param number: record number
+        :return: sorted record numbers the component is compatible with
+        """
+        return self._targets[self._row_offsets[number]:self._row_offsets[number + 1]]
+
+    def compatible(self, number: int, other: int) -> bool:
+        """
+        :param number: record number of the first component
+        :param other: record number of the second component
+        :return: True if other is in the row of number
+        """
+        row = self.row(number)
+        position = bisect_left(row, other)
+        return position < len(row) and row[position] == other
+
+    def close(self):
+        """
+        releases the mapping
+        """
+        for section in (self._uuid_order, self._row_offsets, self._targets):
+            section.release()
+        for section in self._sections:
+            section.release()
+        if isinstance(self._map, memoryview):
+            self._map.release()
+        else:
+            self._map.close()
+
+
+class CatalogInventory(Mapping):
+    """
+    inventory (component -> ID) view over a MappedCatalog, record numbers are the IDs
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        self.catalog = catalog
+
+    def __getitem__(self, component):
+        number = self.catalog.find(component)
+        if number is None:
+            raise KeyError(component)
+        return number
+
+    def __contains__(self, component):
+        return self.catalog.find(component) is not None
+
+    def __iter__(self):
+        return (self.catalog.component(number) for number in range(len(self.catalog)))
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class CatalogIdChart(Sequence):
+    """
+    id_chart (ID -> component) view over a MappedCatalog
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        self.catalog = catalog
+
+    def __getitem__(self, number):
+        if not 0 <= number < len(self.catalog):
+            raise IndexError(number)
+        return self.catalog.component(number)
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class CatalogUuids(Sequence):
+    """
+    uuids (ID -> uuid) view over a MappedCatalog
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        self.catalog = catalog
+
+    def __getitem__(self, number):
+        if not 0 <= number < len(self.catalog):
+            raise IndexError(number)
+        return self.catalog.uuid(number)
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class CatalogUuidIndex(Mapping):
+    """
+    uuid_index (uuid -> ID) view over a MappedCatalog
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        self.catalog = catalog
+
+    def __getitem__(self, comp_uuid):
+        number = self.catalog.find_uuid(comp_uuid)
+        if number is None:
+            raise KeyError(comp_uuid)
+        return number
+
+    def __contains__(self, comp_uuid):
+        return self.catalog.find_uuid(comp_uuid) is not None
+
+    def __iter__(self):
+        return (self.catalog.uuid(number) for number in range(len(self.catalog)))
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class CatalogDependencies(Mapping):
+    """
+    dependencies (ID -> set of IDs) view over a MappedCatalog, rows are decoded on access
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        self.catalog = catalog
+
+    def __getitem__(self, number):
+        if not 0 <= number < len(self.catalog):
+            raise KeyError(number)
+        return set(self.catalog.row(number))
+
+    def __iter__(self):
+        return iter(range(len(self.catalog)))
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class CatalogEngine:
+    """
+    Read-only storage engine answering CompatibilityDatabase queries from a MappedCatalog.
+    Writes are not supported, the database materializes the catalog first.
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        """
+        init function
+        :param catalog: mapped catalog to answer from
+        """
+        self.catalog = catalog
+
+    def load(self, dependencies):
+        """
+        nothing to load, the catalog is the storage
+        """
+        pass
+
+    def compatible(self, number: int, other: int) -> bool:
+        """
+        binary search inside the row of number
+        :return: True if other is in the compatibility row of number
+        """
+        return self.catalog.compatible(number, other)
+
+    def compatible_with_all(self, number: int, others) -> bool:
+        """
+        :return: True if number is compatible with every one of others
+        """
+        return all(self.catalog.compatible(number, other) for other in others)
+
+    def common_compatible(self, numbers) -> set:
+        """
+        :return: set of IDs every given component is compatible with
+        """
+        common = None
+        for number in numbers:
+            row = set(self.catalog.row(number))
+            common = row if common is None else common & row
+        if common is None:
+            common = set(range(len(self.catalog)))
+        return common
+
+    def submatrix(self, numbers: list):
+        """
+        :return: k x k boolean array, [a, b] True if numbers[b] is in the row of numbers[a],
+            None without numpy, callers then check pair by pair
+        """
+        if np is None:
+            return None
+        return np.array([[self.catalog.compatible(number, other) for other in numbers] for number in numbers],
+                        dtype=bool).reshape(len(numbers), len(numbers))
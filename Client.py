@@ -1,6 +1,7 @@
 import json
 from Builder import *
 from CompatibilityDatabase import *
+from Metrics import metrics
 
 
 class Client:
@@ -9,9 +10,21 @@ class Client:
         self.clientID = clientID
         self.inventory = inventory
         self._builder = builder
-        self.current_components = set()
+        # conflicts of the configuration, kept up to date on every add and remove
+        self._session = builder.session()
         self.suggestions = dict()
 
+    @property
+    def current_components(self) -> set:
+        """
+        :return: set of components in the current configuration
+        """
+        return self._session.components
+
+    @current_components.setter
+    def current_components(self, component_set: set):
+        self._session.reset(component_set)
+
     def add_component(self, component):
         """
         Adds component to current configuration
@@ -19,39 +32,59 @@ class Client:
         :return: True if added, False otherwise
         """
         if component not in self.inventory:
+            if metrics.enabled:
+                metrics.incr('client.rejected')
             raise Warning("\n Requested Component \" " + str(component.name) + " \" not in "
                                                                                "inventory, can't add to build \n")
 
         else:
-            self.current_components.add(component)
+            self._session.add(component)
 
     def remove_component(self, component):
         """
         Removes a component from current configuration
         :param component: component to remove
         """
-        self.current_components.remove(component)
+        self._session.remove(component)
 
     def send_build(self):
         """
-        Sends current configuration to the builder to build
-        :return: True if success, False otherwise
+        Sends current configuration to the builder to build.
+        The conflicts were found as components were added, so nothing is checked again here
+        :return: True if success, False for conflicts or a component type taken twice, see show_violations
         """
-        return self._builder.build(self.current_components)
+        with metrics.timer('client.send_build'):
+            return self._session.ok()
 
     def show_conflict(self):
         """
         show conflicts in current build set
         :return: list of conflicts
         """
-        return self._builder.conflicts
+        return self._session.conflicts()
+
+    def show_violations(self):
+        """
+        show component types taken by more than one component
+        :return: dict mapping component type to the competing components
+        """
+        return self._session.violations()
 
     def show_suggestions(self):
         """
         show suggestions to resolve conflicts
         :return: dict of suggestions per component
         """
-        return self._builder.suggestions
+        return self._session.suggestions()
+
+    def show_alternatives(self, component, k: int = 5):
+        """
+        show the parts most like a component of the current build that fit the rest of it
+        :param component: component of the current build, e.g. one in a conflict
+        :param k: number of alternatives
+        :return: list of components, most similar first
+        """
+        return self._builder.alternatives(component, self.current_components, k)
 
     def save_components_to_json(self, filename: str):
         """
@@ -60,11 +93,19 @@ class Client:
         :return: None
         """
         component_list = list(self.current_components)
-        j_write = json.dumps([vars(comp) for comp in component_list])
+        j_write = json.dumps([comp.to_dict() for comp in component_list])
         f_j = open(filename, "w")
         f_j.write(j_write)
         f_j.close()
 
+    def save_to_registry(self, registry):
+        """
+        saves the current component set in a BuildRegistry, which revalidates it as the catalog changes
+        :param registry: registry to save to
+        :return: build ID
+        """
+        return registry.register(self.current_components)
+
     def load_components_from_json(self, filename: str):
         """
         Loads data from given file into current component set
@@ -79,7 +120,8 @@ class Client:
         self.current_components = result
         f_r.close()
 
-    def recreate_from_json(self, data: dict):
+    @staticmethod
+    def recreate_from_json(data: dict):
         """
         recreates a component from json dict
         :param data: component data
@@ -0,0 +1,97 @@
+import argparse
+import os
+import pickle
+from CompatibilityDatabase import CompatibilityDatabase, SNAPSHOT_FORMAT, asymmetric_edges, upper_rows, full_rows
+
+'''
+Audits a dependency file for one-way compatibilities and converts it between
+the directed and the undirected layout, e.g.
+
+    python CompatibilityAudit.py dependency.pkl --inventory inventory.pkl
+    python CompatibilityAudit.py dependency.pkl --convert undirected --output dependency_undirected.pkl
+
+Converting to undirected keeps only the mutual edges, so the report should be
+checked first. Files from before integer ids are read, but need to be loaded
+and saved once by CompatibilityDatabase before they can be converted.
+'''
+
+
+def load(dependency_file: str, inventory_file: str = None) -> tuple:
+    """
+    reads a dependency file of any layout
+    :param dependency_file: pickled dependency file
+    :param inventory_file: optional matching inventory file, used for component names
+    :return: (uuids or None for uuid keyed files, directed dependencies, undirected flag of the file, names,
+        rules state or None)
+    """
+    f_dep = open(dependency_file, "rb")
+    dependencies = pickle.load(f_dep)
+    f_dep.close()
+
+    inventory = None
+    if inventory_file is not None:
+        f_i = open(inventory_file, "rb")
+        inventory = pickle.load(f_i)
+        f_i.close()
+
+    if isinstance(dependencies, dict):
+        # keyed by uuid, the inventory maps component to uuid
+        names = {comp_uuid: comp.name for (comp, comp_uuid) in inventory.items()} if inventory else dict()
+        return None, dependencies, False, names, None
+
+    (uuids, rows) = dependencies[1:3]
+    undirected = dependencies[0] >= 3 and dependencies[3]
+    names = {comp_id: comp.name for (comp_id, comp) in enumerate(inventory)} if inventory else dict()
+    rules = dependencies[4] if dependencies[0] >= 4 else None
+    return uuids, (full_rows(rows) if undirected else rows), undirected, names, rules
+
+
+def report(dependencies: dict, names: dict) -> list:
+    """
+    lists the one-way edges of a directed dependencies dictionary
+    :param dependencies: dict mapping component key to its set of compatible keys
+    :param names: dict mapping component key to its name
+    :return: list of printable lines
+    """
+    one_way = asymmetric_edges(dependencies)
+    edges = sum(len(row) for row in dependencies.values())
+    lines = [str(len(dependencies)) + ' components, ' + str(edges) + ' directed edges, ' +
+             str(len(one_way)) + ' one-way']
+    for (comp, other) in one_way:
+        lines.append('  ' + str(names.get(comp, comp)) + ' -> ' + str(names.get(other, other)) +
+                     ' (not ' + str(names.get(other, other)) + ' -> ' + str(names.get(comp, comp)) + ')')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report one-way compatibilities and convert dependency files')
+    parser.add_argument('dependency', help='dependency file to audit')
+    parser.add_argument('--inventory', help='matching inventory file, to print component names')
+    parser.add_argument('--convert', choices=['directed', 'undirected'], help='layout to convert to')
+    parser.add_argument('--output', help='converted file, defaults to replacing the input')
+    parser.add_argument('--force', action='store_true', help='convert to undirected even with one-way edges')
+    args = parser.parse_args()
+
+    (uuids, dependencies, undirected, names, rules) = load(args.dependency, args.inventory)
+    print(args.dependency + ': ' + ('undirected' if undirected else 'directed') + ' layout')
+    lines = report(dependencies, names)
+    for line in lines:
+        print(line)
+
+    if args.convert is None:
+        return
+    if uuids is None:
+        parser.error('uuid keyed file, load and save it with CompatibilityDatabase first')
+    one_way = len(asymmetric_edges(dependencies))
+    if args.convert == 'undirected' and one_way and not args.force:
+        parser.error(str(one_way) + ' one-way edges would be dropped, use --force to convert anyway')
+
+    rows = upper_rows(dependencies) if args.convert == 'undirected' else dependencies
+    # rules and exclusions are carried over as they are, see CompatibilityRules
+    CompatibilityDatabase._dump((SNAPSHOT_FORMAT, uuids, rows, args.convert == 'undirected', rules),
+                                args.output or args.dependency)
+    print('wrote ' + os.path.abspath(args.output or args.dependency))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,62 @@
+import os
 import pickle
-import time
+import sys
 import warnings
+import weakref
+from contextlib import nullcontext
+from itertools import islice
 from Components import *
+from ComponentIndex import ComponentIndex
+from CompatibilityRules import RuleSet
+from SimilarityIndex import SimilarityIndex
+from SparseSet import SparseSet
+from Metrics import metrics
+from CatalogFile import MappedCatalog, CatalogInventory, CatalogIdChart, CatalogDependencies, CatalogUuids, \
+    CatalogUuidIndex, CatalogEngine, write_catalog, pack_catalog
 from uuid import uuid1
-from threading import Thread
+from threading import Thread, Event, RLock
+
+# layout version of the pickled dependency file, files without one are keyed by uuid.
+# Version 2 files hold (2, uuids, dependencies), version 3 adds the undirected flag.
+SNAPSHOT_FORMAT = 4
+
+# items bulk_update and bulk_add take from their input per locked pass and log record
+BULK_CHUNK = 10000
+
+
+def asymmetric_edges(dependencies) -> list:
+    """
+    one-way compatibilities: other is in the row of comp_id but comp_id is not in the row of other
+    :param dependencies: dict mapping component ID to its set of compatible IDs
+    :return: sorted list of (comp_id, other) pairs
+    """
+    return sorted((comp_id, other) for (comp_id, row) in dependencies.items() for other in row
+                  if comp_id not in dependencies.get(other, ()))
+
+
+def upper_rows(dependencies) -> dict:
+    """
+    undirected layout: every mutual edge is kept once, in the row of its smaller ID.
+    One-way edges are dropped, builds already treat them as conflicts.
+    :param dependencies: dict mapping component ID to its set of compatible IDs
+    :return: dict mapping component ID to the frozenset of compatible IDs not smaller than it
+    """
+    return {comp_id: frozenset(other for other in row
+                               if other >= comp_id and comp_id in dependencies.get(other, ()))
+            for (comp_id, row) in dependencies.items()}
+
+
+def full_rows(dependencies) -> dict:
+    """
+    expands the undirected layout back into one row per component holding all its compatible IDs
+    :param dependencies: dict mapping component ID to the compatible IDs not smaller than it
+    :return: dict mapping component ID to the frozenset of all compatible IDs
+    """
+    rows = {comp_id: set(row) for (comp_id, row) in dependencies.items()}
+    for (comp_id, row) in dependencies.items():
+        for other in row:
+            rows.setdefault(other, set()).add(comp_id)
+    return {comp_id: frozenset(row) for (comp_id, row) in rows.items()}
 
 
 class CompatibilityDatabase:
@@ -11,40 +64,223 @@ class CompatibilityDatabase:
     The database class. In this example, it is collection of key-value stores.
     Ideally should be an SQL database as it is easier for users
     and manufacturers to filter components they need.
+
+    Concurrency: readers never lock. Compatibility rows are never changed in
+    place, writers build a new row and swap it in (copy-on-write), and a new
+    component is published by its inventory entry, written after everything
+    else about it. Writers serialize on a lock and bump version. The persister
+    takes a shallow point-in-time copy under the lock and pickles it outside.
+
+    Undirected mode is for catalogs where compatibility is symmetric by policy:
+    an edge entered in either direction holds both ways and is stored once,
+    in the row of the smaller ID, so rows take about half the memory.
+
+    With a storage backend (init_from_backend, e.g. SQLiteBackend) the
+    collections above are views onto the backend and every change is written
+    to it directly, instead of the pickled snapshots.
+
+    Rules (add_rule) make whole groups of components compatible by their
+    attributes without storing the edges, they are compiled into a pair of
+    bit masks per component and evaluated at query time. Explicit edges add
+    to them and exclusions (exclude_compatibility) override both.
+
+    Compact mode keeps every row as a SparseSet, a sorted 4 byte ID array or
+    a bitmap, for catalogs too large for frozensets of ints.
     """
 
-    def __init__(self, inventory_file: str, dependency_file: str):
+    def __init__(self, inventory_file: str, dependency_file: str, engine=None, wal_file: str = None,
+                 compact_every: int = 1000, compact_bytes: int = 1 << 20, undirected: bool = False,
+                 compact: bool = False, gauge: str = 'database'):
         """
         init function
         :param inventory_file: file to save and load inventory from
         :param dependency_file: file to save and load dependency dependencies from
+        :param engine: optional storage engine answering compatibility queries, e.g. BitsetEngine
+        :param wal_file: optional write-ahead log, changes are appended here and snapshots are written lazily
+        :param compact_every: in WAL mode, number of logged changes that triggers a new snapshot
+        :param compact_bytes: in WAL mode, log size in bytes that triggers a new snapshot
+        :param undirected: store every edge once and treat it as symmetric, see upper_rows
+        :param compact: keep the rows as compressed SparseSets instead of frozensets, for large sparse catalogs
+        :param gauge: name of the stats gauge in metrics, None when an owner reports for this database
         """
         # Initializing file
         self.inventory_file = inventory_file
         self.dependency_file = dependency_file
+        self.wal_file = wal_file
+        self.compact_every = compact_every
+        self.compact_bytes = compact_bytes
+        self.undirected = undirected
+        self.compact = compact
 
-        # dictionary mapping object to its id
+        # dictionary mapping object to its id, ids are dense integers 0..n-1
         self.inventory = dict()
 
-        # reverse inventory mapping id to object
-        self.id_chart = dict()
+        # reverse inventory, list of objects indexed by id
+        self.id_chart = list()
+
+        # uuid of every id, the external alias of a component, and the reverse mapping
+        self.uuids = list()
+        self.uuid_index = dict()
 
         # Current dependencies is a dictionary which keeps track of dependencies
-        # key: tuple(component, type)
-        # value: set of all compatible objects as tuple(component, type)
+        # key: component id
+        # value: set of ids of all compatible components, in undirected mode only those not smaller than the key.
+        # Rows are frozensets, or SparseSets in compact mode
         self.dependencies = dict()
 
+        # optional engine kept in sync with dependencies for fast queries
+        self.engine = engine
+
+        # attribute rules and exclusions evaluated on top of the explicit edges
+        self.rules = RuleSet(undirected)
+
+        # memory-mapped catalog the database is answering from, see init_from_catalog
+        self.catalog = None
+
+        # storage backend holding the catalog instead of memory, see init_from_backend
+        self.backend = None
+        self._detached_engine = None
+
+        # secondary indexes for query, built on first use and kept up to date afterwards
+        self.index = None
+
+        # MinHash index of the rows for similar, also built on first use
+        self.similarity = None
+
+        # rows with the rules applied, see row. Component ID to ((components, version), row), for one generation
+        self._rule_rows = dict()
+        self._rule_rows_generation = 0
+
+        # number of changes not yet in the snapshot files
+        self.dirty = 0
+        self._wal = None
+
+        # writers hold _lock, only one snapshot is written at a time
+        self._lock = RLock()
+        self._persist_lock = RLock()
+
+        # bumped by every change
+        self.version = 0
+
+        # per component change counters, bumped for both ends of every new edge, and the
+        # generation, bumped when the whole store is replaced. BuildCache stamps entries with them.
+        self.component_versions = dict()
+        self.generation = 0
+
+        # callables told about every change, with the IDs whose rows changed or None for all, e.g. BuildRegistry.
+        # They run under the writer lock and must only take note.
+        self.listeners = []
+
         self.initialized = False
+        self._stop = Event()
         self.write_thread = Thread(target=self.periodic_write, daemon=True)
 
+        self.gauge = None
+        if gauge is not None:
+            me = weakref.ref(self)
+            self.gauge = metrics.gauge(gauge, lambda: me().stats() if me() is not None else None)
+
     def fill_id_chart(self):
         """
-        fills id_chart
+        fills id_chart and uuid_index
         """
+        self.id_chart = [None] * len(self.inventory)
         for (key, value) in self.inventory.items():
             self.id_chart[value] = key
+        self.uuid_index = {comp_uuid: comp_id for (comp_id, comp_uuid) in enumerate(self.uuids)}
+
+    def _register(self, component: Component, compatibility_set=frozenset()) -> int:
+        """
+        gives a new component the next id and a fresh uuid.
+        The inventory entry is written last, readers only find the component once it is complete.
+        :param component: component to register
+        :param compatibility_set: ids the component is compatible with
+        :return: id of the component
+        """
+        component = intern_component(component)
+        if self.backend is not None:
+            comp_id = len(self.backend)
+            self.rules.add_component(comp_id, component)
+            if self.similarity is not None:
+                self.similarity.add(comp_id, component.comp_type, () if self.undirected else compatibility_set)
+            self.backend.add_component(comp_id, str(uuid1()), component,
+                                       () if self.undirected else compatibility_set)
+            if self.undirected:
+                self._add_edges({comp_id: set(compatibility_set)})
+            else:
+                self._touch(compatibility_set)
+            return comp_id
+
+        comp_id = len(self.uuids)
+        self.rules.add_component(comp_id, component)
+        if self.similarity is not None:
+            self.similarity.add(comp_id, component.comp_type, () if self.undirected else compatibility_set)
+        self.uuids.append(str(uuid1()))
+        self.uuid_index[self.uuids[comp_id]] = comp_id
+        self.id_chart.append(component)
+        if self.undirected:
+            # the new id is the largest, so its edges go into the rows of the others
+            self.dependencies[comp_id] = self._new_row()
+            if self.engine is not None:
+                self.engine.add_component(comp_id, ())
+            self._add_edges({comp_id: set(compatibility_set)})
+        else:
+            self.dependencies[comp_id] = self._new_row(compatibility_set)
+            if self.engine is not None:
+                self.engine.add_component(comp_id, compatibility_set)
+            self._touch(compatibility_set)
+        if self.index is not None:
+            self.index.add(component, comp_id)
+        self.inventory[component] = comp_id
+        return comp_id
+
+    def _new_row(self, comp_ids=()):
+        """
+        :return: row holding the given IDs, a SparseSet in compact mode and a frozenset otherwise
+        """
+        return SparseSet(comp_ids) if self.compact else frozenset(comp_ids)
+
+    def _compact_rows(self):
+        """
+        converts loaded rows to the kind this database keeps, e.g. after loading a snapshot written
+        in the other mode: SparseSets in compact mode, frozensets otherwise
+        """
+        kind = SparseSet if self.compact else frozenset
+        if any(type(row) is not kind for row in self.dependencies.values()):
+            self.dependencies = {comp_id: row if type(row) is kind else kind(row)
+                                 for (comp_id, row) in self.dependencies.items()}
+
+    def _touch(self, comp_ids):
+        """
+        bumps the version of the given components, after their rows changed, and tells the listeners
+        :param comp_ids: iterable of component IDs
+        :return: None
+        """
+        if self.listeners:
+            comp_ids = list(comp_ids)
+        versions = self.component_versions
+        for comp_id in comp_ids:
+            versions[comp_id] = versions.get(comp_id, 0) + 1
+        for listener in self.listeners:
+            listener(comp_ids)
+
+    def _new_generation(self):
+        """
+        starts a new generation after the whole store was replaced, earlier component versions no longer apply
+        """
+        self.component_versions = dict()
+        self.generation += 1
+        for listener in self.listeners:
+            listener(None)
 
-    def cid(self, component: Component) -> str:
+    def load_engine(self):
+        """
+        rebuilds the storage engine from dependencies
+        """
+        if self.engine is not None:
+            self.engine.load(self.dependencies)
+
+    def cid(self, component: Component) -> int:
         """
         returns component ID in the inventory
         :param component: Component to fetch ID for
@@ -52,7 +288,7 @@ class CompatibilityDatabase:
         """
         return self.inventory[component]
 
-    def component_from_id(self, comp_id: str):
+    def component_from_id(self, comp_id: int):
         """
         returns component with given ID
         :param comp_id:
@@ -60,6 +296,22 @@ class CompatibilityDatabase:
         """
         return self.id_chart[comp_id]
 
+    def uuid(self, component: Component) -> str:
+        """
+        returns the uuid of a component, its stable external alias
+        :param component: Component to fetch the uuid for
+        :return: uuid string
+        """
+        return self.uuids[self.inventory[component]]
+
+    def component_from_uuid(self, comp_uuid: str):
+        """
+        returns component with given uuid
+        :param comp_uuid: uuid string
+        :return: Component with given uuid
+        """
+        return self.id_chart[self.uuid_index[comp_uuid]]
+
     def default_init(self):
         """
         An example initialization of the dependencies state
@@ -85,58 +337,227 @@ class CompatibilityDatabase:
         # Add to inventory
         maruti_ids = list()
         for comp in [maruti_body, maruti_engine, maruti_battery, maruti_wheels, maruti_radio]:
-            self.inventory[comp] = str(uuid1())
-            maruti_ids.append(self.inventory[comp])
+            maruti_ids.append(self._register(comp))
 
         tesla_ids = list()
         for comp_t in [tesla_body, tesla_engine, tesla_battery, tesla_wheels, tesla_radio]:
-            self.inventory[comp_t] = str(uuid1())
-            tesla_ids.append(self.inventory[comp_t])
+            tesla_ids.append(self._register(comp_t))
 
-        # Add dependencies dependency for Maruti
-        self.dependencies[self.cid(maruti_body)] = set(maruti_ids + [self.cid(tesla_engine), self.cid(tesla_wheels)])
-        self.dependencies[self.cid(maruti_engine)] = set([self.cid(tesla_radio), self.cid(tesla_body)] + maruti_ids)
-        self.dependencies[self.cid(maruti_battery)] = set(maruti_ids + [self.cid(tesla_wheels)])
+        # Add dependencies dependency for Maruti, rows are replaced whole like everywhere else
+        self.dependencies[self.cid(maruti_body)] = self._new_row(
+            maruti_ids + [self.cid(tesla_engine), self.cid(tesla_wheels)])
+        self.dependencies[self.cid(maruti_engine)] = self._new_row(
+            [self.cid(tesla_radio), self.cid(tesla_body)] + maruti_ids)
+        self.dependencies[self.cid(maruti_battery)] = self._new_row(maruti_ids + [self.cid(tesla_wheels)])
         m_wheel_list = maruti_ids + tesla_ids
         m_wheel_list.remove(self.cid(tesla_wheels))
-        self.dependencies[self.cid(maruti_wheels)] = set(m_wheel_list)
+        self.dependencies[self.cid(maruti_wheels)] = self._new_row(m_wheel_list)
         m_radio_list = maruti_ids + tesla_ids
         m_radio_list.remove(self.cid(tesla_radio))
-        self.dependencies[self.cid(maruti_radio)] = set(m_radio_list)
+        self.dependencies[self.cid(maruti_radio)] = self._new_row(m_radio_list)
 
         # Add dependencies dependency for Tesla
-        self.dependencies[self.cid(tesla_body)] = set(tesla_ids + [self.cid(maruti_engine), self.cid(maruti_wheels)])
-        self.dependencies[self.cid(tesla_engine)] = set(tesla_ids + [self.cid(maruti_wheels), self.cid(maruti_radio)])
-        self.dependencies[self.cid(tesla_battery)] = set(tesla_ids + [self.cid(maruti_engine), self.cid(maruti_wheels)])
+        self.dependencies[self.cid(tesla_body)] = self._new_row(
+            tesla_ids + [self.cid(maruti_engine), self.cid(maruti_wheels)])
+        self.dependencies[self.cid(tesla_engine)] = self._new_row(
+            tesla_ids + [self.cid(maruti_wheels), self.cid(maruti_radio)])
+        self.dependencies[self.cid(tesla_battery)] = self._new_row(
+            tesla_ids + [self.cid(maruti_engine), self.cid(maruti_wheels)])
         t_wheel_set = set(maruti_ids + tesla_ids)
         t_wheel_set.remove(self.cid(maruti_wheels))
-        self.dependencies[self.cid(tesla_wheels)] = t_wheel_set
+        self.dependencies[self.cid(tesla_wheels)] = self._new_row(t_wheel_set)
         t_radio_set = set(maruti_ids + tesla_ids)
         t_radio_set.remove(self.cid(maruti_radio))
-        self.dependencies[self.cid(tesla_radio)] = t_radio_set
+        self.dependencies[self.cid(tesla_radio)] = self._new_row(t_radio_set)
+
+        if self.undirected:
+            self.dependencies = upper_rows(self.dependencies)
+        self._compact_rows()
+        self.load_engine()
+        self.rules.compile(self.id_chart)
+        self.index = None
+        self.similarity = None
+        self._new_generation()
 
-        self.fill_id_chart()
+        # none of the above is in the log, so start from a fresh snapshot
+        self.dirty += 1
+        if self.wal_file is not None:
+            self.write_state_to_disk()
 
     def periodic_write(self):
         """
-        Periodically saves to disk every 10 seconds
+        Periodically saves to disk every 10 seconds, when needs_snapshot says so
         """
         while self.initialized is True:
-            # print('saving.....')
-            self.write_state_to_disk()
-            time.sleep(10.0)
+            if self.needs_snapshot():
+                self.write_state_to_disk()
+            elif metrics.enabled:
+                metrics.incr('persist.skipped')
+            self._stop.wait(10.0)
+
+    def needs_snapshot(self) -> bool:
+        """
+        decides whether the snapshot files are due for a rewrite.
+        Without a log any change does, with a log only enough changes or a large log do.
+        A storage backend commits every change itself and a database without files has nowhere to write,
+        neither ever needs one.
+        :return: True if write_state_to_disk should run
+        """
+        if self.dirty == 0 or self.backend is not None or self.inventory_file is None:
+            return False
+        if self.wal_file is None:
+            return True
+        return self.dirty >= self.compact_every or self._wal_size() >= self.compact_bytes
+
+    def _wal_size(self) -> int:
+        """
+        :return: current size of the write-ahead log in bytes
+        """
+        try:
+            return os.path.getsize(self.wal_file)
+        except OSError:
+            return 0
+
+    def _log(self, record: tuple):
+        """
+        appends a change record to the write-ahead log and counts it as dirty
+        :param record: ('a', component, ID, uuid, compatible IDs), ('e', ID, compatible ID),
+            ('b', ((component, ID, uuid), ...), ((ID, compatible IDs), ...)) for a bulk chunk,
+            ('r', source selector, target selector) for a rule or ('x', ID, excluded ID)
+        :return: None
+        """
+        if self.wal_file is not None:
+            if self._wal is None:
+                self._wal = open(self.wal_file, "ab")
+            pickle.dump(record, self._wal, pickle.HIGHEST_PROTOCOL)
+            self._wal.flush()
+        self.dirty += 1
+        self.version += 1
+
+    def replay_log(self):
+        """
+        applies the records of the write-ahead log on top of the loaded snapshot.
+        Replaying is idempotent, so records already in the snapshot are harmless.
+        A torn record at the end of the log, left by a crash, is cut off.
+        :return: None
+        """
+        if self.wal_file is None or not os.path.exists(self.wal_file):
+            return
+
+        f_w = open(self.wal_file, "rb")
+        good = 0
+        while True:
+            try:
+                record = pickle.load(f_w)
+            except EOFError:
+                break
+            except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                break
+            if record[0] == 'a':
+                (_, component, comp_id, comp_uuid, compatible) = record
+                if comp_id == len(self.uuids):
+                    self.uuids.append(comp_uuid)
+                self.inventory[intern_component(component)] = comp_id
+                self.dependencies.setdefault(comp_id, self._new_row())
+                self._merge_rows({comp_id: compatible})
+            elif record[0] == 'e':
+                self._merge_rows({record[1]: (record[2],)})
+            elif record[0] == 'b':
+                (_, components, rows) = record
+                for (component, comp_id, comp_uuid) in components:
+                    if comp_id == len(self.uuids):
+                        self.uuids.append(comp_uuid)
+                    self.inventory[intern_component(component)] = comp_id
+                    self.dependencies.setdefault(comp_id, self._new_row())
+                self._merge_rows(dict(rows))
+            elif record[0] == 'r':
+                self.rules.add_rule(record[1], record[2])
+            elif record[0] == 'x':
+                self.rules.exclude(record[1], record[2])
+            good = f_w.tell()
+            self.dirty += 1
+            if metrics.enabled:
+                metrics.incr('persist.replayed')
+        f_w.close()
+
+        if good != os.path.getsize(self.wal_file):
+            warnings.warn('Discarding torn record at the end of ' + self.wal_file)
+            os.truncate(self.wal_file, good)
+
+    def snapshot(self) -> tuple:
+        """
+        consistent point-in-time copy of the database.
+        Only the containers are copied, rows are shared since they are never changed in place.
+        :return: (components in id order, uuids, dependencies, rules state, log offset, dirty count, version)
+        """
+        with self._lock:
+            if self._wal is not None:
+                offset = self._wal.tell()
+            elif self.wal_file is not None:
+                offset = self._wal_size()
+            else:
+                offset = 0
+            return list(self.id_chart), list(self.uuids), dict(self.dependencies), self.rules.state(), offset, \
+                self.dirty, self.version
 
     def write_state_to_disk(self):
         """
-        Writes the current database state to disk
+        Writes the current database state to disk.
+        The inventory file holds the components in id order, the dependency file
+        (SNAPSHOT_FORMAT, uuids, dependencies, undirected, rules state).
+        Files are replaced atomically, writers keep going while they are pickled, and
+        afterwards the records the snapshot covers are dropped from the write-ahead log.
         """
-        f_i = open(self.inventory_file, "wb")
-        pickle.dump(self.inventory, f_i)
-        f_i.close()
+        with self._persist_lock, metrics.timer('persist.write'):
+            with metrics.timer('persist.snapshot'):
+                (components, uuids, dependencies, rules, offset, dirty, _) = self.snapshot()
+            self._dump(components, self.inventory_file)
+            self._dump((SNAPSHOT_FORMAT, uuids, dependencies, self.undirected, rules), self.dependency_file)
+            if metrics.enabled:
+                metrics.incr('persist.writes')
+                metrics.incr('persist.bytes_written', os.path.getsize(self.dependency_file))
+
+            with self._lock:
+                if self.wal_file is not None:
+                    self._trim_log(offset)
+                self.dirty -= dirty
 
-        f_dep = open(self.dependency_file, "wb")
-        pickle.dump(self.dependencies, f_dep)
-        f_dep.close()
+    def _trim_log(self, offset: int):
+        """
+        drops the first offset bytes of the write-ahead log, keeping records appended after them
+        :param offset: log size at the time of the snapshot
+        :return: None
+        """
+        if self._wal is not None:
+            self._wal.close()
+        tail = b''
+        if os.path.exists(self.wal_file):
+            f_w = open(self.wal_file, "rb")
+            f_w.seek(offset)
+            tail = f_w.read()
+            f_w.close()
+        f_tmp = open(self.wal_file + ".tmp", "wb")
+        f_tmp.write(tail)
+        f_tmp.flush()
+        os.fsync(f_tmp.fileno())
+        f_tmp.close()
+        os.replace(self.wal_file + ".tmp", self.wal_file)
+        self._wal = open(self.wal_file, "ab")
+
+    @staticmethod
+    def _dump(obj, filename: str):
+        """
+        pickles an object next to filename and moves it into place
+        :param obj: object to save
+        :param filename: destination file
+        :return: None
+        """
+        f_tmp = open(filename + ".tmp", "wb")
+        pickle.dump(obj, f_tmp)
+        f_tmp.flush()
+        os.fsync(f_tmp.fileno())
+        f_tmp.close()
+        os.replace(filename + ".tmp", filename)
 
     def init_from_file(self):
         """
@@ -147,15 +568,189 @@ class CompatibilityDatabase:
             self.initialized = True
             self.write_thread.start()
 
-        f_i = open(self.inventory_file, "rb")
-        self.inventory = pickle.load(f_i)
-        f_i.close()
+        with metrics.timer('db.init_from_file'):
+            f_i = open(self.inventory_file, "rb")
+            inventory = pickle.load(f_i)
+            f_i.close()
 
-        f_dep = open(self.dependency_file, "rb")
-        self.dependencies = pickle.load(f_dep)
-        f_dep.close()
+            f_dep = open(self.dependency_file, "rb")
+            dependencies = pickle.load(f_dep)
+            f_dep.close()
 
-        self.fill_id_chart()
+            undirected = False
+            rules = None
+            if isinstance(dependencies, dict):
+                self._load_uuid_snapshot(inventory, dependencies)
+            else:
+                (self.uuids, self.dependencies) = dependencies[1:3]
+                undirected = dependencies[0] >= 3 and dependencies[3]
+                rules = dependencies[4] if dependencies[0] >= 4 else None
+                self.inventory = {intern_component(comp): comp_id for (comp_id, comp) in enumerate(inventory)}
+            self._convert_layout(undirected)
+            self._compact_rows()
+            self.rules.restore(rules)
+
+            self.replay_log()
+            self.fill_id_chart()
+            self.load_engine()
+            self.rules.compile(self.id_chart)
+            self.index = None
+            self.similarity = None
+            self._new_generation()
+
+    def _convert_layout(self, undirected: bool):
+        """
+        brings loaded dependencies into the layout of this database.
+        Directed rows are only made undirected when no edge is one-way, CompatibilityAudit reports those.
+        :param undirected: layout of the loaded dependencies
+        :return: None
+        """
+        if undirected == self.undirected:
+            return
+        if undirected:
+            self.dependencies = full_rows(self.dependencies)
+            return
+        one_way = asymmetric_edges(self.dependencies)
+        if one_way:
+            raise ValueError(str(len(one_way)) + ' one-way edges in ' + str(self.dependency_file) +
+                             ', audit and convert it with CompatibilityAudit first')
+        self.dependencies = upper_rows(self.dependencies)
+
+    def _load_uuid_snapshot(self, inventory: dict, dependencies: dict):
+        """
+        converts files written before integer ids, keyed by uuid, into the current layout
+        :param inventory: dict mapping component to uuid
+        :param dependencies: dict mapping uuid to set of uuids
+        :return: None
+        """
+        self.uuids = list(inventory.values())
+        number = {comp_uuid: comp_id for (comp_id, comp_uuid) in enumerate(self.uuids)}
+        self.inventory = {intern_component(comp): number[comp_uuid] for (comp, comp_uuid) in inventory.items()}
+        self.dependencies = {comp_id: set() for comp_id in range(len(self.uuids))}
+        for (comp_uuid, compatible) in dependencies.items():
+            if comp_uuid in number:
+                self.dependencies[number[comp_uuid]] = {number[other] for other in compatible if other in number}
+
+    def write_catalog(self, catalog_file: str):
+        """
+        writes the current state as a memory-mappable catalog file, see CatalogFile
+        :param catalog_file: file to write
+        """
+        if self.rules:
+            raise ValueError('Catalog files hold explicit edges only, this database has rules')
+        with self._lock:
+            dependencies = full_rows(self.dependencies) if self.undirected else self.dependencies
+            write_catalog(catalog_file, self.inventory, dependencies, self.uuids)
+
+    def catalog_image(self) -> list:
+        """
+        the current state in the catalog layout, for catalogs kept elsewhere than in a file, e.g. SharedCatalog
+        :return: list of byte strings, see CatalogFile.pack_catalog
+        """
+        if self.rules:
+            raise ValueError('Catalog files hold explicit edges only, this database has rules')
+        with self._lock:
+            dependencies = full_rows(self.dependencies) if self.undirected else self.dependencies
+            return pack_catalog(self.inventory, dependencies, self.uuids)
+
+    def init_from_catalog(self, catalog_file: str, verify: bool = False):
+        """
+        initialize the database by mapping a catalog file written by write_catalog.
+        Nothing is deserialized, queries read the mapped file directly until the
+        first change, which materializes the catalog into the in-memory store.
+        :param catalog_file: file to map
+        :param verify: verify the checksum of every section before use
+        """
+
+        if not self.initialized:
+            self.initialized = True
+            self.write_thread.start()
+
+        self.init_from_mapped(MappedCatalog(catalog_file, verify=verify))
+
+    def init_from_mapped(self, catalog: MappedCatalog):
+        """
+        initialize the database from an already mapped catalog, e.g. a generation of a
+        SharedCatalog. Calling it again with a newer catalog switches over to it.
+        :param catalog: mapped catalog to answer from
+        """
+        self.initialized = True
+        if self.catalog is None:
+            self._detached_engine = self.engine
+        self.catalog = catalog
+        self.inventory = CatalogInventory(self.catalog)
+        self.id_chart = CatalogIdChart(self.catalog)
+        self.uuids = CatalogUuids(self.catalog)
+        self.uuid_index = CatalogUuidIndex(self.catalog)
+        self.dependencies = CatalogDependencies(self.catalog)
+        self.engine = CatalogEngine(self.catalog)
+        self.rules = RuleSet(self.undirected)
+        self.index = None
+        self.similarity = None
+        self._new_generation()
+
+    def init_from_backend(self, backend):
+        """
+        initialize the database from a storage backend, e.g. SQLiteBackend.
+        The catalog stays in the backend: queries and changes go straight to it,
+        nothing is loaded into memory and no snapshots are written.
+        :param backend: backend with the MappedCatalog read methods plus writes, see SQLiteBackend
+        """
+        if backend.undirected != self.undirected:
+            raise ValueError('Backend layout is ' + ('undirected' if backend.undirected else 'directed') +
+                             ', the database expects the other one')
+        self.initialized = True
+        self.backend = backend
+        self.inventory = CatalogInventory(backend)
+        self.id_chart = CatalogIdChart(backend)
+        self.uuids = CatalogUuids(backend)
+        self.uuid_index = CatalogUuidIndex(backend)
+        self.dependencies = CatalogDependencies(backend)
+        self.engine = backend
+        self.rules.restore(backend.load_rules(), self.id_chart)
+        self.index = None
+        self.similarity = None
+        self._new_generation()
+
+    def write_backend(self, backend):
+        """
+        copies the current state into a storage backend, replacing what it held
+        :param backend: backend to fill, e.g. SQLiteBackend
+        """
+        with self._lock:
+            backend.load_state(self.inventory, self.dependencies, self.uuids, self.undirected)
+            backend.save_rules(self.rules.state())
+
+    def materialize(self):
+        """
+        copies a mapped catalog into the in-memory store so it can be changed
+        """
+        if self.catalog is None:
+            return
+        with self._lock:
+            catalog = self.catalog
+            # record numbers become the ids, so readers still on the catalog agree with the new store.
+            # The catalog is not closed here, a concurrent reader may still use it.
+            inventory = {intern_component(catalog.component(number)): number for number in range(len(catalog))}
+            dependencies = {number: frozenset(catalog.row(number)) for number in range(len(catalog))}
+            self.dependencies = upper_rows(dependencies) if self.undirected else dependencies
+            self._compact_rows()
+            self.uuids = [catalog.uuid(number) for number in range(len(catalog))]
+            self.id_chart = list(inventory)
+            self.uuid_index = {comp_uuid: comp_id for (comp_id, comp_uuid) in enumerate(self.uuids)}
+            if self._detached_engine is not None:
+                self._detached_engine.load(self.dependencies)
+            self.engine = self._detached_engine
+            self.index = None
+            self.similarity = None
+            self.catalog = None
+            self.inventory = inventory
+            self._new_generation()
+
+            # the ids may differ from the pickled snapshot, which a log must not be replayed over
+            self.dirty += 1
+            if self.wal_file is not None:
+                self.write_state_to_disk()
 
     def add_component(self, component: Component, compatibility_set: set):
         """
@@ -164,12 +759,13 @@ class CompatibilityDatabase:
         :param compatibility_set: Compatibility set for the Component
         :return: None
         """
-        if component not in self.inventory:
-            self.inventory[component] = str(uuid1())
-            self.dependencies[self.cid(component)] = compatibility_set
-            self.id_chart[self.inventory[component]] = component
-        else:
-            warnings.warn('Component already exists. Use update_compatibility to add more compatible items')
+        self.materialize()
+        with self._lock, metrics.timer('db.add_component'):
+            if component not in self.inventory:
+                comp_id = self._register(component, compatibility_set)
+                self._log(('a', component, comp_id, self.uuids[comp_id], tuple(compatibility_set)))
+            else:
+                warnings.warn('Component already exists. Use update_compatibility to add more compatible items')
 
     def update_compatibility(self, component, new_item):
         """
@@ -178,13 +774,245 @@ class CompatibilityDatabase:
         :param new_item: item to add in compatibility set
         :return: None
         """
+        self.materialize()
+        if metrics.enabled:
+            metrics.incr('db.update_compatibility')
         if component not in self.inventory:
             raise KeyError('Component not in inventory')
 
         elif new_item not in self.inventory:
             raise KeyError('new compatible item not in inventory')
         else:
-            (self.dependencies[self.cid(component)]).add(self.cid(new_item))
+            with self._lock:
+                self._add_edges({self.cid(component): {self.cid(new_item)}})
+                self._log(('e', self.cid(component), self.cid(new_item)))
+
+    def add_rule(self, source: dict, target: dict, symmetric: bool = True):
+        """
+        makes every component matching source compatible with every component matching target.
+        Selectors are dicts of field to value over ComponentIndex.INDEXED_FIELDS, e.g.
+        add_rule({'comp_type': Component_Type.Wheels, 'diameter': Diameter.Eighteen},
+                 {'comp_type': Component_Type.Body, 'structure': Structure.Sedan})
+        :param source: selector of the components the rule is about
+        :param target: selector of the components they become compatible with
+        :param symmetric: also make the targets compatible with the sources, always so in undirected mode
+        :return: None
+        """
+        self.materialize()
+        with self._lock, metrics.timer('db.add_rule'):
+            rules = [(source, target)]
+            if symmetric and not self.undirected:
+                rules.append((target, source))
+            for (rule_source, rule_target) in rules:
+                self.rules.add_rule(rule_source, rule_target)
+            # the masks are swapped in whole, readers see the rules before or after the change
+            self.rules.compile(self.id_chart)
+            for (rule_source, rule_target) in rules:
+                self._log(('r', rule_source, rule_target))
+            if self.backend is not None:
+                self.backend.save_rules(self.rules.state())
+            # a rule can change any row, cached builds of the old generation are stale
+            self.similarity = None
+            self._new_generation()
+
+    def exclude_compatibility(self, component, other):
+        """
+        makes other incompatible with component whatever the explicit edges and rules say
+        :param component: component whose row is changed, both ways in undirected mode
+        :param other: component it no longer is compatible with
+        :return: None
+        """
+        self.materialize()
+        comp_id = self.inventory.get(component)
+        other_id = self.inventory.get(other)
+        if comp_id is None or other_id is None:
+            raise KeyError('Component not in inventory: ' + (other if comp_id is not None else component).name)
+        with self._lock:
+            self.rules.exclude(comp_id, other_id)
+            # signatures cannot forget an edge, the index is rebuilt on next use
+            self.similarity = None
+            self._log(('x', comp_id, other_id))
+            if self.backend is not None:
+                self.backend.save_rules(self.rules.state())
+            self._touch((comp_id, other_id))
+
+    def _merge_rows(self, additions: dict) -> dict:
+        """
+        merges new compatible IDs into their rows, every row is copied once.
+        In undirected mode each edge first moves to the row of its smaller ID.
+        :param additions: dict mapping component ID to the IDs to add to its row
+        :return: the additions as merged
+        """
+        if self.undirected:
+            additions = self._upper(additions)
+        for (comp_id, compatible) in additions.items():
+            self.dependencies[comp_id] = self.dependencies.get(comp_id, self._new_row()).union(compatible)
+        return additions
+
+    @staticmethod
+    def _upper(additions: dict) -> dict:
+        """
+        moves every edge to the row of its smaller ID, the undirected layout
+        :param additions: dict mapping component ID to IDs
+        :return: dict mapping component ID to the IDs not smaller than it
+        """
+        upper = dict()
+        for (comp_id, compatible) in additions.items():
+            for other in compatible:
+                if other < comp_id:
+                    upper.setdefault(other, set()).add(comp_id)
+                else:
+                    upper.setdefault(comp_id, set()).add(other)
+        return upper
+
+    def _add_edges(self, additions: dict):
+        """
+        merges new compatible IDs into their rows and into the storage engine
+        :param additions: dict mapping component ID to the set of IDs to add to its row
+        :return: None
+        """
+        if self.backend is not None:
+            additions = self._upper(additions) if self.undirected else additions
+            self.backend.add_edges(additions)
+        else:
+            additions = self._merge_rows(additions)
+        if self.engine is not None and self.backend is None:
+            if hasattr(self.engine, 'add_edges'):
+                self.engine.add_edges(additions)
+            else:
+                for (comp_id, compatible) in additions.items():
+                    for other in compatible:
+                        self.engine.add_edge(comp_id, other)
+        if self.similarity is not None:
+            for (comp_id, compatible) in additions.items():
+                self.similarity.update(comp_id, compatible)
+                if self.undirected:
+                    for other in compatible:
+                        self.similarity.update(other, (comp_id,))
+        self._touch(additions)
+        for compatible in additions.values():
+            self._touch(compatible)
+
+    def _batch(self):
+        """
+        :return: context manager grouping backend writes into one transaction, a no-op without a backend
+        """
+        return self.backend.batch() if self.backend is not None else nullcontext()
+
+    @staticmethod
+    def _chunks(iterable, size: int):
+        """
+        cuts an iterable into lists of at most size items without reading ahead further
+        """
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def bulk_update(self, edges, symmetric: bool = True, chunk_size: int = BULK_CHUNK) -> int:
+        """
+        adds many compatibility edges at once.
+        The input is consumed in chunks: each chunk is validated before any of it is applied,
+        then every touched row is copied once and the chunk is logged as a single record.
+        :param edges: iterable of (component, compatible component) pairs, may be a generator
+        :param symmetric: also make the second component compatible with the first, always so in undirected mode
+        :param chunk_size: pairs per validated and logged chunk
+        :return: number of pairs read
+        """
+        self.materialize()
+        count = 0
+        for chunk in self._chunks(edges, chunk_size):
+            with self._lock, self._batch(), metrics.timer('db.bulk_update'):
+                additions = dict()
+                for (component, other) in chunk:
+                    comp_id = self.inventory.get(component)
+                    other_id = self.inventory.get(other)
+                    if comp_id is None or other_id is None:
+                        raise KeyError('Component not in inventory: ' + (other if comp_id is not None
+                                                                         else component).name)
+                    additions.setdefault(comp_id, set()).add(other_id)
+                    if symmetric and not self.undirected:
+                        additions.setdefault(other_id, set()).add(comp_id)
+                self._add_edges(additions)
+                self._log(('b', (), tuple((comp_id, tuple(row)) for (comp_id, row) in additions.items())))
+            count += len(chunk)
+        return count
+
+    def link(self, additions: dict):
+        """
+        adds IDs to rows without looking them up in the inventory, for rows pointing
+        outside of this database, e.g. a shard of ShardedDatabase. Logged as one bulk record.
+        :param additions: dict mapping component ID to the IDs to add to its row
+        :return: None
+        """
+        self.materialize()
+        with self._lock, self._batch(), metrics.timer('db.link'):
+            additions = {comp_id: set(row) for (comp_id, row) in additions.items()}
+            self._add_edges(additions)
+            self._log(('b', (), tuple((comp_id, tuple(row)) for (comp_id, row) in additions.items())))
+
+    def bulk_add(self, components_with_compat, symmetric: bool = True, chunk_size: int = BULK_CHUNK,
+                 unresolved: list = None) -> int:
+        """
+        adds many components with their compatible components at once.
+        Compatible components may be in the inventory already or anywhere in the input;
+        references to components further down the input are held back until those arrive.
+        Components already in the inventory only get the new edges.
+        The input is streamed, so a reference is only known to be missing once it has ended, after
+        every chunk has been applied and logged. Such references are not an error: their edges are
+        left out and reported, in unresolved when given, else with a warning. Check references
+        before calling when a catalog has to go in whole or not at all.
+        :param components_with_compat: iterable of (component, iterable of compatible components), may be a generator
+        :param symmetric: also add every component to the rows of its compatible components
+        :param chunk_size: components per locked pass and logged record
+        :param unresolved: optional list, gets the (component, compatible component) pairs left out
+        :return: number of components added
+        """
+        self.materialize()
+        added = 0
+        # (component ID, compatible component) pairs waiting for the compatible component to arrive
+        pending = []
+        for chunk in self._chunks(components_with_compat, chunk_size):
+            with self._lock, self._batch(), metrics.timer('db.bulk_add'):
+                new = []
+                for (component, _) in chunk:
+                    if component not in self.inventory:
+                        comp_id = self._register(component)
+                        new.append((component, comp_id, self.uuids[comp_id]))
+
+                additions = dict()
+                waiting = []
+                for (comp_id, other) in pending + [(self.inventory[component], other)
+                                                   for (component, compatible) in chunk for other in compatible]:
+                    other_id = self.inventory.get(other)
+                    if other_id is None:
+                        waiting.append((comp_id, other))
+                        continue
+                    additions.setdefault(comp_id, set()).add(other_id)
+                    if symmetric and not self.undirected:
+                        additions.setdefault(other_id, set()).add(comp_id)
+                pending = waiting
+                self._add_edges(additions)
+                self._log(('b', tuple(new), tuple((comp_id, tuple(row)) for (comp_id, row) in additions.items())))
+            added += len(new)
+
+        self._report_unresolved([(self.id_chart[comp_id], other) for (comp_id, other) in pending], unresolved)
+        return added
+
+    @staticmethod
+    def _report_unresolved(pairs: list, unresolved: list):
+        """
+        hands the edges bulk_add left out to the caller's list, or warns about them
+        :param pairs: (component, compatible component) pairs whose compatible component never arrived
+        :param unresolved: the caller's list or None
+        """
+        if unresolved is not None:
+            unresolved.extend(pairs)
+        elif pairs:
+            warnings.warn('Compatible components not in inventory, edges left out: ' +
+                          ', '.join(sorted({other.name for (_, other) in pairs})))
 
     def compatibility(self, comp1, comp2):
         """
@@ -193,20 +1021,243 @@ class CompatibilityDatabase:
         :param comp2: second object
         :return: True if compatible, False otherwise
         """
-        if comp1 not in self.inventory:
+        if metrics.enabled:
+            metrics.incr('db.compatibility')
+        id1 = self.inventory.get(comp1)
+        if id1 is None:
             raise KeyError("First component not in inventory")
 
-        elif comp2 not in self.inventory:
+        id2 = self.inventory.get(comp2)
+        if id2 is None:
             raise KeyError("Second component not in inventory")
 
+        return self.compatible_ids(id1, id2)
+
+    def compatible_ids(self, id1: int, id2: int) -> bool:
+        """
+        compatibility check on component IDs, skips the inventory lookups
+        :param id1: first component ID
+        :param id2: second component ID
+        :return: True if id2 is in the compatibility set of id1, or a rule says so, and no exclusion forbids it
+        """
+        if self.undirected and id1 > id2:
+            (id1, id2) = (id2, id1)
+        if self.engine is not None:
+            explicit = self.engine.compatible(id1, id2)
+        else:
+            explicit = id2 in self.dependencies[id1]
+        if self.rules:
+            return self.rules.decide(id1, id2, explicit)
+        return explicit
+
+    def mutually_compatible(self, id1: int, id2: int) -> bool:
+        """
+        compatibility in both directions, one check in undirected mode
+        :param id1: first component ID
+        :param id2: second component ID
+        :return: True if each is in the compatibility set of the other
+        """
+        if self.undirected:
+            return self.compatible_ids(id1, id2)
+        return self.compatible_ids(id1, id2) and self.compatible_ids(id2, id1)
+
+    def row(self, comp_id: int):
+        """
+        all IDs a component is compatible with.
+        In undirected mode the part kept in the rows of smaller IDs is collected with a scan,
+        with rules every component is checked and the result is cached. The cached row is used
+        until the component's version, the number of components or the generation changes;
+        new rules and exclusions bump one of them.
+        :param comp_id: component ID
+        :return: set of compatible IDs
+        """
+        if self.rules:
+            if self._rule_rows_generation != self.generation:
+                (self._rule_rows, self._rule_rows_generation) = (dict(), self.generation)
+            stamp = (len(self.id_chart), self.component_versions.get(comp_id, 0))
+            cached = self._rule_rows.get(comp_id)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            row = frozenset(other for other in range(len(self.id_chart)) if self.compatible_ids(comp_id, other))
+            self._rule_rows[comp_id] = (stamp, row)
+            return row
+        if self.backend is not None and self.undirected:
+            return self.backend.neighbors(comp_id)
+        row = self.dependencies[comp_id]
+        if not self.undirected:
+            return row
+        return row.union(other for other in range(comp_id) if comp_id in self.dependencies[other])
+
+    def compatible_with_all(self, component, others) -> bool:
+        """
+        checks one component against many at once
+        :param component: component to check
+        :param others: components it has to be compatible with
+        :return: True if component is compatible with every one of others
+        """
+        comp_id = self.cid(component)
+        other_ids = [self.cid(other) for other in others]
+        if self.undirected or self.rules:
+            return all(self.compatible_ids(comp_id, other) for other in other_ids)
+        if self.engine is not None:
+            return self.engine.compatible_with_all(comp_id, other_ids)
+        return self.dependencies[comp_id].issuperset(other_ids)
+
+    def common_compatible(self, components) -> set:
+        """
+        returns the components that all given components are compatible with
+        :param components: iterable of components
+        :return: set of components
+        """
+        comp_ids = [self.cid(comp) for comp in components]
+        if self.engine is not None and not self.undirected and not self.rules:
+            common = self.engine.common_compatible(comp_ids)
+        elif len(comp_ids) == 0:
+            common = range(len(self.id_chart))
         else:
-            return self.cid(comp2) in self.dependencies[self.cid(comp1)]
+            common = set.intersection(*(set(self.row(comp_id)) for comp_id in comp_ids))
+        return {self.id_chart[comp_id] for comp_id in common}
+
+    def query(self, comp_type=None, manufacturer=None, structure=None, mechanism=None, diameter=None, use=None,
+              compatible_with=None) -> set:
+        """
+        filters the inventory through the secondary indexes.
+        Attribute filters that are None are ignored, compatible_with keeps only components
+        that do not conflict in either direction with any of the given parts.
+        Example: query(comp_type=Component_Type.Engine, manufacturer='Tesla', mechanism=Engine_Mechanism.Electric)
+        :param comp_type: Component_Type to match
+        :param manufacturer: manufacturer name to match
+        :param structure: Body Structure to match
+        :param mechanism: Engine Engine_Mechanism to match
+        :param diameter: Wheels Diameter to match
+        :param use: Extra use to match
+        :param compatible_with: iterable of components in the inventory
+        :return: set of matching components
+        """
+        if self.backend is not None:
+            candidates = self.backend.lookup(comp_type=comp_type, manufacturer=manufacturer, structure=structure,
+                                             mechanism=mechanism, diameter=diameter, use=use)
+        else:
+            with self._lock:
+                if self.index is None:
+                    self.index = ComponentIndex()
+                    self.index.build(self.inventory)
+                candidates = self.index.lookup(comp_type=comp_type, manufacturer=manufacturer, structure=structure,
+                                               mechanism=mechanism, diameter=diameter, use=use)
+
+        if compatible_with is not None and self.rules and candidates is not None:
+            # the attribute filters narrowed it down, checking the bucket beats building the rows
+            part_ids = [self.cid(part) for part in compatible_with]
+            candidates = {comp_id for comp_id in candidates
+                          if all(self.compatible_ids(part_id, comp_id) and self.compatible_ids(comp_id, part_id)
+                                 for part_id in part_ids)}
+        elif compatible_with is not None:
+            part_ids = [self.cid(part) for part in compatible_with]
+            rows = sorted((self.row(part_id) for part_id in part_ids), key=len)
+            if candidates is None:
+                candidates = set(rows[0]) if rows else set(range(len(self.id_chart)))
+            for row in rows:
+                candidates = candidates.intersection(row)
+            if self.rules:
+                candidates = {comp_id for comp_id in candidates
+                              if all(self.compatible_ids(comp_id, part_id) for part_id in part_ids)}
+            elif not self.undirected:
+                candidates = {comp_id for comp_id in candidates if self.dependencies[comp_id].issuperset(part_ids)}
+        elif candidates is None:
+            candidates = set(range(len(self.id_chart)))
+
+        return {self.component_from_id(comp_id) for comp_id in candidates}
+
+    def similar(self, component, k: int = 5, compatible_with=None) -> list:
+        """
+        the parts of the same type (and use, for Extra) whose compatibility rows are most like
+        the row of component, from the MinHash buckets of SimilarityIndex instead of a catalog scan.
+        Example: similar(conflicting_engine, 3, compatible_with=rest_of_build)
+        :param component: component in the inventory
+        :param k: number of results
+        :param compatible_with: iterable of components the results must not conflict with in either direction
+        :return: list of up to k components, most similar first
+        """
+        comp_id = self.cid(component)
+        part_ids = [self.cid(part) for part in compatible_with or ()]
+        with self._lock:
+            if self.similarity is None:
+                similarity = SimilarityIndex()
+                similarity.build(self)
+                self.similarity = similarity
+        use = component.use if component.comp_type == Component_Type.Extra else None
+
+        def fits(other: int) -> bool:
+            if use is not None and self.id_chart[other].use != use:
+                return False
+            return all(self.mutually_compatible(other, part_id) for part_id in part_ids)
+
+        return [self.id_chart[other] for (other, _) in self.similarity.nearest(comp_id, k, fits)]
+
+    def row_similarity(self, comp_id: int, others) -> dict:
+        """
+        how alike the compatibility rows of a component and of others are, e.g. to rank replacements.
+        Exact rather than the MinHash estimate of SimilarityIndex, which depends on when the index was built
+        :param comp_id: component ID
+        :param others: iterable of component IDs
+        :return: dict mapping every one of others to the Jaccard similarity of its row, 0.0 to 1.0
+        """
+        row = set(self.row(comp_id))
+        result = dict()
+        for other in others:
+            other_row = self.row(other)
+            shared = len(row.intersection(other_row))
+            union = len(row) + len(other_row) - shared
+            result[other] = shared / union if union else 0.0
+        return result
+
+    def stats(self) -> dict:
+        """
+        size of the catalog and a rough estimate of the memory it takes
+        :return: dict with components, edges, estimated bytes, dirty count, version, layout and rules
+        """
+        components = len(self.inventory)
+        edges = 0
+        memory = 0
+        if self.backend is not None:
+            # on disk, not in memory
+            edges = self.backend.edges
+            memory = self.backend.file_size()
+        elif self.catalog is None:
+            memory = sys.getsizeof(self.inventory) + sys.getsizeof(self.id_chart) + sys.getsizeof(self.uuids) \
+                + sys.getsizeof(self.uuid_index) + sys.getsizeof(self.dependencies) \
+                + sys.getsizeof(self.rules.source_masks) + sys.getsizeof(self.rules.target_masks)
+            for row in list(self.dependencies.values()):
+                edges += len(row)
+                memory += sys.getsizeof(row)
+            if components:
+                sample = self.id_chart[0]
+                memory += components * (sys.getsizeof(sample) + sys.getsizeof(sample.name) + sys.getsizeof(self.uuids[0]))
+            memory += getattr(getattr(self.engine, 'rows', None), 'nbytes', 0)
+        else:
+            edges = self.catalog.edges
+            memory = len(self.catalog._map)
+        return {'components': components, 'edges': edges, 'memory_bytes': memory, 'dirty': self.dirty,
+                'version': self.version, 'undirected': self.undirected, 'compact': self.compact,
+                'rules': len(self.rules.rules), 'exclusions': len(self.rules.excluded)}
 
     def close(self):
         """
         Closes the database
         """
         self.initialized = False
-        self.write_thread.join()
+        self._stop.set()
+        if self.write_thread.is_alive():
+            self.write_thread.join()
+        if self.dirty > 0 and self.inventory_file is not None and self.backend is None:
+            self.write_state_to_disk()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        if self.backend is not None:
+            self.backend.close()
+        if self.gauge is not None:
+            metrics.drop_gauge(self.gauge)
+            self.gauge = None
         del self.inventory
         del self.dependencies
@@ -0,0 +1,209 @@
+from Components import *
+from ComponentIndex import INDEXED_FIELDS, index_value
+
+'''
+Declarative compatibility rules over component attributes, e.g.
+
+    database.add_rule({'comp_type': Component_Type.Wheels, 'diameter': Diameter.Eighteen},
+                      {'comp_type': Component_Type.Body, 'structure': Structure.Sedan})
+
+makes every 18 inch wheel compatible with every Sedan body without storing an
+edge per pair. Selectors are field=value dicts over INDEXED_FIELDS, all fields
+have to match. Explicit edges still add compatibility and explicit exclusions
+take it away, whatever the rules say.
+'''
+
+
+def selector(fields: dict) -> dict:
+    """
+    normalizes a selector so enum members and their values select the same components
+    :param fields: dict mapping field from INDEXED_FIELDS to value
+    :return: dict mapping field to string value
+    """
+    for field in fields:
+        if field not in INDEXED_FIELDS:
+            raise KeyError("No index on " + field)
+    return {field: index_value(value) for (field, value) in fields.items() if value is not None}
+
+
+class RuleSet:
+    """
+    Rules compiled into bit masks, bit r standing for rule r.
+    For every side (source, target) and field there is a mask of the rules that
+    do not constrain the field and one per value of the rules requiring it; a
+    component's mask is the AND over its fields. A rule relates a and b when
+    bit r is set in the source mask of a and the target mask of b, so a check
+    is one AND of two integers and memory is two masks per component.
+    """
+
+    def __init__(self, undirected: bool = False):
+        """
+        init function
+        :param undirected: rules and exclusions hold both ways, as in an undirected database
+        """
+        self.undirected = undirected
+        # list of (source selector, target selector)
+        self.rules = []
+        # (comp_id, other) pairs made incompatible whatever the rules or edges say
+        self.excluded = frozenset()
+
+        # component masks, indexed by component ID
+        self.source_masks = []
+        self.target_masks = []
+        self._compile_tables()
+
+    def __len__(self):
+        return len(self.rules) + len(self.excluded)
+
+    def _compile_tables(self):
+        """
+        builds the per field masks of both sides from the rules
+        """
+        tables = []
+        for side in (0, 1):
+            free = dict()
+            by_value = dict()
+            for field in INDEXED_FIELDS:
+                free[field] = 0
+                by_value[field] = dict()
+                for (number, rule) in enumerate(self.rules):
+                    value = rule[side].get(field)
+                    if value is None:
+                        free[field] |= 1 << number
+                    else:
+                        by_value[field][value] = by_value[field].get(value, 0) | 1 << number
+            tables.append((free, by_value))
+        self._tables = tables
+
+    def _mask(self, side: int, component: Component) -> int:
+        """
+        :return: mask of the rules whose selector on the given side matches the component
+        """
+        (free, by_value) = self._tables[side]
+        mask = (1 << len(self.rules)) - 1
+        for field in INDEXED_FIELDS:
+            value = index_value(getattr(component, field)) if hasattr(component, field) else None
+            mask &= free[field] | by_value[field].get(value, 0)
+            if mask == 0:
+                break
+        return mask
+
+    def compile(self, components):
+        """
+        computes the masks of a whole catalog, without rules there is nothing to compute
+        :param components: sequence of components indexed by ID
+        :return: None
+        """
+        if len(self.rules) == 0:
+            (self.source_masks, self.target_masks) = ([], [])
+            return
+        components = [components[comp_id] for comp_id in range(len(components))]
+        # swapped in whole, readers see either the old or the new masks
+        (self.source_masks, self.target_masks) = ([self._mask(0, comp) for comp in components],
+                                                  [self._mask(1, comp) for comp in components])
+
+    def add_component(self, comp_id: int, component: Component):
+        """
+        computes the masks of a new component, which has to get the next ID
+        """
+        if len(self.rules) == 0:
+            return
+        if comp_id != len(self.source_masks):
+            raise IndexError('Rule masks are out of step with the component IDs')
+        self.target_masks.append(self._mask(1, component))
+        self.source_masks.append(self._mask(0, component))
+
+    def add_rule(self, source: dict, target: dict, components=None) -> int:
+        """
+        adds a rule, adding it again changes nothing
+        :param source: selector of the components the rule is about
+        :param target: selector of the components they become compatible with
+        :param components: sequence of components indexed by ID to recompile the masks for,
+            None leaves that to a later compile
+        :return: number of the rule
+        """
+        rule = (selector(source), selector(target))
+        if rule in self.rules:
+            return self.rules.index(rule)
+        self.rules = self.rules + [rule]
+        self._compile_tables()
+        if components is not None:
+            self.compile(components)
+        return len(self.rules) - 1
+
+    def _pair(self, comp_id: int, other: int) -> tuple:
+        if self.undirected and other < comp_id:
+            return other, comp_id
+        return comp_id, other
+
+    def exclude(self, comp_id: int, other: int):
+        """
+        makes other incompatible with comp_id whatever the rules or explicit edges say
+        """
+        self.excluded = self.excluded | {self._pair(comp_id, other)}
+
+    def matches(self, comp_id: int, other: int) -> bool:
+        """
+        :return: True if a rule makes other compatible with comp_id
+        """
+        if comp_id >= len(self.source_masks) or other >= len(self.source_masks):
+            return False
+        if self.source_masks[comp_id] & self.target_masks[other]:
+            return True
+        return self.undirected and bool(self.source_masks[other] & self.target_masks[comp_id])
+
+    def decide(self, comp_id: int, other: int, explicit: bool) -> bool:
+        """
+        combines an explicit edge with the rules and exclusions
+        :param comp_id: first component ID
+        :param other: second component ID
+        :param explicit: whether an explicit edge makes other compatible with comp_id
+        :return: final compatibility
+        """
+        if self.excluded and self._pair(comp_id, other) in self.excluded:
+            return False
+        return explicit or self.matches(comp_id, other)
+
+    def overlay_pairs(self, comp_ids, other_ids, explicit) -> list:
+        """
+        decide for many pairs
+        :param comp_ids: first component IDs
+        :param other_ids: second component IDs
+        :param explicit: explicit results, one per pair
+        :return: list of final results
+        """
+        return [self.decide(comp_id, other, bool(found)) for (comp_id, other, found)
+                in zip(comp_ids, other_ids, explicit)]
+
+    def overlay_matrix(self, comp_ids: list, explicit):
+        """
+        decide for a submatrix, in place
+        :param comp_ids: component IDs of the rows and columns
+        :param explicit: k x k boolean array of explicit edges
+        :return: the array
+        """
+        for (row, comp_id) in enumerate(comp_ids):
+            for (col, other) in enumerate(comp_ids):
+                explicit[row, col] = self.decide(comp_id, other, bool(explicit[row, col]))
+        return explicit
+
+    def state(self) -> dict:
+        """
+        :return: the rules and exclusions as plain data, for snapshots
+        """
+        return {'rules': [[dict(source), dict(target)] for (source, target) in self.rules],
+                'excluded': sorted(self.excluded)}
+
+    def restore(self, state: dict, components=None):
+        """
+        replaces the rules and exclusions with saved ones
+        :param state: as returned by state, None for none
+        :param components: sequence of components indexed by ID to compile the masks for,
+            None leaves that to a later compile
+        """
+        state = state or {'rules': [], 'excluded': []}
+        self.rules = [(selector(source), selector(target)) for (source, target) in state['rules']]
+        self.excluded = frozenset(self._pair(comp_id, other) for (comp_id, other) in state['excluded'])
+        self._compile_tables()
+        if components is not None:
+            self.compile(components)
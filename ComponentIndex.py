@@ -0,0 +1,70 @@
+from Components import *
+
+# component attributes that get a secondary index
+INDEXED_FIELDS = ('comp_type', 'manufacturer', 'structure', 'mechanism', 'diameter', 'use')
+
+
+def index_value(value) -> str:
+    """
+    normalizes an attribute value so Structure.Sedan and '2' land in the same bucket
+    :param value: attribute value, enum member or plain string
+    :return: string key
+    """
+    return str(getattr(value, 'value', value))
+
+
+class ComponentIndex:
+    """
+    Secondary indexes over the inventory.
+    For every field in INDEXED_FIELDS keeps a dict from value to the set of
+    component IDs having it, so filters cost the size of the buckets they
+    touch instead of a scan of the inventory.
+    """
+
+    def __init__(self):
+        # field -> value -> set of component IDs
+        self.buckets = {field: dict() for field in INDEXED_FIELDS}
+
+    def build(self, inventory):
+        """
+        indexes a whole inventory
+        :param inventory: mapping component -> ID
+        :return: None
+        """
+        for (component, comp_id) in inventory.items():
+            self.add(component, comp_id)
+
+    def add(self, component: Component, comp_id: int):
+        """
+        indexes one component
+        :param component: component to index
+        :param comp_id: its ID
+        :return: None
+        """
+        for field in INDEXED_FIELDS:
+            if hasattr(component, field):
+                value = index_value(getattr(component, field))
+                self.buckets[field].setdefault(value, set()).add(comp_id)
+
+    def lookup(self, **filters) -> set:
+        """
+        intersects the buckets of the given filters, smallest first
+        :param filters: field=value pairs, fields from INDEXED_FIELDS, None values are ignored
+        :return: set of matching component IDs, None if no filter was given
+        """
+        selected = []
+        for (field, value) in filters.items():
+            if field not in self.buckets:
+                raise KeyError("No index on " + field)
+            if value is not None:
+                selected.append(self.buckets[field].get(index_value(value), set()))
+        if len(selected) == 0:
+            return None
+
+        selected.sort(key=len)
+        result = set(selected[0])
+        for bucket in selected[1:]:
+            result &= bucket
+            if len(result) == 0:
+                break
+        return result
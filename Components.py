@@ -1,4 +1,5 @@
 from enum import Enum
+from weakref import WeakValueDictionary
 
 
 # Enum for primary components of the car, non-primary components are marked as Extra
@@ -42,32 +43,73 @@ class Diameter(str, Enum):
 class Component:
     """
     Component superclass
+    Components are immutable value objects: __slots__ keep them small and the
+    hash is computed once. Use intern_component to get the canonical instance.
     """
 
+    __slots__ = ('comp_type', 'name', 'manufacturer', '_hash', '__weakref__')
+
+    # type specific attribute, None for components without one
+    attribute = None
+
     def __init__(self, comp_type: Enum, name: str, manufacturer: str):
         self.comp_type = comp_type
         self.name = name
         self.manufacturer = manufacturer
 
+    def key(self) -> tuple:
+        """
+        :return: the fields identifying this component
+        """
+        if self.attribute is None:
+            return self.comp_type, self.name, self.manufacturer
+        return self.comp_type, self.name, self.manufacturer, getattr(self, self.attribute)
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict of the component fields, as saved to json
+        """
+        data = {'comp_type': self.comp_type, 'name': self.name, 'manufacturer': self.manufacturer}
+        if self.attribute is not None:
+            data[self.attribute] = getattr(self, self.attribute)
+        return data
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state: dict):
+        # also restores components pickled before __slots__, their state is the same field dict
+        for (field, value) in state.items():
+            if field != '_hash':
+                object.__setattr__(self, field, value)
+        self._init_hash()
+
+    def _init_hash(self):
+        self._hash = hash(self.key()[1:])
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return False
+        return self._hash == other._hash and self.key() == other.key()
+
+    def __hash__(self):
+        return self._hash
+
 
 class Body(Component):
     """
     Body class, includes seats and lights
     """
 
+    __slots__ = ('structure',)
+    attribute = 'structure'
+
     def __init__(self, name: str, structure: Structure.Mini, manufacturer: str):
         super().__init__(Component_Type.Body, name, manufacturer)
-        self.structure = structure
-
-    def __eq__(self, other):
-        if not isinstance(other, Body):
-            return False
-
-        return self.name == other.name and self.structure == other.structure \
-               and self.manufacturer == other.manufacturer
-
-    def __hash__(self):
-        return hash((self.name, self.structure, self.manufacturer))
+        self.structure = Structure(structure)
+        self._init_hash()
 
 
 class Engine(Component):
@@ -75,19 +117,13 @@ class Engine(Component):
     Engine class, includes tank
     """
 
+    __slots__ = ('mechanism',)
+    attribute = 'mechanism'
+
     def __init__(self, name: str, mechanism: Engine_Mechanism.Electric, manufacturer: str):
         super().__init__(Component_Type.Engine, name, manufacturer)
-        self.mechanism = mechanism
-
-    def __eq__(self, other):
-        if not isinstance(other, Engine):
-            return False
-
-        return self.name == other.name and self.mechanism == other.mechanism \
-               and self.manufacturer == other.manufacturer
-
-    def __hash__(self):
-        return hash((self.name, self.mechanism, self.manufacturer))
+        self.mechanism = Engine_Mechanism(mechanism)
+        self._init_hash()
 
 
 class Battery(Component):
@@ -95,17 +131,11 @@ class Battery(Component):
     Battery class
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, manufacturer: str):
         super().__init__(Component_Type.Battery, name, manufacturer)
-
-    def __eq__(self, other):
-        if not isinstance(other, Battery):
-            return False
-
-        return self.name == other.name and self.manufacturer == other.manufacturer
-
-    def __hash__(self):
-        return hash((self.name, self.manufacturer))
+        self._init_hash()
 
 
 class Wheels(Component):
@@ -113,20 +143,13 @@ class Wheels(Component):
     Wheel class
     """
 
+    __slots__ = ('diameter',)
+    attribute = 'diameter'
+
     def __init__(self, name: str, diameter: Diameter.Sixteen, manufacturer: str):
         super().__init__(Component_Type.Wheels, name, manufacturer)
-        self.diameter = diameter
-
-    def __eq__(self, other):
-        if not isinstance(other, Wheels):
-            # don't attempt to compare against unrelated types
-            return NotImplemented
-
-        return self.name == other.name and self.diameter == other.diameter \
-               and self.manufacturer == other.manufacturer
-
-    def __hash__(self):
-        return hash((self.name, self.diameter, self.manufacturer))
+        self.diameter = Diameter(diameter)
+        self._init_hash()
 
 
 class Extra(Component):
@@ -134,26 +157,38 @@ class Extra(Component):
     Extra Component class
     """
 
+    __slots__ = ('use',)
+    attribute = 'use'
+
     def __init__(self, name: str, use: str, manufacturer: str):
         super().__init__(Component_Type.Extra, name, manufacturer)
         self.use = use
+        self._init_hash()
 
-    def __eq__(self, other):
-        if not isinstance(other, Extra):
-            # don't attempt to compare against unrelated types
-            return False
 
-        return self.name == other.name and self.use == other.use \
-               and self.manufacturer == other.manufacturer
+# flyweight table of canonical component instances, entries go away with their last user
+_interned = WeakValueDictionary()
 
-    def __hash__(self):
-        return hash((self.name, self.use, self.manufacturer))
+
+def intern_component(component: Component) -> Component:
+    """
+    returns the canonical instance equal to component, registering it if it is the first one.
+    Canonical instances make dict and set probes succeed on the identity check.
+    :param component: component
+    :return: canonical component
+    """
+    key = (type(component),) + component.key()
+    canonical = _interned.get(key)
+    if canonical is None:
+        _interned[key] = component
+        canonical = component
+    return canonical
 
 
 class Component_factory:
     """
     Component factory
-    Creates and returns components
+    Creates and returns canonical components
     """
 
     def __init__(self, man_name):
@@ -164,16 +199,16 @@ class Component_factory:
     '''
 
     def create_body_component(self, name, structure):
-        return Body(name, structure, self.man_name)
+        return intern_component(Body(name, structure, self.man_name))
 
     def create_engine_component(self, name, mechanism):
-        return Engine(name, mechanism, self.man_name)
+        return intern_component(Engine(name, mechanism, self.man_name))
 
     def create_battery_component(self, name):
-        return Battery(name, self.man_name)
+        return intern_component(Battery(name, self.man_name))
 
     def create_wheels_component(self, name, diameter):
-        return Wheels(name, diameter, self.man_name)
+        return intern_component(Wheels(name, diameter, self.man_name))
 
     def create_extra_component(self, name, use):
-        return Extra(name, use, self.man_name)
+        return intern_component(Extra(name, use, self.man_name))
@@ -25,3 +25,26 @@ class Manufacturer:
     '''
     def update_compatibility(self, component, new_compatibility_item):
         self.database.update_compatibility(component, new_compatibility_item)
+
+    '''
+    Send many components with their compatible components in one pass.
+    Takes (component, compatible components) pairs from any iterable, so a catalog
+    can be streamed from a file, and makes every edge symmetric unless told otherwise.
+    Edges to components that never arrive are left out and put in unresolved, see bulk_add
+    '''
+    def send_many(self, components_with_compat, symmetric=True, unresolved=None):
+        return self.database.bulk_add(components_with_compat, symmetric=symmetric, unresolved=unresolved)
+
+    '''
+    Declare a compatibility rule for this manufacturer's components, e.g. every
+    one of its 18 inch wheels fits every Sedan body, without listing the pairs.
+    The source selector is limited to this manufacturer unless it names another
+    '''
+    def add_rule(self, source, target, symmetric=True):
+        self.database.add_rule(dict({'manufacturer': self.man_name}, **source), target, symmetric=symmetric)
+
+    '''
+    Take back compatibility with one component, whatever edges or rules say
+    '''
+    def exclude_compatibility(self, component, other):
+        self.database.exclude_compatibility(component, other)
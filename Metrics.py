@@ -0,0 +1,234 @@
+import json
+import time
+from contextlib import nullcontext
+from threading import Lock, Thread, Event
+
+'''
+Low-overhead metrics for the database, builder, client and persister.
+Off by default: instrumented code checks metrics.enabled before doing any
+work, so a disabled registry costs one attribute lookup per call site.
+
+    from Metrics import metrics
+    metrics.enable()
+    ...
+    metrics.snapshot()
+'''
+
+
+class Histogram:
+    """
+    Histogram with power-of-two microsecond buckets
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        # bucket b counts values below 2 ** b microseconds
+        self.buckets = dict()
+
+    def add(self, value: float):
+        """
+        records one value
+        :param value: duration in seconds, or any non-negative number for size histograms
+        """
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        bucket = int(value * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction: float) -> float:
+        """
+        upper bound of the bucket holding the given percentile
+        :param fraction: 0.5 for the median, 0.99 for p99
+        :return: value in the unit of add, None when empty
+        """
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.max, (2 ** bucket) / 1e6)
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        :return: count, sum, min, max, mean, p50 and p99 of the recorded values
+        """
+        return {'count': self.count, 'sum': self.total, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.50), 'p99': self.percentile(0.99)}
+
+
+class Timer:
+    """
+    context manager adding the elapsed time to a histogram, a no-op while metrics are disabled
+    """
+
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry, name: str):
+        self.registry = registry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.registry.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# what timer hands out while metrics are disabled, stateless so one instance serves every block
+IDLE_TIMER = nullcontext()
+
+
+class Metrics:
+    """
+    Registry of counters, histograms and gauges
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = dict()
+        self.histograms = dict()
+        self.gauges = dict()
+        self._lock = Lock()
+        self._dump_stop = None
+
+    def enable(self):
+        """
+        starts recording
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        stops recording, collected values are kept
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        clears counters and histograms, gauges stay registered
+        """
+        with self._lock:
+            self.counters = dict()
+            self.histograms = dict()
+
+    def incr(self, name: str, amount: int = 1):
+        """
+        adds to a counter
+        :param name: counter name
+        :param amount: amount to add
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float):
+        """
+        adds a value to a histogram
+        :param name: histogram name
+        :param value: duration in seconds or a size
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def timer(self, name: str) -> Timer:
+        """
+        :param name: histogram name
+        :return: context manager timing its block into the histogram, the shared IDLE_TIMER while disabled
+        """
+        if not self.enabled:
+            return IDLE_TIMER
+        return Timer(self, name)
+
+    def gauge(self, name: str, function) -> str:
+        """
+        registers a value computed when a snapshot is taken. A name already in use gets a number,
+        the second database is 'database.2', so no gauge replaces another.
+        :param name: gauge name
+        :param function: callable returning the value, or None once its source is gone
+        :return: the name the gauge was registered under
+        """
+        with self._lock:
+            (base, number) = (name, 1)
+            while name in self.gauges:
+                number += 1
+                name = base + '.' + str(number)
+            self.gauges[name] = function
+        return name
+
+    def drop_gauge(self, name: str):
+        """
+        unregisters a gauge, e.g. when its source is closed
+        :param name: name gauge returned
+        """
+        with self._lock:
+            self.gauges.pop(name, None)
+
+    def snapshot(self) -> dict:
+        """
+        current values of all metrics
+        :return: dict with counters, histogram summaries and gauges
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.summary() for (name, histogram) in self.histograms.items()}
+        gauges = dict()
+        for (name, function) in list(self.gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                # a broken source is skipped, it must not cost the others their values or stop the dump thread
+                continue
+            if value is not None:
+                gauges[name] = value
+            else:
+                # the source is gone, free the name
+                with self._lock:
+                    if self.gauges.get(name) is function:
+                        del self.gauges[name]
+        return {'time': time.time(), 'enabled': self.enabled, 'counters': counters, 'histograms': histograms,
+                'gauges': gauges}
+
+    def start_dump(self, filename: str, interval: float = 60.0):
+        """
+        appends a JSON line snapshot to filename every interval seconds
+        :param filename: file to append to
+        :param interval: seconds between snapshots
+        """
+        self.stop_dump()
+        stop = self._dump_stop = Event()
+
+        def dump():
+            while not stop.wait(interval):
+                f_m = open(filename, "a")
+                f_m.write(json.dumps(self.snapshot()) + '\n')
+                f_m.close()
+
+        Thread(target=dump, daemon=True).start()
+
+    def stop_dump(self):
+        """
+        stops the periodic dump
+        """
+        if self._dump_stop is not None:
+            self._dump_stop.set()
+            self._dump_stop = None
+
+
+# process wide registry
+metrics = Metrics()
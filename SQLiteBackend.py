@@ -0,0 +1,365 @@
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from threading import local, Lock
+from Components import *
+from ComponentIndex import index_value
+from CatalogFile import catalog_key, _attribute, _build_component, _TYPES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+'''
+SQLite storage backend for CompatibilityDatabase, see init_from_backend.
+
+A backend answers the read methods of MappedCatalog (len, find, find_uuid,
+uuid, component, row, compatible), so the Catalog* views of CatalogFile
+serve as inventory, id_chart, uuids, uuid_index and dependencies. It also
+takes writes (add_component, add_edges, load_state, batch), keeps the
+compatibility rules (save_rules, load_rules), filters by
+attribute (lookup) and answers compatibility queries as a storage engine.
+
+Nothing is held in memory: catalogs larger than RAM are queried and updated
+in place and every change is durable once its transaction commits.
+'''
+
+# layout version of the database file
+SCHEMA_VERSION = 1
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    # key is catalog_key, attribute the type specific field (structure, mechanism, diameter or use)
+    "CREATE TABLE IF NOT EXISTS components (id INTEGER PRIMARY KEY, uuid TEXT NOT NULL UNIQUE, "
+    "key BLOB NOT NULL UNIQUE, comp_type INTEGER NOT NULL, name TEXT NOT NULL, manufacturer TEXT NOT NULL, "
+    "attribute TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS components_type ON components (comp_type, attribute)",
+    "CREATE INDEX IF NOT EXISTS components_manufacturer ON components (manufacturer, comp_type)",
+    # src is compatible with dst, the reverse index serves undirected rows
+    "CREATE TABLE IF NOT EXISTS edges (src INTEGER NOT NULL, dst INTEGER NOT NULL, PRIMARY KEY (src, dst)) "
+    "WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS edges_reverse ON edges (dst, src)",
+)
+
+# query fields and the component type their attribute belongs to
+_ATTRIBUTE_TYPES = {'structure': 1, 'mechanism': 2, 'diameter': 4, 'use': 5}
+
+# edges written per executemany call
+BATCH_ROWS = 5000
+
+
+class SQLiteBackend:
+    """
+    Components and compatibility edges in a SQLite file.
+    Every thread gets its own connection, the file is in WAL journal mode so
+    readers are not blocked by the writer. Writes commit when they return,
+    or when the outermost batch block ends.
+    """
+
+    def __init__(self, filename: str, undirected: bool = False):
+        """
+        init function
+        :param filename: database file, created if missing
+        :param undirected: layout of new files, existing files keep the layout they were created with
+        """
+        self.filename = filename
+        self._local = local()
+        self._connections = []
+        self._lock = Lock()
+
+        conn = self._connection()
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('undirected', ?)", ('1' if undirected else '0',))
+        self.undirected = conn.execute("SELECT value FROM meta WHERE name = 'undirected'").fetchone()[0] == '1'
+
+    def _connection(self):
+        """
+        :return: the connection of the calling thread, opened on first use
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, check_same_thread=False, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """
+        closes the connections of all threads
+        """
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = local()
+
+    @contextmanager
+    def batch(self):
+        """
+        groups the writes of the calling thread inside the block into one transaction
+        """
+        conn = self._connection()
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.rollback()
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.commit()
+
+    def _commit(self, conn):
+        """
+        commits unless inside a batch block
+        """
+        if self._local.depth == 0:
+            conn.commit()
+
+    def _fetch(self, sql: str, args=()) -> list:
+        """
+        :return: all rows of a query on the calling thread's connection
+        """
+        return self._connection().execute(sql, args).fetchall()
+
+    # read methods shared with MappedCatalog
+
+    def __len__(self):
+        # ids are dense, so this is a single index lookup instead of a count
+        return self._fetch("SELECT COALESCE(MAX(id) + 1, 0) FROM components")[0][0]
+
+    def find(self, component) -> int:
+        """
+        :param component: component to look up
+        :return: its ID, None if it is not stored
+        """
+        if not isinstance(component, Component):
+            return None
+        rows = self._fetch("SELECT id FROM components WHERE key = ?", (catalog_key(component),))
+        return rows[0][0] if rows else None
+
+    def find_uuid(self, comp_uuid: str) -> int:
+        """
+        :param comp_uuid: uuid to look up
+        :return: its ID, None if it is not stored
+        """
+        rows = self._fetch("SELECT id FROM components WHERE uuid = ?", (comp_uuid,))
+        return rows[0][0] if rows else None
+
+    def uuid(self, comp_id: int) -> str:
+        """
+        :return: uuid of a component ID
+        """
+        rows = self._fetch("SELECT uuid FROM components WHERE id = ?", (comp_id,))
+        if not rows:
+            raise IndexError(comp_id)
+        return rows[0][0]
+
+    def component(self, comp_id: int) -> Component:
+        """
+        :return: the interned component with the given ID
+        """
+        rows = self._fetch("SELECT comp_type, name, manufacturer, attribute FROM components WHERE id = ?", (comp_id,))
+        if not rows:
+            raise IndexError(comp_id)
+        return intern_component(_build_component(*rows[0]))
+
+    def row(self, comp_id: int) -> list:
+        """
+        :return: IDs stored as compatible in the row of comp_id, sorted
+        """
+        return [dst for (dst,) in self._fetch("SELECT dst FROM edges WHERE src = ? ORDER BY dst", (comp_id,))]
+
+    def neighbors(self, comp_id: int) -> set:
+        """
+        every ID sharing an edge with comp_id in either direction, the full row of the undirected layout
+        """
+        return {other for (other,) in self._fetch("SELECT dst FROM edges WHERE src = ? UNION "
+                                                  "SELECT src FROM edges WHERE dst = ?", (comp_id, comp_id))}
+
+    def compatible(self, comp_id: int, other: int) -> bool:
+        """
+        :return: True if other is in the row of comp_id
+        """
+        return bool(self._fetch("SELECT 1 FROM edges WHERE src = ? AND dst = ?", (comp_id, other)))
+
+    @property
+    def edges(self) -> int:
+        """
+        number of stored edges
+        """
+        return self._fetch("SELECT COUNT(*) FROM edges")[0][0]
+
+    def file_size(self) -> int:
+        """
+        :return: bytes taken by the database file and its journal
+        """
+        return sum(os.path.getsize(name) for name in (self.filename, self.filename + '-wal')
+                   if os.path.exists(name))
+
+    # writes
+
+    def add_component(self, comp_id: int, comp_uuid: str, component: Component, compatibility_set=()):
+        """
+        stores a new component with its row
+        :param comp_id: ID of the new component
+        :param comp_uuid: its uuid
+        :param component: component to store
+        :param compatibility_set: IDs it is compatible with
+        """
+        conn = self._connection()
+        conn.execute("INSERT INTO components VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (comp_id, comp_uuid, catalog_key(component), _TYPES[component.comp_type], component.name,
+                      component.manufacturer, _attribute(component)))
+        conn.executemany("INSERT OR IGNORE INTO edges VALUES (?, ?)",
+                         ((comp_id, other) for other in compatibility_set))
+        self._commit(conn)
+
+    def add_edges(self, additions: dict):
+        """
+        adds compatible IDs to rows
+        :param additions: dict mapping component ID to the IDs to add to its row
+        """
+        conn = self._connection()
+        pairs = [(comp_id, other) for (comp_id, compatible) in additions.items() for other in compatible]
+        for start in range(0, len(pairs), BATCH_ROWS):
+            conn.executemany("INSERT OR IGNORE INTO edges VALUES (?, ?)", pairs[start:start + BATCH_ROWS])
+        self._commit(conn)
+
+    def load_state(self, inventory, dependencies, uuids, undirected: bool = False):
+        """
+        replaces the stored catalog with the given state in one transaction
+        :param inventory: mapping of component to ID
+        :param dependencies: mapping of ID to its set of compatible IDs
+        :param uuids: uuid of every ID
+        :param undirected: layout of dependencies
+        """
+        conn = self._connection()
+        with self.batch():
+            conn.execute("DELETE FROM edges")
+            conn.execute("DELETE FROM components")
+            conn.executemany("INSERT INTO components VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             ((comp_id, uuids[comp_id], catalog_key(comp), _TYPES[comp.comp_type], comp.name,
+                               comp.manufacturer, _attribute(comp)) for (comp, comp_id) in inventory.items()))
+            conn.executemany("INSERT INTO edges VALUES (?, ?)",
+                             ((comp_id, other) for (comp_id, row) in dependencies.items() for other in row))
+            conn.execute("UPDATE meta SET value = ? WHERE name = 'undirected'", ('1' if undirected else '0',))
+        self.undirected = undirected
+
+    def save_rules(self, state: dict):
+        """
+        stores the compatibility rules and exclusions
+        :param state: as returned by RuleSet.state
+        """
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('rules', ?)", (json.dumps(state),))
+        self._commit(conn)
+
+    def load_rules(self):
+        """
+        :return: the stored RuleSet.state, None if there is none
+        """
+        found = self._fetch("SELECT value FROM meta WHERE name = 'rules'")
+        return json.loads(found[0][0]) if found else None
+
+    # queries
+
+    def lookup(self, **filters) -> set:
+        """
+        component IDs matching all filters, answered from the indexes
+        :param filters: field=value pairs, fields from ComponentIndex.INDEXED_FIELDS, None values are ignored
+        :return: set of matching component IDs, None if no filter was given
+        """
+        (clauses, args) = ([], [])
+        for (field, value) in filters.items():
+            if value is None:
+                continue
+            if field == 'comp_type':
+                clauses.append("comp_type = ?")
+                args.append(int(index_value(value)))
+            elif field == 'manufacturer':
+                clauses.append("manufacturer = ?")
+                args.append(value)
+            elif field in _ATTRIBUTE_TYPES:
+                clauses.append("comp_type = ? AND attribute = ?")
+                args.extend((_ATTRIBUTE_TYPES[field], index_value(value)))
+            else:
+                raise KeyError("No index on " + field)
+        if len(clauses) == 0:
+            return None
+        return {comp_id for (comp_id,) in self._fetch("SELECT id FROM components WHERE " + " AND ".join(clauses),
+                                                      args)}
+
+    # storage engine methods, writes reach the backend through CompatibilityDatabase instead
+
+    def load(self, dependencies):
+        """
+        nothing to load, the file is the storage
+        """
+        pass
+
+    def compatible_with_all(self, comp_id: int, others) -> bool:
+        """
+        :return: True if comp_id is compatible with every one of others
+        """
+        others = set(others)
+        if len(others) == 0:
+            return True
+        marks = ",".join("?" * len(others))
+        return self._fetch("SELECT COUNT(*) FROM edges WHERE src = ? AND dst IN (" + marks + ")",
+                           [comp_id] + list(others))[0][0] == len(others)
+
+    def common_compatible(self, comp_ids) -> set:
+        """
+        :return: set of IDs every given component is compatible with
+        """
+        comp_ids = set(comp_ids)
+        if len(comp_ids) == 0:
+            return set(range(len(self)))
+        marks = ",".join("?" * len(comp_ids))
+        return {dst for (dst,) in self._fetch("SELECT dst FROM edges WHERE src IN (" + marks + ") GROUP BY dst "
+                                              "HAVING COUNT(*) = ?", list(comp_ids) + [len(comp_ids)])}
+
+    def _pairs_among(self, comp_ids) -> set:
+        """
+        :return: set of (src, dst) edges with both ends among comp_ids, in one query
+        """
+        comp_ids = list(set(comp_ids))
+        marks = ",".join("?" * len(comp_ids))
+        return set(self._fetch("SELECT src, dst FROM edges WHERE src IN (" + marks + ") AND dst IN (" + marks + ")",
+                               comp_ids + comp_ids))
+
+    def compatible_pairs(self, comp_ids, other_ids) -> list:
+        """
+        many compatibility tests, rows are read once per distinct first ID
+        :return: list of bools, True where other_ids[n] is in the row of comp_ids[n]
+        """
+        rows = dict()
+        result = []
+        for (comp_id, other) in zip(comp_ids, other_ids):
+            if comp_id not in rows:
+                rows[comp_id] = set(self.row(comp_id))
+            result.append(other in rows[comp_id])
+        return result
+
+    def submatrix(self, comp_ids: list):
+        """
+        :return: k x k boolean array, [a, b] True if comp_ids[b] is in the row of comp_ids[a],
+            None without numpy, callers then check pair by pair
+        """
+        if np is None:
+            return None
+        present = self._pairs_among(comp_ids) if comp_ids else set()
+        return np.array([[(comp_id, other) in present for other in comp_ids] for comp_id in comp_ids],
+                        dtype=bool).reshape(len(comp_ids), len(comp_ids))
@@ -0,0 +1,529 @@
+import json
+import os
+import warnings
+import weakref
+import zlib
+from collections.abc import Mapping
+from threading import Lock
+from Components import *
+from CompatibilityDatabase import CompatibilityDatabase, BULK_CHUNK, full_rows
+from Metrics import metrics
+
+'''
+Compatibility database partitioned by manufacturer, e.g.
+
+    database = ShardedDatabase('catalog', shards=4, placement={'Tesla': 0})
+    database.init_from_file()
+
+Every shard is a CompatibilityDatabase with its own snapshot files, write-ahead
+log, persister thread and writer lock, so ingesting one manufacturer's parts
+never waits on another's. Builder, Client, Manufacturer, BuildCache and
+BuildRegistry take a ShardedDatabase in place of a CompatibilityDatabase.
+'''
+
+# file in the shard directory recording the layout the IDs depend on
+LAYOUT_FILE = 'shards.json'
+
+
+def shard_of(manufacturer: str, shards: int, placement: dict = None) -> int:
+    """
+    shard of a manufacturer, from placement or a stable hash of its name
+    :param manufacturer: manufacturer name
+    :param shards: number of shards
+    :param placement: optional dict pinning manufacturers to shards
+    :return: shard number
+    """
+    if placement and manufacturer in placement:
+        return placement[manufacturer]
+    return zlib.crc32(str(manufacturer).encode()) % shards
+
+
+class ShardedInventory(Mapping):
+    """
+    Read-only inventory of all shards, component -> global ID
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, component):
+        database = self._database
+        number = database.shard_number(component)
+        return database.global_id(number, database.shards[number].inventory[component])
+
+    def __contains__(self, component):
+        return isinstance(component, Component) and \
+            component in self._database.shards[self._database.shard_number(component)].inventory
+
+    def __iter__(self):
+        for shard in self._database.shards:
+            yield from list(shard.inventory)
+
+    def __len__(self):
+        return sum(len(shard.inventory) for shard in self._database.shards)
+
+
+class ShardedUuids:
+    """
+    Read-only uuids by global ID
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, comp_id: int) -> str:
+        (number, local) = self._database.split_id(comp_id)
+        return self._database.shards[number].uuids[local]
+
+    def __len__(self):
+        return sum(len(shard.uuids) for shard in self._database.shards)
+
+
+class ShardedDatabase:
+    """
+    Components partitioned by manufacturer into independent shards.
+    A global ID interleaves the shards: local ID * shards + shard number, so
+    routing an ID needs no table and the IDs stay valid as shards grow.
+    A compatibility edge lives in the row of its first component, in that
+    component's shard, and holds the global ID of the second, wherever that
+    one lives. A directed check therefore reads one shard; lookups over several
+    parts fan out to the shards owning them and intersect the rows they return.
+    Component versions, the generation and the listeners are kept here, over
+    global IDs, so caches and the registry see one database.
+    Compatibility is directed, rules and the similarity index are not sharded.
+    Builds run inline or in thread mode only: Builder.build_many and BatchReplay
+    refuse process and shared mode, which need a single CompatibilityDatabase.
+    """
+
+    def __init__(self, directory: str, shards: int = 4, placement: dict = None, wal: bool = True,
+                 compact_every: int = 1000, compact_bytes: int = 1 << 20, compact: bool = False):
+        """
+        init function
+        :param directory: directory holding the files of every shard, None keeps everything in memory
+        :param shards: number of shards, fixed once the directory has been written
+        :param placement: optional dict pinning manufacturers to shard numbers, e.g. the largest suppliers
+        :param wal: give every shard a write-ahead log
+        :param compact_every: see CompatibilityDatabase
+        :param compact_bytes: see CompatibilityDatabase
+        :param compact: keep the rows of every shard as SparseSets, see CompatibilityDatabase
+        """
+        self.directory = directory
+        (self.shard_count, self.placement) = (shards, dict(placement or {}))
+        if directory is not None:
+            self._load_layout()
+        for number in self.placement.values():
+            if not 0 <= number < self.shard_count:
+                raise ValueError('Placement outside of the ' + str(self.shard_count) + ' shards')
+
+        self.shards = []
+        for number in range(self.shard_count):
+            files = [None, None, None]
+            if directory is not None:
+                prefix = os.path.join(directory, 'shard' + str(number))
+                files = [prefix + '_inventory.pkl', prefix + '_dependency.pkl', prefix + '.wal' if wal else None]
+            self.shards.append(CompatibilityDatabase(files[0], files[1], wal_file=files[2],
+                                                     compact_every=compact_every, compact_bytes=compact_bytes,
+                                                     compact=compact, gauge=None))
+
+        self.inventory = ShardedInventory(self)
+        self.uuids = ShardedUuids(self)
+        # every shard routes to itself, checks are answered from the rows
+        self.engine = None
+        self.undirected = False
+        self.rules = None
+
+        # see CompatibilityDatabase, over global IDs. Shards write concurrently, so bumps take _versions_lock
+        self._versions_lock = Lock()
+        self.component_versions = dict()
+        self.generation = 0
+        self.version = 0
+        self.listeners = []
+
+        # one gauge for the whole database, stats() reports every shard under it
+        me = weakref.ref(self)
+        self.gauge = metrics.gauge('database', lambda: me().stats() if me() is not None else None)
+
+    def _load_layout(self):
+        """
+        reads the shard count and placement the directory was written with, or records them for a new one.
+        Global IDs and the routing depend on both, so a directory cannot be reopened with others.
+        """
+        filename = os.path.join(self.directory, LAYOUT_FILE)
+        if not os.path.exists(filename):
+            os.makedirs(self.directory, exist_ok=True)
+            f_tmp = open(filename + ".tmp", "w")
+            json.dump({'shards': self.shard_count, 'placement': self.placement}, f_tmp)
+            f_tmp.close()
+            os.replace(filename + ".tmp", filename)
+            return
+        f_r = open(filename, "r")
+        layout = json.load(f_r)
+        f_r.close()
+        if self.shard_count != layout['shards'] or self.placement and self.placement != layout['placement']:
+            raise ValueError(self.directory + ' was written with ' + str(layout['shards']) +
+                             ' shards and placement ' + str(layout['placement']))
+        (self.shard_count, self.placement) = (layout['shards'], layout['placement'])
+
+    def global_id(self, number: int, local: int) -> int:
+        """
+        :return: global ID of the local ID of a shard
+        """
+        return local * self.shard_count + number
+
+    def split_id(self, comp_id: int) -> tuple:
+        """
+        :return: (shard number, local ID) of a global ID
+        """
+        return comp_id % self.shard_count, comp_id // self.shard_count
+
+    def shard_number(self, component: Component) -> int:
+        """
+        :return: number of the shard owning a component
+        """
+        return shard_of(component.manufacturer, self.shard_count, self.placement)
+
+    def shard(self, component: Component) -> CompatibilityDatabase:
+        """
+        :return: shard owning a component
+        """
+        return self.shards[self.shard_number(component)]
+
+    def _touch(self, comp_ids):
+        """
+        bumps the version of the given global IDs and tells the listeners, see CompatibilityDatabase._touch
+        """
+        comp_ids = list(comp_ids)
+        with self._versions_lock:
+            versions = self.component_versions
+            for comp_id in comp_ids:
+                versions[comp_id] = versions.get(comp_id, 0) + 1
+            self.version += 1
+            for listener in self.listeners:
+                listener(comp_ids)
+
+    def _new_generation(self):
+        with self._versions_lock:
+            self.component_versions = dict()
+            self.generation += 1
+            for listener in self.listeners:
+                listener(None)
+
+    def init_from_file(self):
+        """
+        loads every shard from its files, shards without files yet start empty
+        """
+        with metrics.timer('sharded.init_from_file'):
+            for shard in self.shards:
+                if shard.dependency_file is None:
+                    shard.initialized = True
+                    continue
+                if not os.path.exists(shard.dependency_file):
+                    shard.write_state_to_disk()
+                shard.init_from_file()
+        self._new_generation()
+
+    def import_database(self, database: CompatibilityDatabase, chunk_size: int = BULK_CHUNK) -> int:
+        """
+        copies a CompatibilityDatabase into the shards, e.g. to split an existing catalog.
+        Only the explicit edges are copied, rules and exclusions are not, neither as rules
+        nor as what they decide, so a part only a rule made compatible is not compatible here.
+        :param database: source database
+        :param chunk_size: components per locked pass and logged record, see bulk_add
+        :return: number of components added
+        """
+        database.materialize()
+        if database.rules:
+            warnings.warn('Rules and exclusions are not copied into shards')
+        components = list(database.id_chart)
+        rows = full_rows(database.dependencies) if database.undirected else database.dependencies
+        return self.bulk_add(((component, [components[other] for other in rows.get(comp_id, ())])
+                              for (comp_id, component) in enumerate(components)),
+                             symmetric=False, chunk_size=chunk_size)
+
+    def cid(self, component: Component) -> int:
+        """
+        :return: global ID of a component
+        """
+        return self.inventory[component]
+
+    def component_from_id(self, comp_id: int):
+        """
+        :return: component with the given global ID
+        """
+        (number, local) = self.split_id(comp_id)
+        return self.shards[number].id_chart[local]
+
+    def uuid(self, component: Component) -> str:
+        """
+        :return: uuid of a component
+        """
+        return self.shard(component).uuid(component)
+
+    def component_from_uuid(self, comp_uuid: str):
+        """
+        :return: component with the given uuid, looked up in every shard
+        """
+        for shard in self.shards:
+            if comp_uuid in shard.uuid_index:
+                return shard.component_from_uuid(comp_uuid)
+        raise KeyError(comp_uuid)
+
+    def add_component(self, component: Component, compatibility_set: set):
+        """
+        Adds new component to its shard
+        :param component: Component to add
+        :param compatibility_set: global IDs of the components it is compatible with, in any shard
+        :return: None
+        """
+        number = self.shard_number(component)
+        shard = self.shards[number]
+        with shard._lock:
+            if component in shard.inventory:
+                warnings.warn('Component already exists. Use update_compatibility to add more compatible items')
+                return
+            shard.add_component(component, compatibility_set)
+            comp_id = self.global_id(number, shard.inventory[component])
+        self._touch([comp_id] + list(compatibility_set))
+
+    def update_compatibility(self, component, new_item):
+        """
+        makes new_item compatible with component, written to the shard of component only
+        :param component: component to update
+        :param new_item: item to add in compatibility set
+        :return: None
+        """
+        if metrics.enabled:
+            metrics.incr('db.update_compatibility')
+        if component not in self.inventory:
+            raise KeyError('Component not in inventory')
+        elif new_item not in self.inventory:
+            raise KeyError('new compatible item not in inventory')
+        (number, local) = self.split_id(self.cid(component))
+        self.shards[number].link({local: {self.cid(new_item)}})
+        self._touch((self.cid(component), self.cid(new_item)))
+
+    def _link(self, additions: dict):
+        """
+        routes new edges to the shards owning their rows, each shard is written under its own lock
+        :param additions: dict mapping global ID to the global IDs to add to its row
+        :return: None
+        """
+        routed = [dict() for _ in self.shards]
+        for (comp_id, compatible) in additions.items():
+            (number, local) = self.split_id(comp_id)
+            routed[number][local] = compatible
+        for (shard, rows) in zip(self.shards, routed):
+            if rows:
+                shard.link(rows)
+        touched = set(additions)
+        for compatible in additions.values():
+            touched.update(compatible)
+        self._touch(touched)
+
+    def bulk_update(self, edges, symmetric: bool = True, chunk_size: int = BULK_CHUNK) -> int:
+        """
+        adds many compatibility edges at once, see CompatibilityDatabase.bulk_update.
+        Every chunk is validated, then written as one record per shard it touches.
+        :param edges: iterable of (component, compatible component) pairs, may be a generator
+        :param symmetric: also make the second component compatible with the first
+        :param chunk_size: pairs per chunk
+        :return: number of pairs read
+        """
+        count = 0
+        for chunk in CompatibilityDatabase._chunks(edges, chunk_size):
+            additions = dict()
+            for (component, other) in chunk:
+                comp_id = self.inventory.get(component)
+                other_id = self.inventory.get(other)
+                if comp_id is None or other_id is None:
+                    raise KeyError('Component not in inventory: ' + (other if comp_id is not None
+                                                                     else component).name)
+                additions.setdefault(comp_id, set()).add(other_id)
+                if symmetric:
+                    additions.setdefault(other_id, set()).add(comp_id)
+            self._link(additions)
+            count += len(chunk)
+        return count
+
+    def bulk_add(self, components_with_compat, symmetric: bool = True, chunk_size: int = BULK_CHUNK,
+                 unresolved: list = None) -> int:
+        """
+        adds many components with their compatible components at once, see CompatibilityDatabase.bulk_add.
+        Per chunk the new components are registered in their shards first, then the edges are routed.
+        References that never arrive are left out and reported the same way.
+        :param components_with_compat: iterable of (component, iterable of compatible components), may be a generator
+        :param symmetric: also add every component to the rows of its compatible components
+        :param chunk_size: components per chunk
+        :param unresolved: optional list, gets the (component, compatible component) pairs left out
+        :return: number of components added
+        """
+        added = 0
+        pending = []
+        for chunk in CompatibilityDatabase._chunks(components_with_compat, chunk_size):
+            by_shard = [dict() for _ in self.shards]
+            for (component, _) in chunk:
+                if component not in self.inventory:
+                    by_shard[self.shard_number(component)][component] = ()
+            new = []
+            for (shard, components) in zip(self.shards, by_shard):
+                if components:
+                    added += shard.bulk_add(components.items(), symmetric=False, chunk_size=len(components))
+                    new.extend(self.cid(component) for component in components)
+
+            additions = dict()
+            waiting = []
+            for (comp_id, other) in pending + [(self.cid(component), other)
+                                               for (component, compatible) in chunk for other in compatible]:
+                other_id = self.inventory.get(other)
+                if other_id is None:
+                    waiting.append((comp_id, other))
+                    continue
+                additions.setdefault(comp_id, set()).add(other_id)
+                if symmetric:
+                    additions.setdefault(other_id, set()).add(comp_id)
+            pending = waiting
+            self._link(additions)
+            if new:
+                self._touch(new)
+
+        CompatibilityDatabase._report_unresolved([(self.component_from_id(comp_id), other)
+                                                  for (comp_id, other) in pending], unresolved)
+        return added
+
+    def compatibility(self, comp1, comp2):
+        """
+        compares the compatibility of two objects in database
+        :param comp1: first object
+        :param comp2: second object
+        :return: True if compatible, False otherwise
+        """
+        if metrics.enabled:
+            metrics.incr('db.compatibility')
+        id1 = self.inventory.get(comp1)
+        if id1 is None:
+            raise KeyError("First component not in inventory")
+
+        id2 = self.inventory.get(comp2)
+        if id2 is None:
+            raise KeyError("Second component not in inventory")
+
+        return self.compatible_ids(id1, id2)
+
+    def compatible_ids(self, id1: int, id2: int) -> bool:
+        """
+        compatibility check on global IDs, answered by the shard of id1
+        :return: True if id2 is in the compatibility set of id1
+        """
+        (number, local) = self.split_id(id1)
+        return id2 in self.shards[number].dependencies[local]
+
+    def mutually_compatible(self, id1: int, id2: int) -> bool:
+        """
+        :return: True if each is in the compatibility set of the other
+        """
+        return self.compatible_ids(id1, id2) and self.compatible_ids(id2, id1)
+
+    def row(self, comp_id: int):
+        """
+        :return: global IDs a component is compatible with
+        """
+        (number, local) = self.split_id(comp_id)
+        return self.shards[number].dependencies[local]
+
+    def rows(self, comp_ids) -> dict:
+        """
+        rows of many components, gathered shard by shard
+        :param comp_ids: iterable of global IDs
+        :return: dict mapping global ID to its row
+        """
+        routed = [[] for _ in self.shards]
+        for comp_id in comp_ids:
+            routed[comp_id % self.shard_count].append(comp_id)
+        found = dict()
+        for (shard, shard_ids) in zip(self.shards, routed):
+            dependencies = shard.dependencies
+            for comp_id in shard_ids:
+                found[comp_id] = dependencies[comp_id // self.shard_count]
+        return found
+
+    def compatible_with_all(self, component, others) -> bool:
+        """
+        checks one component against many at once, from the row in its shard
+        :param component: component to check
+        :param others: components it has to be compatible with
+        :return: True if component is compatible with every one of others
+        """
+        return self.row(self.cid(component)).issuperset(self.cid(other) for other in others)
+
+    def common_compatible(self, components) -> set:
+        """
+        returns the components that all given components are compatible with
+        :param components: iterable of components
+        :return: set of components
+        """
+        rows = sorted(self.rows(self.cid(comp) for comp in components).values(), key=len)
+        if len(rows) == 0:
+            return set(self.inventory)
+        common = set(rows[0]).intersection(*rows[1:])
+        return {self.component_from_id(comp_id) for comp_id in common}
+
+    def query(self, comp_type=None, manufacturer=None, structure=None, mechanism=None, diameter=None, use=None,
+              compatible_with=None) -> set:
+        """
+        filters the inventory, see CompatibilityDatabase.query. A manufacturer filter only
+        asks the shard owning it, otherwise every shard filters its own index and the
+        matches are gathered; compatible_with intersects the rows of the parts, then
+        keeps the candidates whose own rows, in their shards, hold every part.
+        :return: set of matching components
+        """
+        numbers = range(self.shard_count) if manufacturer is None else \
+            [shard_of(manufacturer, self.shard_count, self.placement)]
+        filtered = any(value is not None for value in (comp_type, manufacturer, structure, mechanism, diameter, use))
+        candidates = None
+        if filtered:
+            candidates = set()
+            for number in numbers:
+                shard = self.shards[number]
+                for component in shard.query(comp_type=comp_type, manufacturer=manufacturer, structure=structure,
+                                             mechanism=mechanism, diameter=diameter, use=use):
+                    candidates.add(self.global_id(number, shard.inventory[component]))
+
+        if compatible_with is not None:
+            part_ids = [self.cid(part) for part in compatible_with]
+            rows = sorted(self.rows(part_ids).values(), key=len)
+            if candidates is None:
+                candidates = set(rows[0]) if rows else set(self.inventory.values())
+            for row in rows:
+                candidates = candidates.intersection(row)
+            candidates = {comp_id for (comp_id, row) in self.rows(candidates).items() if row.issuperset(part_ids)}
+        elif candidates is None:
+            return set(self.inventory)
+
+        return {self.component_from_id(comp_id) for comp_id in candidates}
+
+    def write_state_to_disk(self):
+        """
+        writes a snapshot of every shard
+        """
+        for shard in self.shards:
+            if shard.dependency_file is not None:
+                shard.write_state_to_disk()
+
+    def stats(self) -> dict:
+        """
+        :return: dict with the totals over the shards and the stats of every shard under 'shards'
+        """
+        shards = [shard.stats() for shard in self.shards]
+        totals = {key: sum(stats[key] for stats in shards) for key in ('components', 'edges', 'memory_bytes', 'dirty')}
+        totals.update({'version': self.version, 'undirected': False, 'shards': shards})
+        return totals
+
+    def close(self):
+        """
+        Closes every shard
+        """
+        for shard in self.shards:
+            shard.close()
+        if self.gauge is not None:
+            metrics.drop_gauge(self.gauge)
+            self.gauge = None
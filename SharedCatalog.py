@@ -0,0 +1,183 @@
+import mmap
+import os
+import struct
+from multiprocessing import shared_memory
+from CatalogFile import MappedCatalog, HEADER
+
+try:
+    import _posixshmem
+except ImportError:
+    # Windows, readers need POSIX shared memory
+    _posixshmem = None
+
+'''
+Catalog generations in shared memory, for validating on many processes at once.
+
+The publisher writes the database in the CatalogFile layout into a new shared
+memory segment per generation, then bumps the generation number in a small
+control segment. Readers map the segment of the current generation read-only
+and answer from it in place through MappedCatalog, so every process shares the
+same pages instead of holding its own copy of the catalog:
+
+    shared = SharedCatalog()
+    shared.publish(database)
+    reader = SharedCatalogReader(shared.prefix)   # in a worker process
+    worker_database.init_from_mapped(reader.catalog)
+
+A reader picks up a newer generation with refresh. A generation is complete
+before its number is published, so a reader sees either the old or the new
+catalog. Old segments are unlinked once keep newer generations exist, processes
+still mapping one keep it until they move on.
+'''
+
+# generation number in the control segment
+CONTROL = struct.Struct('<Q')
+
+
+def segment_name(prefix: str, generation: int) -> str:
+    """
+    :return: name of the segment holding a generation, the control segment is generation 'ctl'
+    """
+    return prefix + '_' + str(generation)
+
+
+def _attach(name: str) -> mmap.mmap:
+    """
+    maps an existing segment read-only. SharedMemory is not used here, it maps
+    read-write and hands the segment to the resource tracker of this process,
+    which would unlink it on exit; only the publisher owns segments.
+    :param name: segment name
+    :return: read-only mapping of the whole segment
+    """
+    if _posixshmem is None:
+        raise OSError('Shared catalogs need POSIX shared memory')
+    descriptor = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+    try:
+        return mmap.mmap(descriptor, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(descriptor)
+
+
+class SharedCatalog:
+    """
+    Publishes catalog generations of a database into shared memory
+    """
+
+    def __init__(self, prefix: str = None, keep: int = 2):
+        """
+        init function
+        :param prefix: name prefix of the segments, unique per publisher by default
+        :param keep: generations kept mapped for readers that have not refreshed yet
+        """
+        self.prefix = prefix or 'cmk' + os.urandom(4).hex()
+        self.keep = max(1, keep)
+        self.generation = 0
+        self._control = shared_memory.SharedMemory(segment_name(self.prefix, 'ctl'), create=True,
+                                                   size=CONTROL.size)
+        CONTROL.pack_into(self._control.buf, 0, 0)
+        # generation -> its segment, newest last
+        self._segments = dict()
+
+    def publish(self, database) -> int:
+        """
+        writes the current state of a database as the next generation
+        :param database: CompatibilityDatabase, see catalog_image
+        :return: the new generation number
+        """
+        parts = database.catalog_image()
+        generation = self.generation + 1
+        segment = shared_memory.SharedMemory(segment_name(self.prefix, generation), create=True,
+                                             size=sum(len(part) for part in parts))
+        position = 0
+        for part in parts:
+            segment.buf[position:position + len(part)] = part
+            position += len(part)
+        self._segments[generation] = segment
+
+        # the segment is complete, readers may switch to it
+        CONTROL.pack_into(self._control.buf, 0, generation)
+        self.generation = generation
+
+        for old in [number for number in self._segments if number <= generation - self.keep]:
+            self._release(old)
+        return generation
+
+    def _release(self, generation: int):
+        segment = self._segments.pop(generation)
+        segment.close()
+        segment.unlink()
+
+    def close(self):
+        """
+        unlinks every segment, readers still mapping one keep it until they close
+        """
+        for generation in list(self._segments):
+            self._release(generation)
+        self._control.close()
+        self._control.unlink()
+
+    def stats(self) -> dict:
+        """
+        :return: dict with the current generation, generations kept and their bytes
+        """
+        return {'generation': self.generation, 'segments': len(self._segments),
+                'bytes': sum(segment.size for segment in self._segments.values())}
+
+
+class SharedCatalogReader:
+    """
+    Read-only view of the current generation of a SharedCatalog
+    """
+
+    def __init__(self, prefix: str):
+        """
+        init function
+        :param prefix: prefix of the publisher, SharedCatalog.prefix
+        """
+        self.prefix = prefix
+        self._control = _attach(segment_name(prefix, 'ctl'))
+        self.generation = 0
+        self.catalog = None
+        self._segment = None
+        if not self.refresh():
+            raise FileNotFoundError('Nothing published under ' + prefix + ' yet')
+
+    def refresh(self) -> bool:
+        """
+        switches to the newest generation if there is one. The previous catalog is
+        closed, callers have to stop using it, see CompatibilityDatabase.init_from_mapped
+        :return: True if the catalog changed
+        """
+        while True:
+            generation = CONTROL.unpack_from(self._control, 0)[0]
+            if generation == self.generation:
+                return False
+            try:
+                segment = _attach(segment_name(self.prefix, generation))
+                break
+            except FileNotFoundError:
+                # published and already released again while we looked, read the number again
+                continue
+
+        # segments may be rounded up to whole pages, the catalog ends where its header says
+        end = HEADER.unpack_from(segment, 0)[10]
+        catalog = MappedCatalog(segment_name(self.prefix, generation), buffer=memoryview(segment)[:end])
+        (previous, self.catalog, self._segment) = ((self.catalog, self._segment), catalog, segment)
+        self.generation = generation
+        self._close(*previous)
+        return True
+
+    @staticmethod
+    def _close(catalog, segment):
+        if catalog is not None:
+            catalog.close()
+        if segment is not None:
+            segment.close()
+
+    def close(self):
+        """
+        unmaps the current generation
+        """
+        self._close(self.catalog, self._segment)
+        (self.catalog, self._segment) = (None, None)
+        self._control.close()
@@ -0,0 +1,163 @@
+import random
+from Components import *
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, signatures are then hashed one ID at a time
+    np = None
+
+'''
+Nearest alternatives by compatibility row, see CompatibilityDatabase.similar
+'''
+
+# hashes are (a * ID + b) mod PRIME, small enough that a * ID fits in 64 bits
+PRIME = (1 << 31) - 1
+
+# IDs hashed per numpy step, bounds the temporary matrix
+HASH_CHUNK = 4096
+
+
+class SimilarityIndex:
+    """
+    MinHash signatures of the compatibility rows with LSH buckets, per Component_Type.
+    Two parts that fit mostly the same components agree on about as many
+    signature values as the Jaccard similarity of their rows. Signatures are cut
+    into bands and parts sharing a band are candidates, so a lookup only ranks
+    the parts in its buckets instead of comparing rows across the catalog.
+    New edges only lower signature values, so rows are updated in place.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        """
+        init function
+        :param num_perm: signature length, more is more precise and slower
+        :param bands: LSH bands, num_perm / bands values each. More bands find less similar parts
+        :param seed: seed of the hash functions
+        """
+        if num_perm % bands != 0:
+            raise ValueError('num_perm must be a multiple of bands')
+        rng = random.Random(seed)
+        self.coefficients = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+        self.bands = bands
+        self.band_width = num_perm // bands
+        if np is not None:
+            self._a = np.array([a for (a, _) in self.coefficients], dtype=np.int64)[:, None]
+            self._b = np.array([b for (_, b) in self.coefficients], dtype=np.int64)[:, None]
+
+        # component ID -> signature tuple and comp_type
+        self.signatures = dict()
+        self.types = dict()
+        # comp_type -> one dict per band mapping band values to the IDs having them.
+        # Buckets are replaced, never changed in place, so lookups need no lock
+        self.buckets = dict()
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _minhash(self, comp_ids) -> list:
+        """
+        :param comp_ids: iterable of component IDs
+        :return: minimum of every hash function over the IDs, PRIME for none
+        """
+        comp_ids = list(comp_ids)
+        if np is None:
+            return [min(((a * comp_id + b) % PRIME for comp_id in comp_ids), default=PRIME)
+                    for (a, b) in self.coefficients]
+        signature = np.full(len(self.coefficients), PRIME, dtype=np.int64)
+        for start in range(0, len(comp_ids), HASH_CHUNK):
+            chunk = np.array(comp_ids[start:start + HASH_CHUNK], dtype=np.int64)[None, :]
+            signature = np.minimum(signature, ((self._a * chunk + self._b) % PRIME).min(axis=1))
+        return signature.tolist()
+
+    def _band_keys(self, signature) -> list:
+        width = self.band_width
+        return [tuple(signature[band * width:(band + 1) * width]) for band in range(self.bands)]
+
+    def _place(self, comp_id: int, old, new):
+        """
+        moves a component from the buckets of its old signature to those of the new one.
+        Empty rows are not bucketed, they say nothing about similarity.
+        """
+        tables = self.buckets.setdefault(self.types[comp_id], [dict() for _ in range(self.bands)])
+        old_keys = self._band_keys(old) if old is not None and min(old) < PRIME else [None] * self.bands
+        new_keys = self._band_keys(new) if min(new) < PRIME else [None] * self.bands
+        for (table, old_key, new_key) in zip(tables, old_keys, new_keys):
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                table[old_key] = table[old_key] - {comp_id}
+                if len(table[old_key]) == 0:
+                    del table[old_key]
+            if new_key is not None:
+                table[new_key] = table.get(new_key, frozenset()) | {comp_id}
+
+    def add(self, comp_id: int, comp_type: Component_Type, row=()):
+        """
+        indexes a component
+        :param comp_id: its ID
+        :param comp_type: its Component_Type, only parts of the same type are compared
+        :param row: IDs it is compatible with
+        :return: None
+        """
+        self.types[comp_id] = comp_type
+        signature = tuple(self._minhash(row))
+        self._place(comp_id, self.signatures.get(comp_id), signature)
+        self.signatures[comp_id] = signature
+
+    def update(self, comp_id: int, new_ids):
+        """
+        adds IDs to the row of an indexed component
+        :param comp_id: its ID
+        :param new_ids: IDs it became compatible with
+        :return: None
+        """
+        old = self.signatures.get(comp_id)
+        if old is None:
+            return
+        signature = tuple(min(value, added) for (value, added) in zip(old, self._minhash(new_ids)))
+        if signature != old:
+            self._place(comp_id, old, signature)
+            self.signatures[comp_id] = signature
+
+    def build(self, database):
+        """
+        indexes every component of a database
+        :param database: CompatibilityDatabase, rows are read with its row method
+        :return: None
+        """
+        for comp_id in range(len(database.id_chart)):
+            self.add(comp_id, database.id_chart[comp_id].comp_type, database.row(comp_id))
+
+    def similarity(self, comp_id: int, other: int) -> float:
+        """
+        :return: estimated Jaccard similarity of the rows of two indexed components
+        """
+        (first, second) = (self.signatures[comp_id], self.signatures[other])
+        return sum(1 for (value, other_value) in zip(first, second) if value == other_value) / len(first)
+
+    def candidates(self, comp_id: int) -> set:
+        """
+        :return: IDs of the same type sharing at least one band with comp_id
+        """
+        signature = self.signatures.get(comp_id)
+        if signature is None or min(signature) == PRIME:
+            return set()
+        found = set()
+        for (table, key) in zip(self.buckets[self.types[comp_id]], self._band_keys(signature)):
+            found.update(table.get(key, ()))
+        found.discard(comp_id)
+        return found
+
+    def nearest(self, comp_id: int, k: int = 5, accept=None) -> list:
+        """
+        the indexed components whose rows are most like the row of comp_id
+        :param comp_id: component ID
+        :param k: number of results
+        :param accept: optional predicate on candidate IDs, e.g. that they fit a build
+        :return: list of up to k (ID, estimated similarity), most similar first
+        """
+        scored = [(self.similarity(comp_id, other), other) for other in self.candidates(comp_id)
+                  if accept is None or accept(other)]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(other, score) for (score, other) in scored[:k]]
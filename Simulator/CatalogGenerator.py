@@ -0,0 +1,87 @@
+import random
+from time import perf_counter
+from Components import *
+
+'''
+Seeded synthetic catalogs for benchmarks and load tests
+'''
+
+# components of each type per manufacturer when no counts are given
+DEFAULT_COUNTS = {Component_Type.Body: 10, Component_Type.Engine: 10, Component_Type.Battery: 10,
+                  Component_Type.Wheels: 10, Component_Type.Extra: 20}
+
+EXTRA_USES = ['Radio', 'Seat_cover', 'Spoiler', 'Navigation', 'Roof_rack']
+
+
+def generate_components(manufacturers: int = 10, counts: dict = None, seed: int = 0) -> list:
+    """
+    creates components for a number of synthetic manufacturers
+    :param manufacturers: number of manufacturers
+    :param counts: dict Component_Type -> number of components per manufacturer
+    :param seed: random seed
+    :return: list of components
+    """
+    rng = random.Random(seed)
+    counts = DEFAULT_COUNTS if counts is None else counts
+    components = []
+    for man in range(manufacturers):
+        factory = Component_factory('Maker' + str(man))
+        for number in range(counts.get(Component_Type.Body, 0)):
+            components.append(factory.create_body_component('body' + str(number), rng.choice(list(Structure))))
+        for number in range(counts.get(Component_Type.Engine, 0)):
+            components.append(factory.create_engine_component('engine' + str(number),
+                                                              rng.choice(list(Engine_Mechanism))))
+        for number in range(counts.get(Component_Type.Battery, 0)):
+            components.append(factory.create_battery_component('battery' + str(number)))
+        for number in range(counts.get(Component_Type.Wheels, 0)):
+            components.append(factory.create_wheels_component('wheels' + str(number), rng.choice(list(Diameter))))
+        for number in range(counts.get(Component_Type.Extra, 0)):
+            components.append(factory.create_extra_component('extra' + str(number), rng.choice(EXTRA_USES)))
+    return components
+
+
+def generate_compatibility(size: int, density: float = 0.05, symmetric: bool = True, seed: int = 0) -> list:
+    """
+    random compatibility rows over ids 0..size-1
+    :param size: number of components
+    :param density: fraction of the catalog each component is compatible with
+    :param symmetric: mirror every edge
+    :param seed: random seed
+    :return: list of sets, row i holds the ids component i is compatible with
+    """
+    rng = random.Random(seed + 1)
+    per_row = min(size, int(round(density * size)))
+    rows = [set(rng.sample(range(size), per_row)) for _ in range(size)]
+    if symmetric:
+        for (comp_id, row) in enumerate(rows):
+            for other in list(row):
+                rows[other].add(comp_id)
+    for (comp_id, row) in enumerate(rows):
+        row.add(comp_id)
+    return rows
+
+
+def populate(database, manufacturers: int = 10, counts: dict = None, density: float = 0.05,
+             symmetric: bool = True, seed: int = 0, timings: list = None) -> list:
+    """
+    fills an empty database with a synthetic catalog through add_component
+    :param database: empty CompatibilityDatabase
+    :param manufacturers: number of manufacturers
+    :param counts: dict Component_Type -> number of components per manufacturer
+    :param density: fraction of the catalog each component is compatible with
+    :param symmetric: mirror every edge
+    :param seed: random seed
+    :param timings: optional list receiving the duration of every add_component call in seconds
+    :return: list of the added components, in id order
+    """
+    if len(database.inventory) != 0:
+        raise ValueError('populate needs an empty database, ids are assigned in insertion order')
+
+    components = generate_components(manufacturers, counts, seed)
+    rows = generate_compatibility(len(components), density, symmetric, seed)
+    for (component, row) in zip(components, rows):
+        start = perf_counter()
+        database.add_component(component, row)
+        if timings is not None:
+            timings.append(perf_counter() - start)
+    return components
@@ -73,7 +73,7 @@ def sim_client(clientID: str, builder: Builder, inventory: set):
         print("\n Conflicts: ")
         print([(x.name, y.name) for (x, y) in client1.show_conflict()])
         print("\n Suggestions: ")
-        print([x.name for x in client1.show_suggestions()])
+        print([(x.name, [y.name for y in ys]) for (x, ys) in client1.show_suggestions().items()])
 
 
 def sim_manufacturer(man_name: str, database: CompatibilityDatabase):
@@ -92,17 +92,11 @@ def sim_manufacturer(man_name: str, database: CompatibilityDatabase):
     man1 = Manufacturer(man_name, database)
     man_factory = Component_factory(man_name)
     all_compatible_radio = man_factory.create_extra_component('DD_radio', 'Radio')
-    compatibility_set = set(database.inventory.values())
+    compatible_components = list(database.inventory.keys())
 
     '''
-    Send component to database
+    Send component to database, every inventory item also becomes compatible with it
     '''
-    man1.send_to_database(all_compatible_radio, compatibility_set)
-
-    '''
-    update compatibility sets of all compatible components
-    '''
-    for comp in database.inventory.keys():
-        man1.update_compatibility(comp, all_compatible_radio)
+    man1.send_many([(all_compatible_radio, compatible_components)])
 
     print("Component added!")
@@ -0,0 +1,291 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, set operations and encoding then run one ID at a time
+    np = None
+
+'''
+Compressed compatibility rows, see CompatibilityDatabase(compact=True)
+'''
+
+# unsigned 32 bit items, 'L' where 'I' is not 4 bytes
+TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+ITEM_BYTES = 4
+
+# first byte of the encoded form
+SORTED = 0
+BITMAP = 1
+
+
+def _varint(value: int, out: bytearray):
+    """
+    appends value as LEB128, 7 bits per byte with the high bit set on every byte but the last
+    """
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position: int) -> tuple:
+    """
+    :return: (value, position after it)
+    """
+    (value, shift) = (0, 0)
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_deltas(values) -> bytes:
+    """
+    sorted IDs as LEB128 gaps, IDs that are close together take one byte each
+    :param values: sorted sequence of non-negative ints
+    :return: encoded bytes
+    """
+    if np is None:
+        out = bytearray()
+        previous = 0
+        for value in values:
+            _varint(value - previous, out)
+            previous = value
+        return bytes(out)
+    gaps = np.diff(np.asarray(values, dtype=np.uint64), prepend=np.uint64(0))
+    lengths = np.ones(len(gaps), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        lengths += gaps >= np.uint64(1 << shift)
+    starts = np.cumsum(lengths) - lengths
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    for byte in range(int(lengths.max(initial=0))):
+        present = lengths > byte
+        bits = (gaps[present] >> np.uint64(7 * byte)) & np.uint64(0x7f)
+        more = (lengths[present] > byte + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[present] + byte] = bits | more
+    return out.tobytes()
+
+
+def decode_deltas(data):
+    """
+    :param data: bytes written by encode_deltas
+    :return: sorted IDs, an int64 array with numpy, else a list
+    """
+    if np is None:
+        (values, position, previous) = ([], 0, 0)
+        while position < len(data):
+            (gap, position) = _read_varint(data, position)
+            previous += gap
+            values.append(previous)
+        return values
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if len(raw) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shift = (np.arange(len(raw)) - starts[group]) * 7
+    # float weights are exact far beyond 32 bit gaps
+    gaps = np.bincount(group, weights=(raw & 0x7f).astype(np.float64) * np.exp2(shift), minlength=len(ends))
+    return np.cumsum(gaps.astype(np.int64))
+
+
+class SparseSet:
+    """
+    Immutable set of component IDs in one of two containers, whichever is smaller:
+    a sorted array of 4 byte IDs, or for rows dense over their range a bitmap
+    starting at the smallest ID, one bit per ID. Sparse rows cost 4 bytes per edge,
+    dense ones down to 1 bit, against about 30 for an int in a frozenset.
+    Membership is a binary search or a bit test; intersection and union merge
+    the sorted IDs. It takes the place of the frozenset rows of
+    CompatibilityDatabase: union returns a new set, nothing changes in place.
+    Pickled it is delta encoded (encode_deltas), about one byte per edge in
+    dense catalogs.
+    """
+
+    __slots__ = ('_items', '_base', '_bits', '_count')
+
+    def __init__(self, items=()):
+        """
+        init function
+        :param items: iterable of non-negative int IDs
+        """
+        if isinstance(items, SparseSet):
+            (self._items, self._base, self._bits, self._count) = (items._items, items._base, items._bits,
+                                                                  items._count)
+            return
+        self._fill(sorted(set(items)))
+
+    @classmethod
+    def from_sorted(cls, values):
+        """
+        :param values: sorted sequence of distinct non-negative ints, e.g. a numpy array
+        :return: SparseSet of them, without sorting again
+        """
+        result = cls.__new__(cls)
+        result._fill(values)
+        return result
+
+    def _fill(self, values):
+        """
+        picks the smaller container for sorted distinct values and fills it
+        """
+        count = len(values)
+        self._count = count
+        (self._items, self._base, self._bits) = (None, 0, None)
+        span = int(values[-1]) - int(values[0]) + 1 if count else 0
+        if (span + 7) // 8 >= count * ITEM_BYTES:
+            items = array(TYPECODE)
+            if np is not None and not isinstance(values, list):
+                items.frombytes(np.asarray(values, dtype=np.uint32).tobytes())
+            else:
+                items.extend(values)
+            self._items = items
+            return
+        self._base = int(values[0])
+        if np is not None:
+            bits = np.zeros(span, dtype=np.uint8)
+            bits[np.asarray(values, dtype=np.int64) - self._base] = 1
+            self._bits = np.packbits(bits, bitorder='little').tobytes()
+            return
+        bits = bytearray((span + 7) // 8)
+        for value in values:
+            offset = value - self._base
+            bits[offset >> 3] |= 1 << (offset & 7)
+        self._bits = bytes(bits)
+
+    def values(self):
+        """
+        :return: the IDs in order, an int64 array with numpy, else a sequence of ints
+        """
+        if self._items is not None:
+            if np is not None:
+                return np.frombuffer(self._items, dtype=np.uint32).astype(np.int64)
+            return self._items
+        if np is not None:
+            return np.flatnonzero(np.unpackbits(np.frombuffer(self._bits, dtype=np.uint8),
+                                                bitorder='little')) + self._base
+        return list(iter(self))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        if self._items is not None:
+            return iter(self._items)
+        return self._iter_bits()
+
+    def _iter_bits(self):
+        base = self._base
+        for (index, byte) in enumerate(self._bits):
+            while byte:
+                low = byte & -byte
+                yield base + index * 8 + low.bit_length() - 1
+                byte ^= low
+
+    def __contains__(self, comp_id) -> bool:
+        try:
+            if self._items is not None:
+                position = bisect_left(self._items, comp_id)
+                return position < self._count and self._items[position] == comp_id
+            offset = comp_id - self._base
+            return 0 <= offset < len(self._bits) * 8 and bool(self._bits[offset >> 3] >> (offset & 7) & 1)
+        except TypeError:
+            return False
+
+    def intersection(self, *others) -> 'SparseSet':
+        """
+        :param others: SparseSets or any iterables of IDs
+        :return: SparseSet of the IDs in self and in every one of others
+        """
+        values = self.values()
+        for other in others:
+            if np is not None and isinstance(other, SparseSet):
+                values = np.intersect1d(values, other.values(), assume_unique=True)
+            else:
+                if not isinstance(other, (set, frozenset, SparseSet)):
+                    other = set(other)
+                values = [value for value in values if value in other]
+        return SparseSet.from_sorted(values)
+
+    def union(self, *others) -> 'SparseSet':
+        """
+        :param others: SparseSets or any iterables of IDs
+        :return: SparseSet of the IDs in self or in any of others, self if none of them is new
+        """
+        new = set()
+        for other in others:
+            new.update(value for value in other if value not in self)
+        if not new:
+            return self
+        if np is not None:
+            return SparseSet.from_sorted(np.union1d(self.values(), np.fromiter(new, dtype=np.int64, count=len(new))))
+        return SparseSet.from_sorted(sorted(list(self) + list(new)))
+
+    __and__ = intersection
+    __or__ = union
+
+    def issuperset(self, other) -> bool:
+        return all(value in self for value in other)
+
+    def issubset(self, other) -> bool:
+        if not isinstance(other, (set, frozenset, SparseSet)):
+            other = set(other)
+        return all(value in other for value in self)
+
+    def isdisjoint(self, other) -> bool:
+        return not any(value in self for value in other)
+
+    def __eq__(self, other):
+        if not isinstance(other, (set, frozenset, SparseSet)):
+            return NotImplemented
+        return len(self) == len(other) and self.issubset(other)
+
+    def __hash__(self):
+        return hash(frozenset(self))
+
+    def __sizeof__(self):
+        container = self._items if self._items is not None else self._bits
+        return object.__sizeof__(self) + sys.getsizeof(container)
+
+    def __repr__(self):
+        return 'SparseSet(' + repr(list(self)) + ')'
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: compact encoding, the sorted IDs as gaps (encode_deltas) or the bitmap with its base
+        """
+        if self._items is not None:
+            return bytes((SORTED,)) + encode_deltas(self.values())
+        header = bytearray((BITMAP,))
+        _varint(self._base, header)
+        _varint(self._count, header)
+        return bytes(header) + self._bits
+
+    @classmethod
+    def from_bytes(cls, data) -> 'SparseSet':
+        """
+        :param data: bytes written by to_bytes
+        :return: the SparseSet
+        """
+        if data[0] == SORTED:
+            return cls.from_sorted(decode_deltas(data[1:]))
+        result = cls.__new__(cls)
+        (result._base, position) = _read_varint(data, 1)
+        (result._count, position) = _read_varint(data, position)
+        (result._items, result._bits) = (None, bytes(data[position:]))
+        return result
+
+    def __reduce__(self):
+        return _decode, (self.to_bytes(),)
+
+
+def _decode(data) -> SparseSet:
+    # module level, for pickle
+    return SparseSet.from_bytes(data)
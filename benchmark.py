@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import Component_Type
+from Simulator import CatalogGenerator
+
+'''
+Benchmarks the database and builder hot paths on synthetic catalogs.
+Writes one JSON document so results can be compared between commits, e.g.
+
+    python benchmark.py --manufacturers 10 100 --density 0.01 --out bench.json
+'''
+
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+
+
+def summarize(name: str, timings: list) -> dict:
+    """
+    throughput and latency percentiles of a list of call durations
+    :param name: operation name
+    :param timings: durations in seconds
+    :return: dict for the JSON report
+    """
+    ordered = sorted(timings)
+    total = sum(ordered)
+
+    def percentile(fraction):
+        return 1e6 * ordered[int(fraction * (len(ordered) - 1))] if ordered else None
+
+    return {'operation': name, 'calls': len(ordered), 'total_s': total,
+            'ops_per_s': len(ordered) / total if total > 0 else None,
+            'p50_us': percentile(0.50), 'p90_us': percentile(0.90), 'p99_us': percentile(0.99),
+            'max_us': 1e6 * ordered[-1] if ordered else None}
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def make_engine(name: str):
+    """
+    :param name: 'dict' or 'bitset'
+    :return: storage engine for CompatibilityDatabase
+    """
+    if name == 'bitset':
+        from BitsetEngine import BitsetEngine
+        return BitsetEngine()
+    return None
+
+
+def run(manufacturers: int, counts: dict, density: float, queries: int, builds: int, engine: str, seed: int,
+        workdir: str, undirected: bool = False) -> dict:
+    """
+    benchmarks one catalog size
+    :return: dict for the JSON report
+    """
+    rng = random.Random(seed)
+    inventory_file = os.path.join(workdir, 'inventory.pkl')
+    dependency_file = os.path.join(workdir, 'dependency.pkl')
+    database = CompatibilityDatabase(inventory_file, dependency_file, engine=make_engine(engine), undirected=undirected)
+
+    adds = []
+    components = CatalogGenerator.populate(database, manufacturers=manufacturers, counts=counts, density=density,
+                                           seed=seed, timings=adds)
+    results = [summarize('add_component', adds)]
+
+    timings = []
+    for _ in range(queries):
+        (first, second) = (rng.choice(components), rng.choice(components))
+        start = time.perf_counter()
+        database.compatibility(first, second)
+        timings.append(time.perf_counter() - start)
+    results.append(summarize('compatibility', timings))
+
+    by_type = {comp_type: [comp for comp in components if comp.comp_type == comp_type]
+               for comp_type in PRIMARY + (Component_Type.Extra,)}
+    timings = []
+    builder = Builder('benchmark', database)
+    for _ in range(builds):
+        build = {rng.choice(by_type[comp_type]) for comp_type in PRIMARY if by_type[comp_type]}
+        build.update(rng.sample(by_type[Component_Type.Extra], min(3, len(by_type[Component_Type.Extra]))))
+        builder.conflicts.clear()
+        start = time.perf_counter()
+        builder.check_conflict(build)
+        timings.append(time.perf_counter() - start)
+    results.append(summarize('check_conflict', timings))
+
+    start = time.perf_counter()
+    database.write_state_to_disk()
+    results.append(summarize('write_state_to_disk', [time.perf_counter() - start]))
+
+    reloaded = CompatibilityDatabase(inventory_file, dependency_file, engine=make_engine(engine), undirected=undirected)
+    # keeps init_from_file from starting the periodic writer
+    reloaded.initialized = True
+    start = time.perf_counter()
+    reloaded.init_from_file()
+    results.append(summarize('init_from_file', [time.perf_counter() - start]))
+
+    return {'manufacturers': manufacturers, 'components': len(components),
+            'edges': sum(len(row) for row in database.dependencies.values()),
+            'density': density, 'engine': engine, 'undirected': undirected, 'file_bytes': os.path.getsize(dependency_file),
+            'peak_rss_mb': peak_rss_mb(), 'operations': results}
+
+
+def git_commit() -> str:
+    """
+    :return: current git commit, None outside a checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CompatibilityDatabase and Builder hot paths')
+    parser.add_argument('--manufacturers', type=int, nargs='+', default=[10, 100],
+                        help='catalog sizes in manufacturers')
+    parser.add_argument('--counts', type=int, nargs=5, metavar=('BODY', 'ENGINE', 'BATTERY', 'WHEELS', 'EXTRA'),
+                        help='components of each type per manufacturer, default 10 10 10 10 20')
+    parser.add_argument('--density', type=float, default=0.01, help='fraction of the catalog each part fits')
+    parser.add_argument('--queries', type=int, default=100000, help='compatibility calls per size')
+    parser.add_argument('--builds', type=int, default=10000, help='check_conflict calls per size')
+    parser.add_argument('--engine', choices=['dict', 'bitset'], default='dict')
+    parser.add_argument('--undirected', action='store_true', help='store every edge once')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='-', help='JSON output file, - for stdout')
+    args = parser.parse_args()
+    counts = None
+    if args.counts is not None:
+        counts = dict(zip(PRIMARY + (Component_Type.Extra,), args.counts))
+
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'machine': platform.machine(),
+              'runs': []}
+    for manufacturers in args.manufacturers:
+        with tempfile.TemporaryDirectory() as workdir:
+            report['runs'].append(run(manufacturers, counts, args.density, args.queries, args.builds, args.engine,
+                                      args.seed, workdir, args.undirected))
+
+    output = json.dumps(report, indent=2)
+    if args.out == '-':
+        print(output)
+    else:
+        f_o = open(args.out, "w")
+        f_o.write(output)
+        f_o.close()
+
+
+if __name__ == '__main__':
+    main()
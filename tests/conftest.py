@@ -0,0 +1,13 @@
+import os
+import sys
+
+'''
+The modules live at the top of the repository, run the tests from there with
+
+    python -m pytest -q
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'Simulator')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
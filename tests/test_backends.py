@@ -0,0 +1,127 @@
+import itertools
+import random
+import pytest
+import CatalogGenerator
+from BitsetEngine import BitsetEngine
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+from SQLiteBackend import SQLiteBackend
+from ShardedDatabase import ShardedDatabase
+
+'''
+Every storage layout answers like the plain in-memory database it was filled like
+'''
+
+COUNTS = {Component_Type.Body: 4, Component_Type.Engine: 4, Component_Type.Battery: 3, Component_Type.Wheels: 3,
+          Component_Type.Extra: 4}
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+
+
+def populated(**kwargs) -> CompatibilityDatabase:
+    database = CompatibilityDatabase(None, None, **kwargs)
+    # symmetric edges, so that the undirected layouts hold the same catalog
+    CatalogGenerator.populate(database, manufacturers=2, counts=COUNTS, density=0.6, symmetric=True, seed=3)
+    return database
+
+
+def sqlite(tmp_path, undirected: bool) -> CompatibilityDatabase:
+    backend = SQLiteBackend(str(tmp_path / 'catalog.db'), undirected=undirected)
+    populated(undirected=undirected).write_backend(backend)
+    database = CompatibilityDatabase(None, None, undirected=undirected)
+    database.init_from_backend(backend)
+    return database
+
+
+def sharded(tmp_path) -> ShardedDatabase:
+    database = ShardedDatabase(None, shards=3)
+    database.import_database(populated())
+    return database
+
+
+def catalog(tmp_path) -> CompatibilityDatabase:
+    populated().write_catalog(str(tmp_path / 'catalog.cat'))
+    database = CompatibilityDatabase(None, None)
+    database.init_from_catalog(str(tmp_path / 'catalog.cat'), verify=True)
+    return database
+
+
+LAYOUTS = {
+    'bitset': lambda tmp_path: populated(engine=BitsetEngine()),
+    'compact': lambda tmp_path: populated(compact=True),
+    'compact_bitset': lambda tmp_path: populated(compact=True, engine=BitsetEngine()),
+    'undirected': lambda tmp_path: populated(undirected=True),
+    'undirected_bitset': lambda tmp_path: populated(undirected=True, engine=BitsetEngine()),
+    'sqlite': lambda tmp_path: sqlite(tmp_path, False),
+    'sqlite_undirected': lambda tmp_path: sqlite(tmp_path, True),
+    'sharded': sharded,
+    'catalog': catalog,
+}
+
+
+@pytest.fixture(params=sorted(LAYOUTS))
+def pair(request, tmp_path):
+    database = LAYOUTS[request.param](tmp_path)
+    yield populated(), database
+    backend = getattr(database, 'backend', None)
+    if backend is not None:
+        backend.close()
+
+
+def builds(reference, number: int, seed: int) -> list:
+    """
+    :return: random builds of one part per primary type and maybe an Extra
+    """
+    rng = random.Random(seed)
+    by_type = dict()
+    for component in reference.inventory:
+        by_type.setdefault(component.comp_type, []).append(component)
+    result = []
+    for _ in range(number):
+        build = {rng.choice(by_type[comp_type]) for comp_type in PRIMARY}
+        if rng.random() < 0.5:
+            build.add(rng.choice(by_type[Component_Type.Extra]))
+        result.append(build)
+    return result
+
+
+def conflicts(database, build: set) -> set:
+    builder = Builder('test', database)
+    builder.check_conflict(build)
+    return {frozenset(conflict) for conflict in builder.conflicts}
+
+
+def assert_same(reference, database):
+    components = list(reference.inventory)
+    assert set(database.inventory) == set(components)
+    for (first, second) in itertools.product(components, repeat=2):
+        assert database.compatibility(first, second) == reference.compatibility(first, second), (first, second)
+
+    for build in builds(reference, 30, seed=len(components)):
+        assert conflicts(database, build) == conflicts(reference, build)
+        assert Builder('test', database).build(build) == Builder('test', reference).build(build)
+
+    for part in components[::5]:
+        for selector in ({'comp_type': Component_Type.Engine}, {'manufacturer': 'Maker1'}, {}):
+            assert database.query(compatible_with=[part], **selector) == \
+                reference.query(compatible_with=[part], **selector)
+        assert Builder('test', database).count_builds([part]) == Builder('test', reference).count_builds([part])
+    assert database.query(comp_type=Component_Type.Body, structure=Structure.Sedan) == \
+        reference.query(comp_type=Component_Type.Body, structure=Structure.Sedan)
+    assert Builder('test', database).count_builds() == Builder('test', reference).count_builds()
+
+
+def test_same_answers(pair):
+    assert_same(*pair)
+
+
+def test_same_answers_after_changes(pair):
+    (reference, database) = pair
+    parts = list(reference.inventory)
+    for target in (reference, database):
+        radio = Extra('Test_radio', 'Radio', 'Maker0')
+        body = Body('Test_body', Structure.Sedan, 'Maker1')
+        target.bulk_add([(radio, parts[:10]), (body, [radio] + parts[10:20])])
+        target.update_compatibility(parts[0], parts[-1])
+        target.update_compatibility(parts[-1], parts[0])
+    assert_same(reference, database)
@@ -0,0 +1,89 @@
+import itertools
+import random
+import pytest
+import BitsetEngine as bitset_module
+from BitsetEngine import BitsetEngine
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+BitsetEngine answers like the dict of sets it was loaded from, before and after it grows
+'''
+
+pytestmark = pytest.mark.skipif(bitset_module.np is None, reason='numpy is not installed')
+
+
+def graph(size: int, density: float, seed: int) -> dict:
+    """
+    :return: random directed compatibility rows over IDs 0 to size - 1
+    """
+    rng = random.Random(seed)
+    return {comp_id: {other for other in range(size) if other != comp_id and rng.random() < density}
+            for comp_id in range(size)}
+
+
+def assert_same(engine: BitsetEngine, rows: dict):
+    ids = sorted(rows)
+    for (first, second) in itertools.product(ids, repeat=2):
+        assert engine.compatible(first, second) == (second in rows[first]), (first, second)
+    pairs = list(itertools.product(ids[:20], ids[-20:]))
+    assert list(engine.compatible_pairs([first for (first, _) in pairs], [second for (_, second) in pairs])) == \
+        [second in rows[first] for (first, second) in pairs]
+
+    rng = random.Random(len(ids))
+    for _ in range(30):
+        group = rng.sample(ids, 3)
+        assert engine.common_compatible(group) == set.intersection(*(rows[comp_id] for comp_id in group))
+        assert engine.compatible_with_all(group[0], group[1:]) == all(other in rows[group[0]] for other in group[1:])
+        block = engine.submatrix(group)
+        assert [[bool(value) for value in line] for line in block] == \
+            [[other in rows[comp_id] for other in group] for comp_id in group]
+
+
+def test_load():
+    rows = graph(150, 0.3, seed=1)
+    engine = BitsetEngine()
+    engine.load(rows)
+    assert_same(engine, rows)
+    assert engine.common_compatible([]) >= set(rows)
+
+
+def test_growth_and_edges():
+    rows = graph(40, 0.3, seed=2)
+    engine = BitsetEngine(capacity=8)
+    for (comp_id, compatible) in rows.items():
+        engine.add_component(comp_id, compatible)
+    assert_same(engine, rows)
+
+    # past the capacity of the first matrix, with single edges and batches
+    rng = random.Random(3)
+    for comp_id in range(40, 300):
+        rows[comp_id] = {other for other in range(comp_id) if rng.random() < 0.1}
+        engine.add_component(comp_id, rows[comp_id])
+    for _ in range(200):
+        (first, second) = rng.sample(range(300), 2)
+        engine.add_edge(first, second)
+        rows[first].add(second)
+    additions = {comp_id: set(rng.sample(range(300), 5)) - {comp_id} for comp_id in range(0, 300, 7)}
+    engine.add_edges(additions)
+    for (comp_id, compatible) in additions.items():
+        rows[comp_id] |= compatible
+    assert_same(engine, rows)
+
+
+def test_unknown_ids():
+    engine = BitsetEngine()
+    engine.load({0: {1}, 1: set()})
+    assert not engine.compatible(0, 5) and not engine.compatible(5, 0)
+    assert not engine.compatible_with_all(5, [0]) and not engine.compatible_with_all(0, [1, 5])
+
+
+def test_database_with_engine():
+    (plain, dense) = (CompatibilityDatabase(None, None), CompatibilityDatabase(None, None, engine=BitsetEngine()))
+    for database in (plain, dense):
+        database.default_init()
+        radio = Extra('Engine_radio', 'Radio', 'Bitset')
+        database.add_component(radio, {0, 2, 4})
+        database.update_compatibility(database.id_chart[1], radio)
+    for (first, second) in itertools.product(list(plain.inventory), repeat=2):
+        assert dense.compatibility(first, second) == plain.compatibility(first, second)
@@ -0,0 +1,130 @@
+import random
+import CatalogGenerator
+from BuildCache import BuildCache
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+BuildCache: a cached result is only served while everything it was computed from is unchanged
+'''
+
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+
+
+def populated() -> CompatibilityDatabase:
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=4, density=0.4, seed=3)
+    return database
+
+
+def builds(database, number: int, seed: int) -> list:
+    rng = random.Random(seed)
+    by_type = dict()
+    for component in database.inventory:
+        by_type.setdefault(component.comp_type, []).append(component)
+    return [{rng.choice(by_type[comp_type]) for comp_type in PRIMARY} for _ in range(number)]
+
+
+def same(cached: Builder, database, build: set) -> bool:
+    """
+    :return: True if the cached builder answers like a fresh one
+    """
+    fresh = Builder('fresh', database)
+    return cached.build(build) == fresh.build(build) and set(cached.conflicts) == set(fresh.conflicts) \
+        and cached.suggestions == fresh.suggestions and cached.repairs == fresh.repairs
+
+
+def test_hits_answer_like_fresh_builds():
+    database = populated()
+    cache = BuildCache(database)
+    builder = Builder('test', database, cache)
+    requests = builds(database, 40, seed=1)
+    for _ in range(3):
+        assert all(same(builder, database, build) for build in requests)
+        assert [(ok, set(conflicts), suggestions) for (ok, conflicts, suggestions) in builder.build_batch(requests)] \
+            == [(ok, set(conflicts), suggestions) for (ok, conflicts, suggestions)
+                in Builder('fresh', database).build_batch(requests)]
+    assert cache.hits > 0 and cache.invalidations == 0
+
+
+def test_changes_invalidate():
+    database = populated()
+    cache = BuildCache(database)
+    builder = Builder('test', database, cache)
+    build = next(build for build in builds(database, 100, seed=2)
+                 if not builder.build(build) and builder.repairs and builder._cacheable(False, build, builder.repairs))
+    assert builder.build(build) is False and cache.hits == 1
+
+    # a new edge on a part of the build
+    (first, second) = builder.conflicts[0]
+    database.update_compatibility(first, second)
+    assert same(builder, database, build)
+    assert cache.invalidations == 1
+
+    # a new edge on a suggested replacement changes how alike its row is to the part it replaces
+    replacement = next(iter(builder.suggestions.values()))[0]
+    other = next(comp for comp in database.inventory
+                 if comp not in build and not database.compatibility(replacement, comp))
+    database.update_compatibility(replacement, other)
+    assert same(builder, database, build)
+    assert cache.invalidations == 2
+
+    # a new generation
+    database.add_rule({'comp_type': Component_Type.Wheels}, {'comp_type': Component_Type.Body})
+    assert same(builder, database, build)
+    assert cache.invalidations == 3
+
+
+def test_unrelated_change_keeps_entry():
+    database = populated()
+    cache = BuildCache(database)
+    builder = Builder('test', database, cache)
+    build = next(build for build in builds(database, 100, seed=2) if builder.build(build))
+    radio = Extra('Cache_radio', 'Radio', 'Cache')
+    database.add_component(radio, {database.cid(comp) for comp in database.inventory if comp not in build})
+    assert builder.build(build) is True
+    assert cache.hits == 1 and cache.invalidations == 0
+
+
+def test_multi_swap_not_cached():
+    body = Body('Body', Structure.Sedan, 'Z')
+    engine = Engine('Engine', Engine_Mechanism.Gas, 'Z')
+    battery = Battery('Battery', 'Z')
+    (wide, alone) = (Engine('Wide', Engine_Mechanism.Gas, 'Z'), Engine('Alone', Engine_Mechanism.Gas, 'Z'))
+    (usual, rare) = (Battery('Usual', 'Z'), Battery('Rare', 'Z'))
+    database = CompatibilityDatabase(None, None)
+    database.bulk_add([(body, []), (engine, [battery]), (battery, []), (usual, [body]), (rare, [body]),
+                       (wide, [body, usual]), (alone, [body])], symmetric=True)
+    cache = BuildCache(database)
+    builder = Builder('test', database, cache)
+
+    assert builder.build({body, engine, battery}) is False
+    assert builder.repairs == [frozenset({engine, battery})]
+    assert builder.suggestions == {engine: [wide], battery: [usual]}
+    assert cache.stats()['entries'] == 0
+
+    # neither end of the new edge is in the build or was suggested
+    database.update_compatibility(alone, rare)
+    database.update_compatibility(rare, alone)
+    assert same(builder, database, {body, engine, battery})
+    assert {part: set(replacements) for (part, replacements) in builder.suggestions.items()} == \
+        {engine: {wide, alone}, battery: {usual, rare}}
+
+
+def test_change_during_build_not_stored():
+    database = populated()
+    cache = BuildCache(database)
+    builder = Builder('test', database, cache)
+    build = next(build for build in builds(database, 100, seed=2)
+                 if not builder.build(build) and builder._cacheable(False, build, builder.repairs))
+    cache.clear()
+    key = cache.key(build)
+    stamp = cache.stamp(key)
+    result = (False, tuple(builder.conflicts),
+              {part: tuple(replacements) for (part, replacements) in builder.suggestions.items()}, builder.repairs)
+    database.add_component(Extra('Late_radio', 'Radio', 'Cache'), set())
+    cache.put(key, stamp, result)
+    assert cache.stats()['entries'] == 0
+    cache.put(key, cache.stamp(key), result)
+    assert cache.get(key, cache.stamp(key)) == result
@@ -0,0 +1,62 @@
+import random
+import pytest
+import CatalogGenerator
+from BatchReplay import BatchReplay
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+from SQLiteBackend import SQLiteBackend
+
+'''
+Builder.build_many: every pool answers like Builder.build, and refuses databases it can not hand to processes
+'''
+
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+
+
+def populated() -> CompatibilityDatabase:
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.5, seed=6)
+    return database
+
+
+def builds(database, number: int) -> list:
+    rng = random.Random(6)
+    by_type = dict()
+    for component in database.inventory:
+        by_type.setdefault(component.comp_type, []).append(component)
+    return [{rng.choice(by_type[comp_type]) for comp_type in PRIMARY} for _ in range(number)]
+
+
+def backed(tmp_path) -> CompatibilityDatabase:
+    backend = SQLiteBackend(str(tmp_path / 'catalog.db'))
+    populated().write_backend(backend)
+    database = CompatibilityDatabase(None, None)
+    database.init_from_backend(backend)
+    return database
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process', 'shared'])
+def test_same_answers(mode):
+    database = populated()
+    requests = builds(database, 30)
+    expected = []
+    for build in requests:
+        builder = Builder('test', database)
+        ok = builder.build(build)
+        expected.append((ok, set(builder.conflicts), builder.suggestions))
+    results = Builder('test', database).build_many(requests, workers=2, mode=mode)
+    assert [(ok, set(conflicts), suggestions) for (_, ok, conflicts, suggestions) in results] == expected
+
+
+@pytest.mark.parametrize('mode', ['process', 'shared'])
+def test_backend_refused(tmp_path, mode):
+    database = backed(tmp_path)
+    requests = builds(database, 4)
+    with pytest.raises(ValueError, match='in-memory database'):
+        list(Builder('test', database).build_many(requests, workers=2, mode=mode))
+    with pytest.raises(ValueError, match='in-memory database'):
+        BatchReplay(database, workers=2, mode=mode)
+    # threads share the backend
+    assert len(list(Builder('test', database).build_many(requests, workers=2, mode='thread'))) == 4
+    database.backend.close()
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import random
+import CatalogGenerator
+from BuildServer import BuildServer
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+BuildServer: answers in request order on a connection, stats included
+'''
+
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+
+
+def builds(database, number: int) -> list:
+    rng = random.Random(7)
+    by_type = dict()
+    for component in database.inventory:
+        by_type.setdefault(component.comp_type, []).append(component)
+    return [{rng.choice(by_type[comp_type]) for comp_type in PRIMARY} for _ in range(number)]
+
+
+def exchange(database, lines: list) -> list:
+    """
+    sends the request lines on one connection without waiting for answers
+    :return: the response dicts, one per line
+    """
+    async def run():
+        server = BuildServer(database, batch_window=0.01)
+        listener = await server.start_tcp('127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8'))
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in lines]
+        writer.close()
+        await server.close()
+        return responses
+
+    return asyncio.run(run())
+
+
+def test_answers_in_order():
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.5, seed=7)
+    requests = builds(database, 50)
+    lines = [{'op': 'stats', 'id': 'first'}]
+    lines += [{'id': number, 'components': [comp.to_dict() for comp in build]}
+              for (number, build) in enumerate(requests)]
+    lines += [{'op': 'stats', 'id': 'last'}]
+    responses = exchange(database, lines)
+
+    assert [response['id'] for response in responses] == ['first'] + list(range(len(requests))) + ['last']
+    for (build, response) in zip(requests, responses[1:]):
+        assert response['ok'] == Builder('test', database).build(build)
+    # each report covers the requests before it, and only those
+    assert responses[0]['stats']['served'] == 0
+    assert responses[-1]['stats']['served'] == len(requests) + 1
+    cache = responses[-1]['stats']['cache']
+    assert cache['hits'] + cache['misses'] == len(requests)
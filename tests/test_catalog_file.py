@@ -0,0 +1,83 @@
+import itertools
+import pytest
+import CatalogGenerator
+from CatalogFile import MappedCatalog, HEADER
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+Catalog files: a mapped catalog answers like the database it was written from
+'''
+
+
+@pytest.fixture(params=[False, True], ids=['directed', 'undirected'])
+def source(request):
+    database = CompatibilityDatabase(None, None, undirected=request.param)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.2, symmetric=False, seed=1)
+    return database
+
+
+def mapped(filename, **kwargs) -> CompatibilityDatabase:
+    database = CompatibilityDatabase(None, None)
+    database.init_from_catalog(str(filename), **kwargs)
+    return database
+
+
+def test_round_trip(tmp_path, source):
+    source.write_catalog(str(tmp_path / 'catalog.cat'))
+    database = mapped(tmp_path / 'catalog.cat', verify=True)
+
+    assert len(database.inventory) == len(source.inventory)
+    for component in source.inventory:
+        assert source.uuid(component) == database.uuid(component)
+        assert database.component_from_uuid(source.uuid(component)) == component
+    for (first, second) in itertools.product(list(source.inventory), repeat=2):
+        assert database.compatibility(first, second) == source.compatibility(first, second)
+    database.catalog.close()
+
+
+def test_change_materializes(tmp_path, source):
+    source.write_catalog(str(tmp_path / 'catalog.cat'))
+    database = mapped(tmp_path / 'catalog.cat')
+    radio = Extra('Mapped_radio', 'Radio', 'Mapped')
+    parts = list(source.inventory)[:3]
+    database.add_component(radio, {database.cid(part) for part in parts})
+
+    assert database.catalog is None
+    assert len(database.inventory) == len(source.inventory) + 1
+    assert all(database.compatibility(radio, part) for part in parts)
+    for (first, second) in itertools.product(list(source.inventory), repeat=2):
+        assert database.compatibility(first, second) == source.compatibility(first, second)
+
+
+def test_checksum_mismatch(tmp_path, source):
+    filename = tmp_path / 'catalog.cat'
+    source.write_catalog(str(filename))
+    data = bytearray(filename.read_bytes())
+    data[HEADER.size + 10] ^= 0xff
+    filename.write_bytes(bytes(data))
+
+    # only checked when asked for, the header is intact
+    MappedCatalog(str(filename)).close()
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        MappedCatalog(str(filename), verify=True)
+
+
+def test_not_a_catalog(tmp_path, source):
+    filename = tmp_path / 'catalog.cat'
+    filename.write_bytes(b'not a catalog')
+    with pytest.raises(ValueError, match='not a catalog file'):
+        MappedCatalog(str(filename))
+
+    source.write_catalog(str(filename))
+    data = bytearray(filename.read_bytes())
+    data[20] ^= 0xff
+    filename.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match='Corrupt catalog header'):
+        MappedCatalog(str(filename))
+
+
+def test_rules_are_refused(tmp_path, source):
+    source.add_rule({'comp_type': Component_Type.Wheels}, {'comp_type': Component_Type.Body})
+    with pytest.raises(ValueError):
+        source.write_catalog(str(tmp_path / 'catalog.cat'))
@@ -0,0 +1,52 @@
+import random
+import pytest
+import BitsetEngine as bitset_module
+import CatalogGenerator
+from BitsetEngine import BitsetEngine
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+Builder.check_conflict: the one-gather check over the engine finds the pairs the pairwise check finds
+'''
+
+pytestmark = pytest.mark.skipif(bitset_module.np is None, reason='numpy is not installed')
+
+
+def populated(undirected: bool, rules: bool) -> CompatibilityDatabase:
+    database = CompatibilityDatabase(None, None, engine=BitsetEngine(), undirected=undirected)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.5, symmetric=undirected, seed=8)
+    if rules:
+        database.add_rule({'comp_type': Component_Type.Extra}, {'manufacturer': 'Maker0'})
+        (first, second) = (database.id_chart[0], database.id_chart[1])
+        database.update_compatibility(first, second)
+        database.exclude_compatibility(first, second)
+    return database
+
+
+@pytest.mark.parametrize('undirected', [False, True], ids=['directed', 'undirected'])
+@pytest.mark.parametrize('rules', [False, True], ids=['edges', 'rules'])
+def test_same_conflicts(undirected, rules):
+    database = populated(undirected, rules)
+    components = sorted(database.inventory, key=database.cid)
+    rng = random.Random(8)
+    for size in range(1, 9):
+        for _ in range(20):
+            build = set(rng.sample(components, size))
+            (vectorized, pairwise) = (Builder('test', database), Builder('test', database))
+            vectorized.check_conflict(build)
+            pairwise.check_conflict_pairwise(build)
+            if undirected:
+                # every unordered pair once, in either orientation
+                found = [frozenset(pair) for pair in vectorized.conflicts]
+                assert len(found) == len(set(found))
+                assert set(found) == {frozenset(pair) for pair in pairwise.conflicts}
+                expected = {frozenset((first, second)) for first in build for second in build
+                            if first != second and not database.compatibility(first, second)}
+                assert set(found) == expected
+            else:
+                assert sorted(vectorized.conflicts, key=lambda pair: (database.cid(pair[0]), database.cid(pair[1]))) \
+                    == sorted(pairwise.conflicts, key=lambda pair: (database.cid(pair[0]), database.cid(pair[1])))
+                assert set(vectorized.conflicts) == {(first, second) for first in build for second in build
+                                                     if first != second and not database.compatibility(first, second)}
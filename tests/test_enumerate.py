@@ -0,0 +1,71 @@
+import itertools
+import pytest
+import CatalogGenerator
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+Builder.enumerate_builds and count_builds find exactly the conflict-free builds a brute force finds
+'''
+
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+COUNTS = {Component_Type.Body: 4, Component_Type.Engine: 4, Component_Type.Battery: 3, Component_Type.Wheels: 3,
+          Component_Type.Extra: 3}
+
+
+@pytest.fixture(params=[False, True], ids=['directed', 'undirected'])
+def database(request):
+    database = CompatibilityDatabase(None, None, undirected=request.param)
+    CatalogGenerator.populate(database, manufacturers=2, counts=COUNTS, density=0.7, symmetric=request.param, seed=9)
+    return database
+
+
+def brute_force(database, fixed=(), extras=()) -> set:
+    by_type = {comp_type: [comp for comp in database.inventory if comp.comp_type == comp_type] for comp_type in PRIMARY}
+    for part in fixed:
+        if part.comp_type in by_type:
+            by_type[part.comp_type] = [part]
+    result = set()
+    for build in itertools.product(*by_type.values()):
+        build = set(build) | set(fixed) | set(extras)
+        checker = Builder('check', database)
+        checker.check_conflict(build)
+        if len(checker.conflicts) == 0:
+            result.add(frozenset(build))
+    return result
+
+
+def test_all_builds(database):
+    builder = Builder('test', database)
+    expected = brute_force(database)
+    assert len(expected) > 3
+    found = [frozenset(build) for build in builder.enumerate_builds()]
+    assert len(found) == len(set(found))
+    assert set(found) == expected
+    assert builder.count_builds() == len(expected)
+    assert len(list(builder.enumerate_builds(limit=3))) == min(3, len(expected))
+    assert builder.count_builds(limit=3) == min(3, len(expected))
+
+
+def test_fixed_parts_and_extras(database):
+    builder = Builder('test', database)
+    extras = [comp for comp in database.inventory if comp.comp_type == Component_Type.Extra]
+    bodies = [comp for comp in database.inventory if comp.comp_type == Component_Type.Body]
+    for body in bodies[::2]:
+        for extra in extras[::2]:
+            expected = brute_force(database, fixed=[body], extras=[extra])
+            assert {frozenset(build) for build in builder.enumerate_builds([body], extras=[extra])} == expected
+            assert builder.count_builds([body], extras=[extra]) == len(expected)
+
+
+def test_nothing_to_build(database):
+    builder = Builder('test', database)
+    bodies = [comp for comp in database.inventory if comp.comp_type == Component_Type.Body]
+    # two parts of one type
+    assert builder.count_builds(bodies[:2]) == 0
+    assert list(builder.enumerate_builds(bodies[:2])) == []
+    # fixed parts that conflict
+    pair = next((first, second) for (first, second) in itertools.permutations(database.inventory, 2)
+                if first.comp_type != second.comp_type and not database.compatibility(first, second))
+    assert builder.count_builds(pair) == 0
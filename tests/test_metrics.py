@@ -0,0 +1,47 @@
+from CompatibilityDatabase import CompatibilityDatabase
+from Metrics import Metrics, metrics, IDLE_TIMER
+from ShardedDatabase import ShardedDatabase
+
+'''
+Metrics registry: gauges per instance, closed sources and broken gauges
+'''
+
+
+def test_gauge_per_instance():
+    registry = Metrics()
+    assert registry.gauge('database', lambda: 1) == 'database'
+    assert registry.gauge('database', lambda: 2) == 'database.2'
+    assert registry.snapshot()['gauges'] == {'database': 1, 'database.2': 2}
+
+
+def test_broken_gauge_is_skipped():
+    registry = Metrics()
+    registry.gauge('broken', lambda: {}['missing'])
+    registry.gauge('fine', lambda: 3)
+    assert registry.snapshot()['gauges'] == {'fine': 3}
+
+
+def test_idle_timer():
+    registry = Metrics()
+    assert registry.timer('a') is IDLE_TIMER
+    registry.enable()
+    with registry.timer('a'):
+        pass
+    assert registry.histograms['a'].count == 1
+
+
+def test_closed_database_drops_its_gauge():
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    name = database.gauge
+    assert name in metrics.snapshot()['gauges']
+    database.close()
+    assert name not in metrics.gauges
+    metrics.snapshot()
+
+    sharded = ShardedDatabase(None, shards=2)
+    name = sharded.gauge
+    assert all(shard.gauge is None for shard in sharded.shards)
+    assert metrics.snapshot()['gauges'][name]['components'] == 0
+    sharded.close()
+    assert name not in metrics.gauges
@@ -0,0 +1,68 @@
+import random
+import pytest
+import CatalogGenerator
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+CompatibilityDatabase.query: the secondary indexes select what a scan of the inventory selects
+'''
+
+FIELDS = ('comp_type', 'manufacturer', 'structure', 'mechanism', 'diameter', 'use')
+
+
+def scan(database, compatible_with=None, **selector) -> set:
+    result = set()
+    for comp in database.inventory:
+        if any(getattr(comp, field, None) != value for (field, value) in selector.items() if value is not None):
+            continue
+        if compatible_with is not None and not all(
+                database.compatibility(comp, part) and database.compatibility(part, comp) for part in compatible_with):
+            continue
+        result.add(comp)
+    return result
+
+
+def selectors(database) -> list:
+    """
+    :return: every single field selector over the values in the inventory, and a few combinations
+    """
+    values = {field: {getattr(comp, field) for comp in database.inventory if hasattr(comp, field)}
+              for field in FIELDS}
+    result = [{field: value} for field in FIELDS for value in values[field]]
+    result += [{'comp_type': comp_type, 'manufacturer': manufacturer}
+               for comp_type in values['comp_type'] for manufacturer in values['manufacturer']]
+    result += [{'comp_type': Component_Type.Engine, 'structure': structure} for structure in values['structure']]
+    return result
+
+
+@pytest.mark.parametrize('rules', [False, True], ids=['edges', 'rules'])
+def test_same_as_scan(rules):
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.5, seed=10)
+    if rules:
+        database.add_rule({'comp_type': Component_Type.Extra}, {'manufacturer': 'Maker1'})
+    parts = sorted(database.inventory, key=database.cid)
+    rng = random.Random(10)
+
+    assert database.query() == set(database.inventory)
+    for selector in selectors(database):
+        assert database.query(**selector) == scan(database, **selector), selector
+        fixed = rng.sample(parts, 2)
+        assert database.query(compatible_with=fixed, **selector) == scan(database, compatible_with=fixed, **selector)
+    assert database.query(compatible_with=[]) == set(database.inventory)
+
+
+def test_index_follows_changes():
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    before = database.query(comp_type=Component_Type.Extra, use='Radio')
+    radio = Extra('Query_radio', 'Radio', 'Query')
+    database.add_component(radio, {0, 1})
+    body = Body('Query_body', Structure.Van, 'Query')
+    database.bulk_add([(body, [radio])], symmetric=True)
+
+    assert database.query(comp_type=Component_Type.Extra, use='Radio') == before | {radio}
+    assert database.query(manufacturer='Query') == {radio, body}
+    assert database.query(manufacturer='Query', compatible_with=[body]) == {radio}
+    assert database.query(manufacturer='Nobody') == set()
@@ -0,0 +1,117 @@
+import random
+import pytest
+import CatalogGenerator
+from BuildRegistry import BuildRegistry
+from Builder import Builder
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+BuildRegistry: verdicts follow the catalog, only affected builds are checked and every flip is an event
+'''
+
+PRIMARY = (Component_Type.Body, Component_Type.Engine, Component_Type.Battery, Component_Type.Wheels)
+
+
+@pytest.fixture(params=[False, True], ids=['directed', 'undirected'])
+def database(request):
+    database = CompatibilityDatabase(None, None, undirected=request.param)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.6, symmetric=request.param, seed=12)
+    return database
+
+
+def builds(database, number: int) -> list:
+    rng = random.Random(12)
+    by_type = dict()
+    for component in database.inventory:
+        by_type.setdefault(component.comp_type, []).append(component)
+    return [{rng.choice(by_type[comp_type]) for comp_type in PRIMARY} for _ in range(number)]
+
+
+def assert_verdicts(registry, database):
+    for build_id in registry.builds:
+        assert registry.verdicts[build_id] == Builder('test', database).build(registry.components(build_id))
+
+
+def test_register(database):
+    registry = BuildRegistry(database)
+    requests = builds(database, 40)
+    ids = [registry.register(build) for build in requests]
+    assert registry.register(requests[0]) == ids[0]
+    assert len(registry) == len({frozenset(build) for build in requests})
+    assert_verdicts(registry, database)
+    extra = next(comp for comp in database.inventory if comp.comp_type == Component_Type.Extra)
+    with pytest.raises(KeyError):
+        registry.register({extra}, build_id=ids[0])
+    registry.remove(ids[0])
+    assert ids[0] not in registry.builds
+    assert all(ids[0] not in saved for saved in registry.by_component.values())
+    registry.close()
+
+
+def test_events(database):
+    registry = BuildRegistry(database)
+    feed = registry.subscribe()
+    failing = next(build for build in builds(database, 100) if not Builder('test', database).build(build))
+    build_id = registry.register(failing)
+    checker = Builder('test', database)
+    checker.check_conflict(failing)
+
+    # fixing every conflict of the build flips it
+    for (first, second) in checker.conflicts:
+        database.update_compatibility(first, second)
+        database.update_compatibility(second, first)
+    assert registry.revalidate() == 1
+    assert registry.verdicts[build_id] is True
+    event = feed.get_nowait()
+    assert event == {'seq': 1, 'build': build_id, 'ok': True, 'conflicts': []}
+
+    # an exclusion breaks it again, the event names the pair
+    (first, second) = checker.conflicts[0]
+    database.exclude_compatibility(first, second)
+    registry.revalidate()
+    event = feed.get_nowait()
+    assert event['seq'] == 2 and event['ok'] is False
+    assert [first.name, second.name] in event['conflicts'] or [second.name, first.name] in event['conflicts']
+    assert registry.changes() == [{'seq': 1, 'build': build_id, 'ok': True, 'conflicts': []}, event]
+    assert registry.changes(since=1) == [event]
+
+    # a change to a component of no registered build checks nothing
+    outsider = next(comp for comp in database.inventory if comp not in failing)
+    database.add_component(Extra('Registry_radio', 'Radio', 'Registry'), {database.cid(outsider)})
+    assert registry.revalidate() == 0
+    assert feed.empty()
+    registry.close()
+
+
+def test_only_affected_builds(database):
+    registry = BuildRegistry(database)
+    for build in builds(database, 60):
+        registry.register(build)
+    part = next(iter(registry.by_component))
+    other = next(comp for comp in database.inventory if database.cid(comp) != part)
+    database.update_compatibility(database.component_from_id(part), other)
+    expected = registry.by_component[part] | registry.by_component.get(database.cid(other), set())
+    assert registry.revalidate() == len(expected)
+    assert_verdicts(registry, database)
+
+    # a new generation checks every build
+    database.add_rule({'comp_type': Component_Type.Wheels}, {'comp_type': Component_Type.Body})
+    assert registry.revalidate() == len(registry)
+    assert_verdicts(registry, database)
+    registry.close()
+
+
+def test_save_and_close(database, tmp_path):
+    registry = BuildRegistry(database)
+    for build in builds(database, 20):
+        registry.register(build)
+    registry.save(str(tmp_path / 'registry.json'))
+    registry.close()
+    assert registry._listener not in database.listeners
+
+    loaded = BuildRegistry(database)
+    loaded.load(str(tmp_path / 'registry.json'))
+    assert loaded.builds == registry.builds and loaded.verdicts == registry.verdicts
+    loaded.close()
+    assert database.listeners == []
@@ -0,0 +1,58 @@
+import io
+import json
+import random
+from BatchReplay import BatchReplay
+from BuildCache import BuildCache
+from CompatibilityDatabase import CompatibilityDatabase
+
+'''
+BatchReplay: one request file gives the same result lines in every mode
+'''
+
+def requests(number: int, seed: int) -> list:
+    """
+    :return: request lines over the example catalog, builds with an add or update operation now and then
+    """
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    components = [comp.to_dict() for comp in database.id_chart]
+    by_type = dict()
+    for component in components:
+        by_type.setdefault(component['comp_type'], []).append(component)
+    rng = random.Random(seed)
+    lines = []
+    for i in range(number):
+        if i % 20 == 10:
+            new = dict(rng.choice(components))
+            new['name'] = 'Replay_%d' % i
+            compatible = [comp for comp in components if rng.random() < 0.7]
+            lines.append({'op': 'add', 'component': new, 'compatible': compatible, 'symmetric': rng.random() < 0.5})
+            components.append(new)
+            by_type[new['comp_type']].append(new)
+        if i % 15 == 7:
+            (first, second) = rng.sample(components, 2)
+            lines.append({'op': 'update', 'component': first, 'compatible': second})
+        lines.append({'id': 'b%d' % i, 'components': [rng.choice(parts) for parts in by_type.values()]})
+    return [json.dumps(line) + '\n' for line in lines]
+
+
+def replay(lines: list, workers: int, mode: str = 'thread', cache: bool = False) -> str:
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    output = io.StringIO()
+    BatchReplay(database, workers=workers, mode=mode, batch_size=16,
+                cache=BuildCache(database, 1000) if cache else None).run(lines, output)
+    database.close()
+    return output.getvalue()
+
+
+def test_same_output_in_every_mode():
+    lines = requests(400, seed=1)
+    expected = replay(lines, workers=1)
+    assert expected.count('\n') == len(lines)
+    assert '"suggestions": [{' in expected
+    # byte for byte, conflicts and suggestions come in the same order from every worker
+    assert replay(lines, workers=2) == expected
+    assert replay(lines, workers=2, cache=True) == expected
+    assert replay(lines, workers=2, mode='process') == expected
+    assert replay(lines, workers=2, mode='shared') == expected
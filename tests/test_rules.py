@@ -0,0 +1,87 @@
+import itertools
+import random
+import pytest
+import CatalogGenerator
+from CompatibilityDatabase import CompatibilityDatabase
+from ComponentIndex import index_value
+from Components import *
+
+'''
+Compiled rules answer like checking every rule's selectors on every pair, exclusions win over everything
+'''
+
+
+def selects(fields: dict, component) -> bool:
+    return all(hasattr(component, field) and index_value(getattr(component, field)) == index_value(value)
+               for (field, value) in fields.items())
+
+
+class Reference:
+    """
+    the rules and exclusions as written down, checked pair by pair
+    """
+
+    def __init__(self, database, undirected: bool):
+        self.edges = {(first, second) for (first, second) in itertools.product(list(database.inventory), repeat=2)
+                      if database.compatibility(first, second)}
+        self.undirected = undirected
+        self.rules = []
+        self.excluded = set()
+
+    def add_rule(self, source: dict, target: dict, symmetric: bool):
+        self.rules.append((source, target))
+        if symmetric or self.undirected:
+            self.rules.append((target, source))
+
+    def compatible(self, first, second) -> bool:
+        if (first, second) in self.excluded or (self.undirected and (second, first) in self.excluded):
+            return False
+        return (first, second) in self.edges or any(selects(source, first) and selects(target, second)
+                                                    for (source, target) in self.rules)
+
+
+RULES = [
+    ({'comp_type': Component_Type.Wheels, 'diameter': Diameter.Eighteen}, {'comp_type': Component_Type.Body}, True),
+    ({'comp_type': Component_Type.Extra}, {'manufacturer': 'Maker0'}, False),
+    # the value of an enum member selects like the member
+    ({'comp_type': '2', 'mechanism': Engine_Mechanism.Electric}, {'comp_type': Component_Type.Battery}, False),
+    ({'manufacturer': 'Maker2'}, {'manufacturer': 'Maker1', 'comp_type': Component_Type.Engine}, True),
+]
+
+
+@pytest.mark.parametrize('undirected', [False, True], ids=['directed', 'undirected'])
+def test_rules_and_exclusions(undirected):
+    database = CompatibilityDatabase(None, None, undirected=undirected)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.2, symmetric=undirected, seed=11)
+    reference = Reference(database, undirected)
+    for (source, target, symmetric) in RULES:
+        database.add_rule(source, target, symmetric=symmetric)
+        reference.add_rule(source, target, symmetric)
+
+    # components added after the rules were compiled
+    for (number, component) in enumerate([Wheels('Rule_wheels', Diameter.Eighteen, 'Maker2'),
+                                          Extra('Rule_radio', 'Radio', 'Maker0')]):
+        database.add_component(component, {number})
+        reference.edges.add((component, database.id_chart[number]))
+        if undirected:
+            reference.edges.add((database.id_chart[number], component))
+
+    rng = random.Random(11)
+    components = sorted(database.inventory, key=database.cid)
+    matched = [(first, second) for (first, second) in itertools.permutations(components, 2)
+               if reference.compatible(first, second) and (first, second) not in reference.edges]
+    assert len(matched) > 0
+    edges = sorted(reference.edges, key=lambda pair: (database.cid(pair[0]), database.cid(pair[1])))
+    for (first, second) in rng.sample(matched, 10) + rng.sample(edges, 5):
+        database.exclude_compatibility(first, second)
+        reference.excluded.add((first, second))
+
+    for (first, second) in itertools.product(components, repeat=2):
+        assert database.compatibility(first, second) == reference.compatible(first, second), (first, second)
+
+
+def test_unknown_field():
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    with pytest.raises(KeyError):
+        database.add_rule({'colour': 'red'}, {'comp_type': Component_Type.Body})
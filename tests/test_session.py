@@ -0,0 +1,68 @@
+import random
+import pytest
+import CatalogGenerator
+from Builder import Builder, repeated_types
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+A BuildSession kept up to date part by part answers like Builder.build on the whole set
+'''
+
+
+@pytest.fixture
+def database():
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=2, density=0.6, seed=5)
+    return database
+
+
+def assert_agrees(database, session):
+    builder = Builder('test', database)
+    parts = session.components
+    if repeated_types(parts):
+        assert session.violations()
+        assert session.ok() is False
+        with pytest.raises(ValueError, match='More than one component of type'):
+            builder.build(parts)
+        return
+    assert session.ok() == builder.build(parts)
+    assert set(session.conflicts()) == set(builder.conflicts)
+
+
+def test_same_type_twice():
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    tesla_x = database.query(comp_type=Component_Type.Body, manufacturer='Tesla').pop()
+    second = Body('Tesla_Y', Structure.Sedan, 'Tesla')
+    database.add_component(second, database.dependencies[database.cid(tesla_x)])
+    for other in database.row(database.cid(tesla_x)):
+        database.update_compatibility(database.id_chart[other], second)
+    database.update_compatibility(tesla_x, second)
+    database.update_compatibility(second, tesla_x)
+
+    session = Builder('test', database).session()
+    session.add(tesla_x)
+    session.add(second)
+    assert session.conflicts() == []
+    assert session.violations() == {Component_Type.Body: {tesla_x, second}}
+    assert_agrees(database, session)
+    session.remove(second)
+    assert session.ok() is True
+    assert_agrees(database, session)
+
+
+def test_random_edits(database):
+    rng = random.Random(0)
+    components = list(database.inventory)
+    session = Builder('test', database).session()
+    for _ in range(300):
+        if len(session) < 6 and (rng.random() < 0.6 or not len(session)):
+            session.add(rng.choice(components))
+        else:
+            session.remove(rng.choice(sorted(session.components, key=database.cid)))
+        if rng.random() < 0.1:
+            database.update_compatibility(rng.choice(components), rng.choice(components))
+        if rng.random() < 0.05:
+            database.exclude_compatibility(rng.choice(components), rng.choice(components))
+        assert_agrees(database, session)
@@ -0,0 +1,93 @@
+import itertools
+import pytest
+import CatalogGenerator
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+from ShardedDatabase import ShardedDatabase, shard_of
+
+'''
+ShardedDatabase: parts live in their manufacturer's shard, IDs route without a table, the layout is fixed
+'''
+
+
+def source() -> CompatibilityDatabase:
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=5, density=0.4, seed=13)
+    return database
+
+
+def test_routing():
+    database = ShardedDatabase(None, shards=3, placement={'Maker0': 2, 'Maker1': 2})
+    database.import_database(source())
+    seen = set()
+    for component in database.inventory:
+        number = database.shard_number(component)
+        assert number == shard_of(component.manufacturer, 3, {'Maker0': 2, 'Maker1': 2})
+        assert component in database.shards[number].inventory
+        assert sum(component in shard.inventory for shard in database.shards) == 1
+        comp_id = database.cid(component)
+        assert database.split_id(comp_id) == (number, database.shards[number].inventory[component])
+        assert database.global_id(*database.split_id(comp_id)) == comp_id
+        assert database.component_from_id(comp_id) == component
+        assert database.component_from_uuid(database.uuid(component)) == component
+        seen.add(comp_id)
+    assert len(seen) == len(database.inventory)
+    assert {component.manufacturer for component in database.shards[2].inventory} >= {'Maker0', 'Maker1'}
+
+
+def test_edges_live_with_their_first_part():
+    database = ShardedDatabase(None, shards=2, placement={'Left': 0, 'Right': 1})
+    (left, right) = (Body('Left_body', Structure.Sedan, 'Left'), Engine('Right_engine', Engine_Mechanism.Gas, 'Right'))
+    database.add_component(left, set())
+    database.add_component(right, set())
+    database.update_compatibility(left, right)
+
+    assert database.compatibility(left, right) and not database.compatibility(right, left)
+    (number, local) = database.split_id(database.cid(left))
+    assert number == 0
+    assert database.shards[0].dependencies[local] == {database.cid(right)}
+    assert all(len(row) == 0 for row in database.shards[1].dependencies.values())
+    assert database.query(compatible_with=[left]) == set()
+    database.update_compatibility(right, left)
+    assert database.query(compatible_with=[left]) == {right}
+
+
+def test_same_answers_as_source():
+    reference = source()
+    database = ShardedDatabase(None, shards=4)
+    database.import_database(reference)
+    components = list(reference.inventory)
+    for (first, second) in itertools.product(components, repeat=2):
+        assert database.compatibility(first, second) == reference.compatibility(first, second)
+    for part in components[::7]:
+        assert database.common_compatible([part]) == reference.common_compatible([part])
+
+
+def test_layout_is_fixed(tmp_path):
+    directory = str(tmp_path / 'shards')
+    database = ShardedDatabase(directory, shards=3, placement={'Maker0': 1})
+    database.init_from_file()
+    database.import_database(source())
+    expected = {component: database.cid(component) for component in database.inventory}
+    database.close()
+
+    with pytest.raises(ValueError):
+        ShardedDatabase(directory, shards=4)
+    with pytest.raises(ValueError):
+        ShardedDatabase(directory, shards=3, placement={'Maker0': 2})
+    with pytest.raises(ValueError):
+        ShardedDatabase(None, shards=3, placement={'Maker0': 3})
+
+    # the layout comes from the directory, the IDs are the same after reopening
+    reopened = ShardedDatabase(directory, shards=3)
+    reopened.init_from_file()
+    assert reopened.placement == {'Maker0': 1}
+    assert {component: reopened.cid(component) for component in reopened.inventory} == expected
+    reopened.close()
+
+
+def test_rules_not_imported():
+    reference = source()
+    reference.add_rule({'comp_type': Component_Type.Extra}, {'comp_type': Component_Type.Body})
+    with pytest.warns(UserWarning, match='not copied'):
+        ShardedDatabase(None, shards=2).import_database(reference)
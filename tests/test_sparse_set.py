@@ -0,0 +1,104 @@
+import pickle
+import random
+import pytest
+import SparseSet as sparse_module
+from SparseSet import SparseSet, encode_deltas, decode_deltas
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+SparseSet behaves like the frozenset rows it replaces, in both containers, with and without numpy
+'''
+
+CASES = {
+    'empty': [],
+    'single': [7],
+    'sparse': [3, 1000, 70000, 2 ** 31 + 5],
+    'dense': list(range(100, 400)) + [402, 405],
+    'random': random.Random(0).sample(range(5000), 700),
+}
+
+
+@pytest.fixture(params=['numpy', 'plain'])
+def numpy_mode(request, monkeypatch):
+    if request.param == 'plain':
+        monkeypatch.setattr(sparse_module, 'np', None)
+    elif sparse_module.np is None:
+        pytest.skip('numpy is not installed')
+    return request.param
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_set_behaviour(numpy_mode, name):
+    values = CASES[name]
+    row = SparseSet(values)
+    expected = frozenset(values)
+
+    assert len(row) == len(expected)
+    assert list(row) == sorted(expected)
+    assert [int(value) for value in row.values()] == sorted(expected)
+    assert row == expected and expected == row
+    assert hash(row) == hash(expected)
+    for value in list(expected)[:50] + [-1, 6, 2 ** 32 + 1, 'x']:
+        assert (value in row) == (value in expected)
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_set_operations(numpy_mode, name):
+    values = CASES[name]
+    other = [value + 1 for value in values[::2]] + [5, 101]
+    row = SparseSet(values)
+
+    for operand in (SparseSet(other), set(other), other):
+        assert row.intersection(operand) == frozenset(values) & frozenset(other)
+        assert row.union(operand) == frozenset(values) | frozenset(other)
+    assert (row & SparseSet(other)) == frozenset(values) & frozenset(other)
+    assert (row | SparseSet(other)) == frozenset(values) | frozenset(other)
+    assert row.union(values[:3]) is row
+    assert row.issuperset(values[:5]) and row.issubset(set(values) | {1})
+    assert row.isdisjoint([-5]) and (not values or not row.isdisjoint(values[:1]))
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_encoding_round_trip(numpy_mode, name):
+    row = SparseSet(CASES[name])
+    assert SparseSet.from_bytes(row.to_bytes()) == row
+    assert pickle.loads(pickle.dumps(row)) == row
+    values = sorted(set(CASES[name]))
+    assert [int(value) for value in decode_deltas(encode_deltas(values))] == values
+
+
+def test_containers():
+    assert SparseSet(range(0, 6400, 64))._items is not None
+    dense = SparseSet(range(1000, 2000))
+    assert dense._items is None and dense._base == 1000
+    assert len(dense.to_bytes()) < 200
+
+
+def test_encodings_agree(monkeypatch):
+    if sparse_module.np is None:
+        pytest.skip('numpy is not installed')
+    values = sorted(random.Random(1).sample(range(2 ** 32), 300))
+    with_numpy = encode_deltas(values)
+    monkeypatch.setattr(sparse_module, 'np', None)
+    assert encode_deltas(values) == with_numpy
+    assert decode_deltas(with_numpy) == values
+
+
+def test_compact_database_round_trip(tmp_path):
+    files = (str(tmp_path / 'inventory.pkl'), str(tmp_path / 'dependency.pkl'))
+    database = CompatibilityDatabase(*files, wal_file=str(tmp_path / 'dependency.wal'), compact=True)
+    database.default_init()
+    radio = Extra('Compact_radio', 'Radio', 'Compact')
+    database.add_component(radio, {0, 1})
+    database.update_compatibility(database.id_chart[2], radio)
+    assert all(isinstance(row, SparseSet) for row in database.dependencies.values())
+    rows = {comp_id: frozenset(row) for (comp_id, row) in database.dependencies.items()}
+    database.close()
+
+    for compact in (True, False):
+        reopened = CompatibilityDatabase(*files, wal_file=str(tmp_path / 'dependency.wal'), compact=compact)
+        reopened.init_from_file()
+        assert {comp_id: frozenset(row) for (comp_id, row) in reopened.dependencies.items()} == rows
+        assert all(isinstance(row, SparseSet) == compact for row in reopened.dependencies.values())
+        reopened.close()
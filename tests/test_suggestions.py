@@ -0,0 +1,136 @@
+import itertools
+import random
+import CatalogGenerator
+from Builder import Builder, repeated_types
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+suggest_resolve: minimal repairs, candidates that can complete them, and a stable ranking
+'''
+
+
+def catalog(edges: list) -> CompatibilityDatabase:
+    """
+    :param edges: (component, compatible components) pairs, every edge goes both ways
+    :return: in-memory database holding them
+    """
+    database = CompatibilityDatabase(None, None)
+    database.bulk_add(edges, symmetric=True)
+    return database
+
+
+def test_repairs_are_minimal():
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    components = list(database.inventory)
+    by_type = dict()
+    for component in components:
+        by_type.setdefault(component.comp_type, []).append(component)
+    failing = 0
+    for build in itertools.product(*by_type.values()):
+        builder = Builder('test', database)
+        if builder.build(set(build)):
+            continue
+        failing += 1
+        smallest = None
+        for size in range(1, len(build) + 1):
+            for swap in itertools.combinations(build, size):
+                kept = set(build) - set(swap)
+                options = [[other for other in by_type[part.comp_type] if other != part] for part in swap]
+                if any(Builder('check', database).build(kept | set(choice)) for choice in itertools.product(*options)):
+                    smallest = size
+                    break
+            if smallest is not None:
+                break
+        assert [len(repair) for repair in builder.repairs] == [smallest] * len(builder.repairs)
+        # every suggestion completes a repair together with suggestions for the other swapped parts
+        for repair in builder.repairs:
+            kept = set(build) - repair
+            for part in repair:
+                others = [builder.suggestions[other] for other in repair if other != part]
+                for candidate in builder.suggestions[part]:
+                    assert any(Builder('check', database).build(kept | {candidate} | set(choice))
+                               for choice in itertools.product(*others))
+    assert failing > 0
+
+
+def test_single_swap_ranked_by_likeness():
+    body = Body('Body', Structure.Sedan, 'Z')
+    engine = Engine('Engine', Engine_Mechanism.Gas, 'Z')
+    # one engine shares the row of the engine it replaces, one shares nothing, the twins only differ in their maker
+    like = Engine('Like', Engine_Mechanism.Gas, 'Z')
+    unlike = Engine('Unlike', Engine_Mechanism.Gas, 'Z')
+    twin_b = Engine('Twin', Engine_Mechanism.Gas, 'B')
+    twin_a = Engine('Twin', Engine_Mechanism.Gas, 'A')
+    shared = [Extra('Shared' + str(number), 'Radio', 'Z') for number in range(40)]
+    other = [Extra('Other' + str(number), 'Radio', 'Z') for number in range(40)]
+    database = catalog([(body, [])] + [(extra, []) for extra in shared + other] +
+                       [(engine, shared), (like, [body] + shared), (unlike, [body] + other),
+                        (twin_b, [body]), (twin_a, [body])])
+
+    builder = Builder('test', database)
+    assert not builder.build({body, engine})
+    assert builder.repairs == [frozenset({engine})]
+    ranked = builder.suggestions[engine]
+    assert ranked[0] == like
+    assert ranked.index(twin_a) + 1 == ranked.index(twin_b)
+    assert set(ranked) == {like, unlike, twin_a, twin_b}
+
+
+def test_multi_swap_ranked_by_fit():
+    body = Body('Body', Structure.Sedan, 'Z')
+    engine = Engine('Engine', Engine_Mechanism.Gas, 'Z')
+    battery = Battery('Battery', 'Z')
+    (wide, narrow, alone) = (Engine('Wide', Engine_Mechanism.Gas, 'Z'), Engine('Narrow', Engine_Mechanism.Gas, 'Z'),
+                             Engine('Alone', Engine_Mechanism.Gas, 'Z'))
+    (popular, rare) = (Battery('Usual', 'Z'), Battery('Rare', 'Z'))
+    # the only body fits neither the engine nor the battery, both have to go
+    database = catalog([(body, []), (engine, [battery]), (battery, []),
+                        (rare, [body]), (popular, [body]),
+                        (narrow, [body, popular]), (wide, [body, popular, rare]), (alone, [body])])
+
+    builder = Builder('test', database)
+    assert not builder.build({body, engine, battery})
+    assert builder.repairs == [frozenset({engine, battery})]
+    # ranked by how many replacements of the other part fit, not by name or ID; an engine fitting none is left out
+    assert builder.suggestions[engine] == [wide, narrow]
+    assert builder.suggestions[battery] == [popular, rare]
+
+
+def test_ranking_is_stable():
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    components = sorted(database.inventory, key=database.cid)
+    for build in itertools.combinations(components, 4):
+        if repeated_types(build):
+            continue
+        first = Builder('test', database)
+        if first.build(set(build)):
+            continue
+        second = Builder('test', database)
+        second.build(set(reversed(build)))
+        assert first.suggestions == second.suggestions
+        assert first.repairs == second.repairs
+
+
+def test_same_order_in_catalog(tmp_path):
+    database = CompatibilityDatabase(None, None)
+    CatalogGenerator.populate(database, manufacturers=3, density=0.5, symmetric=False, seed=4)
+    database.write_catalog(str(tmp_path / 'catalog.cat'))
+    # the catalog numbers components by key, not in the order they were added
+    mapped = CompatibilityDatabase(None, None)
+    mapped.init_from_catalog(str(tmp_path / 'catalog.cat'))
+    assert [mapped.cid(comp) for comp in database.id_chart] != list(range(len(database.id_chart)))
+
+    rng = random.Random(4)
+    by_type = dict()
+    for component in database.inventory:
+        by_type.setdefault(component.comp_type, []).append(component)
+    for _ in range(100):
+        build = {rng.choice(parts) for parts in by_type.values()}
+        (first, second) = (Builder('test', database), Builder('test', mapped))
+        assert first.build(build) == second.build(build)
+        assert first.repairs == second.repairs
+        assert first.suggestions == second.suggestions
+    mapped.catalog.close()
@@ -0,0 +1,152 @@
+import os
+import shutil
+import pytest
+from CompatibilityDatabase import CompatibilityDatabase
+from Components import *
+
+'''
+Write-ahead log: what is logged comes back after a crash, with or without a snapshot in between
+'''
+
+
+def open_database(directory, **kwargs) -> CompatibilityDatabase:
+    """
+    :return: database over the files in directory, not loaded yet
+    """
+    return CompatibilityDatabase(str(directory / 'inventory.pkl'), str(directory / 'dependency.pkl'),
+                                 wal_file=str(directory / 'dependency.wal'), **kwargs)
+
+
+def reopen(directory, **kwargs) -> CompatibilityDatabase:
+    """
+    :return: database loaded from the snapshot and log in directory
+    """
+    database = open_database(directory, **kwargs)
+    database.init_from_file()
+    return database
+
+
+def crash(database: CompatibilityDatabase):
+    """
+    stops a database the way a killed process would, without writing a snapshot
+    """
+    database.initialized = False
+    database._stop.set()
+    database.write_thread.join()
+    if database._wal is not None:
+        database._wal.close()
+        database._wal = None
+
+
+def state(database: CompatibilityDatabase) -> tuple:
+    """
+    :return: what a database answers, by uuid so that it compares across instances
+    """
+    uuids = list(database.uuids)
+    components = {uuids[comp_id]: database.id_chart[comp_id] for comp_id in range(len(uuids))}
+    compatible = {(uuids[first], uuids[second]) for first in range(len(uuids)) for second in range(len(uuids))
+                  if database.compatible_ids(first, second)}
+    return components, compatible
+
+
+def mutate(database: CompatibilityDatabase) -> list:
+    """
+    applies one change of every kind that is logged
+    :return: the components added
+    """
+    radio = Extra('Wal_radio', 'Radio', 'Wal')
+    horn = Extra('Wal_horn', 'Horn', 'Wal')
+    body = Body('Wal_body', Structure.Sedan, 'Wal')
+    database.add_component(radio, set(range(3)))
+    database.update_compatibility(database.id_chart[0], radio)
+    database.bulk_add([(horn, [radio, database.id_chart[1]]), (body, [horn])])
+    database.add_rule({'comp_type': Component_Type.Wheels}, {'manufacturer': 'Wal'})
+    database.exclude_compatibility(radio, database.id_chart[2])
+    return [radio, horn, body]
+
+
+@pytest.mark.parametrize('undirected', [False, True])
+def test_replay_after_crash(tmp_path, undirected):
+    database = open_database(tmp_path, undirected=undirected)
+    database.default_init()
+    added = mutate(database)
+    expected = state(database)
+    crash(database)
+    assert os.path.getsize(tmp_path / 'dependency.wal') > 0
+
+    recovered = reopen(tmp_path, undirected=undirected)
+    assert state(recovered) == expected
+    assert all(component in recovered.inventory for component in added)
+    recovered.close()
+
+
+def test_snapshot_trims_log(tmp_path):
+    database = open_database(tmp_path)
+    database.default_init()
+    mutate(database)
+    expected = state(database)
+    database.write_state_to_disk()
+    assert os.path.getsize(tmp_path / 'dependency.wal') == 0
+    assert database.dirty == 0
+    crash(database)
+
+    recovered = reopen(tmp_path)
+    assert state(recovered) == expected
+    recovered.close()
+
+
+def test_replay_is_idempotent(tmp_path):
+    database = open_database(tmp_path)
+    database.default_init()
+    mutate(database)
+    expected = state(database)
+    # a crash between writing the snapshot and trimming the log replays records the snapshot holds
+    shutil.copy(tmp_path / 'dependency.wal', tmp_path / 'old.wal')
+    database.write_state_to_disk()
+    crash(database)
+    shutil.copy(tmp_path / 'old.wal', tmp_path / 'dependency.wal')
+
+    recovered = reopen(tmp_path)
+    assert state(recovered) == expected
+    recovered.close()
+
+
+def test_torn_record_is_cut_off(tmp_path):
+    database = open_database(tmp_path)
+    database.default_init()
+    database.add_component(Extra('Kept_radio', 'Radio', 'Wal'), {0})
+    kept = state(database)
+    good = os.path.getsize(tmp_path / 'dependency.wal')
+    database.add_component(Extra('Torn_radio', 'Radio', 'Wal'), {0})
+    crash(database)
+    # the process died in the middle of appending the second record
+    os.truncate(tmp_path / 'dependency.wal', os.path.getsize(tmp_path / 'dependency.wal') - 5)
+
+    with pytest.warns(UserWarning, match='torn record'):
+        recovered = reopen(tmp_path)
+    assert state(recovered) == kept
+    assert os.path.getsize(tmp_path / 'dependency.wal') == good
+
+    # the log goes on after the cut
+    recovered.add_component(Extra('Next_radio', 'Radio', 'Wal'), {1})
+    expected = state(recovered)
+    crash(recovered)
+    again = reopen(tmp_path)
+    assert state(again) == expected
+    again.close()
+
+
+def test_no_files_no_snapshot(tmp_path):
+    database = CompatibilityDatabase(None, None)
+    database.default_init()
+    database.add_component(Extra('Memory_radio', 'Radio', 'Wal'), {0})
+    assert database.dirty > 0
+    assert not database.needs_snapshot()
+    database.close()
+
+    database = open_database(tmp_path)
+    database.default_init()
+    database.add_component(Extra('File_radio', 'Radio', 'Wal'), {0})
+    database.compact_every = 1
+    assert database.needs_snapshot()
+    database.close()